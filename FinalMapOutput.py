@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+import os
+import re
+from libs.config_reader import ConfigParser
+from libs.map_rendering import QuicklookRenderer, create_map_title
+from libs.profiling import span
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+# the renderer of the current process, created once per worker #
+_renderer = None
+
+
+def initialize_renderer(color_classes, overlay_file, scale):
+    """
+    This function creates the renderer of a worker process
+    """
+    global _renderer
+    _renderer = QuicklookRenderer(color_classes, overlay_file, scale)
+
+
+def render_map(task):
+    """
+    This function renders a single map with the renderer of the current process
+    Args:
+        task (tuple): the GeoTiff, PNG and title of the map
+
+    Returns:
+        Integer number of grid cells rendered
+    """
+    tif_file, png_file, title = task
+    return _renderer.render(tif_file, png_file, title)
+
+
+class QuicklookMaps:
+    """
+    This is the core processing class for rendering the PNG maps of the STEP_0303 GeoTiffs
+        It replaces the ArcGIS map scripts (FinalMapOutput-ESRI.py and FinalMapOutput-POR-ESRI.py) on any platform
+    """
+    def __init__(self, mode, scale):
+        self.__config = ConfigParser()
+        self.__mode = mode
+        self.__scale = scale
+        self.__region = self.__config.get('region_name')
+        self.__geotiff_dir = self.__config.get('geotiff_dir').replace("\\", '/')
+        self.__export_dir = self.__config.get('map_export_dir').replace("\\", '/')
+        self.__color_classes = self.__config.get('map_colors')
+        self.__overlay_file = self.__config.get('map_overlay').replace("\\", '/')
+        self.__parameters = ['cdi', 'lst', 'ndvi', 'spi', 'sm']
+
+    def get_maps_to_render(self):
+        """
+        This function finds the monthly GeoTiffs of each parameter that need a map
+            In 'updates' mode a map is only rendered again when its GeoTiff is newer than the PNG
+        Returns:
+            List of (GeoTiff, PNG, title) tuples
+        """
+        tasks = []
+        for parameter in self.__parameters:
+            tif_dir = os.path.join(self.__geotiff_dir, parameter.upper())
+            if not os.path.isdir(tif_dir):
+                continue
+            pattern = re.compile(r'^STEP_0303_{}_pct_rank_{}_(\d{{6}})\.tif$'.format(parameter.upper(),
+                                                                                   re.escape(self.__region)))
+            for filename in sorted(os.listdir(tif_dir)):
+                match = pattern.match(filename)
+                if match is None:
+                    continue
+                date_string = match.group(1)
+                tif_file = os.path.join(tif_dir, filename)
+                png_file = os.path.join(self.__export_dir, parameter.upper(), 'png',
+                                        "{}_{}_{}.png".format(self.__region, parameter.upper(), date_string))
+                # skip the maps whose GeoTiff is unchanged #
+                if self.__mode != 'all' and os.path.isfile(png_file) and \
+                        os.path.getmtime(png_file) >= os.path.getmtime(tif_file):
+                    continue
+                tasks.append((tif_file, png_file, create_map_title(self.__region, parameter, date_string)))
+        return tasks
+
+    def render(self, tasks, processes=1):
+        """
+        This function renders the maps, on a pool of processes when more than one is requested
+        Args:
+            tasks (list): the (GeoTiff, PNG, title) tuples of the maps
+            processes (int): the number of maps to render at the same time
+
+        Returns:
+            Integer number of maps rendered
+        """
+        settings = (self.__color_classes, self.__overlay_file, self.__scale)
+        with span('render', maps=len(tasks), processes=processes) as s:
+            if processes > 1 and len(tasks) > 1:
+                with ProcessPoolExecutor(max_workers=processes, initializer=initialize_renderer,
+                                         initargs=settings) as executor:
+                    for pixels in executor.map(render_map, tasks, chunksize=max(len(tasks) // (processes * 4), 1)):
+                        s.add_pixels(pixels)
+            else:
+                initialize_renderer(*settings)
+                for task in tasks:
+                    s.add_pixels(render_map(task))
+        return len(tasks)
+
+
+def main(args):
+    """
+    This is the main entry point for the program
+    """
+    mode = str(args.mode)
+    script_start = datetime.now()
+    try:
+        with span('step', step='maps'):
+            maps = QuicklookMaps(mode, args.scale)
+            tasks = maps.get_maps_to_render()
+            print("Rendering {} map(s)...".format(len(tasks)))
+            maps.render(tasks, args.processes)
+    except IOError as ioe:
+        print(ioe)
+    except Exception as ex:
+        print(ex)
+    finally:
+        script_end = datetime.now()
+        print("Script execution: {}".format(script_end - script_start))
+
+
+if __name__ == '__main__':
+    # set up the command line argument parser
+    parser = ArgumentParser()
+    parser.add_argument("-m", "--mode", default="updates",
+                        help="The maps to render: updates (new or changed GeoTiffs) or all. Default is updates")
+    parser.add_argument("-s", "--scale", default=8, type=int,
+                        help="The number of map pixels per 0.05 degree grid cell. Default is 8")
+    parser.add_argument("-p", "--processes", default=os.cpu_count() or 1, type=int,
+                        help="The number of maps to render at the same time. Default is the number of CPUs")
+    # execute the program with the supplied options
+    main(parser.parse_args())
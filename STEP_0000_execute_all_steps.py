@@ -1,18 +1,10 @@
 # -*- coding: utf-8 -*-
-import time
-
-from netCDF4 import Dataset
-from STEP_0101_read_hdf_create_LST_anom_netcdf import main as step_0101
-from STEP_0102_read_hdf_create_NDVI_anom_netcdf import main as step_0102
-from STEP_0103_read_chirps_create_precip_netcdf_and_spi_netcdf import main as step_0103
-# from STEP_0104_create_5km_soil_moisture_netcdf import main as step_0104
-from STEP_0201_percent_rank_LST_anom_netcdf import main as step_0201
-from STEP_0202_percent_rank_NDVI_anom_netcdf import main as step_0202
-from STEP_0203_percent_rank_SPI_anom import main as step_0203
-# from STEP_0204_percent_rank_soil_moisture_netcdf import main as step_0204
-from STEP_0301_CDI_weighted_sum import main as step_0301
-from STEP_0302_percent_rank_CDI_weighted_sum import main as step_0302
-from STEP_0303_export_ranking_data_rasters import main as step_0303
+import os
+import sys
+from libs.config_reader import ConfigParser, get_aoi_file, get_zone_file
+from libs.pipeline import FileSet, PipelineStep, PipelineRunner
+import libs.profiling as profiling
+from libs.date_range import DateRange, add_arguments as add_date_range_arguments
 from argparse import ArgumentParser
 
 """
@@ -26,28 +18,156 @@ Packages:
 """
 
 
-def log_time(step_name, func, *args):
-    start_time = time.time()
-    print(f"Executing {step_name}...")
-    func(*args)
-    end_time = time.time()
-    elapsed_time = end_time - start_time
-    print(f"{step_name} completed in {elapsed_time:.2f} seconds.\n")
+def build_steps(config):
+    """
+    This function declares the pipeline steps with the files each step reads and writes
+        The step modules are only imported when a step needs to run
+    Args:
+        config (ConfigParser): the project configuration
+
+    Returns:
+        List of PipelineStep objects in execution order
+    """
+    region = config.get('region_name')
+    output_dir = config.get('output_dir').replace("\\", '/')
+    scratch_dir = config.get('scratch_dir').replace("\\", '/')
+    geotiff_dir = config.get('geotiff_dir').replace("\\", '/')
+    patterns = config.get('file_patterns')
+    weights = config.get('cdi_parameters', 'weights')
+    project_settings = './cdi_project_settings.conf'
+
+    def output_file(name):
+        return os.path.join(output_dir, name.format(region))
+
+    def working_files(sub_dir, prefix):
+        return FileSet('{}/{}'.format(scratch_dir, sub_dir), "{}_{}_((?:19|20)\\d\\d)(0[1-9]|1[0-2])\\.nc".format(prefix, region))
+
+    ranking_files = {
+        "lst": output_file("STEP_0201_LST_anomaly_pct_rank_{}.nc"),
+        "ndvi": output_file("STEP_0202_NDVI_anomaly_pct_rank_{}.nc"),
+        "spi": output_file("STEP_0203_SPI_anomaly_pct_rank_{}.nc"),
+        "sm": output_file("STEP_0204_SM_pct_rank_{}.nc")
+    }
+    # the inputs of the CDI and of its weight scenarios #
+    scenario_weights = [weights] + list(config.get('cdi_parameters').get('scenarios', {}).values())
+    cdi_inputs = [ranking_files[p] for p in ranking_files if any(w.get(p, 0) > 0 for w in scenario_weights)]
+    soil_moisture = any(w.get('sm', 0) > 0 for w in scenario_weights)
+    zone_file = get_zone_file(config)
+    # the steps that compute on the cells of the AOI run again when the AOI file changes #
+    aoi_file = get_aoi_file(config)
+    aoi_inputs = [aoi_file] if aoi_file != '' else []
+    zone_tables = [output_file("STEP_0304_{}_zonal_statistics_{{}}.csv".format(p.upper()))
+                   for p in ['cdi'] + [p for p in ranking_files if weights[p] > 0]]
+
+    return [
+        PipelineStep(
+            '0101', 'STEP_0101_read_hdf_create_LST_anom_netcdf',
+            inputs=[project_settings, FileSet(config.get('raw_data_dirs', 'lst_hdf'), patterns['lst_hdf_regex'])] + aoi_inputs,
+            outputs=[output_file("STEP_0101_LST_anomaly_{}.nc")],
+            pass_args=True
+        ),
+        PipelineStep(
+            '0102', 'STEP_0102_read_hdf_create_NDVI_anom_netcdf',
+            inputs=[project_settings, FileSet(config.get('raw_data_dirs', 'ndvi_hdf'), patterns['ndvi_hdf_regex'])] + aoi_inputs,
+            outputs=[output_file("STEP_0102_NDVI_anomaly_{}.nc")],
+            pass_args=True
+        ),
+        PipelineStep(
+            '0103', 'STEP_0103_read_chirps_create_precip_netcdf_and_spi_netcdf',
+            inputs=[project_settings, FileSet(config.get('raw_data_dirs', 'chirps_tif'), patterns['chirps_tif_regex'])] + aoi_inputs,
+            outputs=[output_file("STEP_0103_SPI_anomaly_{}.nc")],
+            pass_args=True
+        ),
+        PipelineStep(
+            '0104', 'STEP_0104_create_5km_soil_moisture_netcdf',
+            inputs=[project_settings, FileSet(config.get('raw_data_dirs', 'fldas_data'), patterns['fldas_data_regex'])],
+            outputs=[working_files('SM', 'STEP_0104_SM')],
+            pass_args=True,
+            enabled=soil_moisture
+        ),
+        PipelineStep(
+            '0201', 'STEP_0201_percent_rank_LST_anom_netcdf',
+            inputs=[output_file("STEP_0101_LST_anomaly_{}.nc")],
+            outputs=[ranking_files['lst']],
+            depends=('0101',),
+            pass_args=True
+        ),
+        PipelineStep(
+            '0202', 'STEP_0202_percent_rank_NDVI_anom_netcdf',
+            inputs=[output_file("STEP_0102_NDVI_anomaly_{}.nc")],
+            outputs=[ranking_files['ndvi']],
+            depends=('0102',),
+            pass_args=True
+        ),
+        PipelineStep(
+            '0203', 'STEP_0203_percent_rank_SPI_anom',
+            inputs=[output_file("STEP_0103_SPI_anomaly_{}.nc")],
+            outputs=[ranking_files['spi']],
+            depends=('0103',),
+            pass_args=True
+        ),
+        PipelineStep(
+            '0204', 'STEP_0204_percent_rank_soil_moisture_netcdf',
+            inputs=[working_files('SM', 'STEP_0104_SM')] + aoi_inputs,
+            outputs=[ranking_files['sm']],
+            depends=('0104',),
+            pass_args=True,
+            enabled=soil_moisture
+        ),
+        PipelineStep(
+            '0301', 'STEP_0301_CDI_weighted_sum',
+            inputs=[project_settings] + cdi_inputs,
+            outputs=[output_file("STEP_0301_CDI_weighted_sum_{}.nc")],
+            depends=('0201', '0202', '0203', '0204'),
+            pass_args=True
+        ),
+        PipelineStep(
+            '0302', 'STEP_0302_percent_rank_CDI_weighted_sum',
+            inputs=[output_file("STEP_0301_CDI_weighted_sum_{}.nc")],
+            outputs=[output_file("STEP_0302_CDI_pct_rank_{}.nc")],
+            depends=('0301',),
+            pass_args=True
+        ),
+        PipelineStep(
+            '0303', 'STEP_0303_export_ranking_data_rasters',
+            inputs=[output_file("STEP_0302_CDI_pct_rank_{}.nc")] + cdi_inputs,
+            outputs=[FileSet('{}/CDI'.format(geotiff_dir), "STEP_0303_CDI_pct_rank_{}_\\d{{6}}\\.tif".format(region))],
+            depends=('0302',),
+            pass_args=True
+        ),
+        PipelineStep(
+            '0304', 'STEP_0304_zonal_statistics',
+            inputs=[project_settings, zone_file, output_file("STEP_0302_CDI_pct_rank_{}.nc")] + cdi_inputs,
+            outputs=zone_tables,
+            depends=('0302',),
+            pass_args=True,
+            enabled=zone_file != ''
+        )
+    ]
 
 
 def main(args):
-    log_time("Step 0101", step_0101, args)
-    log_time("Step 0102", step_0102, args)
-    log_time("Step 0103", step_0103, args)
-    # log_time("Step 0104", step_0104, args)
-    log_time("Step 0201", step_0201)
-    log_time("Step 0202", step_0202)
-    log_time("Step 0203", step_0203)
-    # log_time("Step 0204", step_0204)
-    log_time("Step 0301", step_0301)
-    log_time("Step 0302", step_0302)
-    log_time("Step 0303", step_0303, args)
+    config = ConfigParser()
+    if args.profile is not None:
+        # the report location is passed to the step processes through the environment #
+        profiling.enable(args.profile, args.profile_memory)
+    state_file = os.path.join(config.get('scratch_dir').replace("\\", '/'), 'pipeline_state.json')
+    try:
+        runner = PipelineRunner(build_steps(config), state_file, args.fingerprint)
+        # reprocessing all data, or a range of months, implies running every step #
+        force = args.force or str(args.mode) == 'all' or DateRange.from_args(args).is_set
+        executed = runner.run(args, force, args.until, args.jobs, args.step)
+    except ValueError as ve:
+        # an unknown step name, or an invalid date range #
+        print(ve)
+        return 1
+    if len(runner.failed) > 0:
+        print("Steps not completed: {}".format(", ".join(runner.failed)))
+        return 1
+    if len(executed) == 0:
+        print("All steps are up to date")
     print("Finished processing CDI data")
+    return 0
 
 
 if __name__ == '__main__':
@@ -55,5 +175,23 @@ if __name__ == '__main__':
     parser = ArgumentParser()
     parser.add_argument("-m", "--mode", default="updates",
                         help="The mode of the current processing: updates or all. Default is updates")
+    parser.add_argument("-f", "--force", action="store_true",
+                        help="Run every step, even if its inputs and outputs are unchanged since the last run")
+    parser.add_argument("-u", "--until", default=None,
+                        help="The last step to run, e.g. 0201. Default is to run all steps")
+    parser.add_argument("-s", "--step", action="append", default=None,
+                        help="Only run the named step; repeat to run several, e.g. --step 0201 --step 0302. "
+                             "Only the modules of the selected steps are imported. Default is to run all steps")
+    parser.add_argument("-j", "--jobs", default=1, type=int,
+                        help="The maximum number of steps to run at the same time; independent branches "
+                             "(LST, NDVI, SPI, soil moisture) run in separate processes. Default is 1")
+    parser.add_argument("--fingerprint", default="mtime", choices=["mtime", "content"],
+                        help="How changes to the step files and to the raw files are detected: mtime (size and "
+                             "modification time) or content (file checksum). Default is mtime")
+    parser.add_argument("--profile", default=None,
+                        help="Path of a JSON-lines report to append the per-stage timing, memory and throughput spans to")
+    parser.add_argument("--profile-memory", action="store_true",
+                        help="Also trace the peak Python memory allocations of each span (slower)")
+    add_date_range_arguments(parser)
     # execute the programs with the supplied options
-    main(parser.parse_args())
+    sys.exit(main(parser.parse_args()))
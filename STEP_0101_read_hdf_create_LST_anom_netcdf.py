@@ -1,11 +1,20 @@
 # -*- coding: utf-8 -*-
 import os
-import subprocess
+import sys
 from libs.config_reader import ConfigParser
 from libs.file_operations import FileHandler
 from libs.subgrid_calculations import HDFSubGrid
+from libs.hdf_conversion import HDFConverter
+from libs.pipeline import fingerprint_file
+from libs.change_tracking import set_source, is_source_changed, get_file_fingerprints, read_fingerprints, \
+    set_fingerprints, get_update_range
+from libs.qc_decoding import QCFilter
 from libs.statistics_operations import StatisticOperations
+from libs.aoi_mask import get_aoi_mask
 import libs.netcdf_functions as netcdf
+from libs.time_index import TimeIndex
+from libs.profiling import span
+from libs.date_range import DateRange, add_arguments as add_date_range_arguments
 from argparse import ArgumentParser
 import numpy as np
 import numpy.ma as ma
@@ -17,7 +26,12 @@ class LandSurfaceTemp:
     """
     This is the core processing class for executing all Land-Surface Temperature operations
     """
-    def __init__(self):
+    def __init__(self, fingerprint_method='mtime'):
+        """
+        Args:
+            fingerprint_method (str): how reprocessed raw files are detected: 'mtime' (size and modification time)
+                or 'content' (file checksum)
+        """
         self.__config = ConfigParser()
         self.__raw_data_dir = self.__config.get('raw_data_dirs', 'lst_hdf').replace("\\", '/')
         self.__working_dir = self.__config.get('scratch_dir').replace("\\", '/') + '/LST'
@@ -37,6 +51,19 @@ class LandSurfaceTemp:
         self.__latitudes = self.__config.get('latitudes')
         self.__longitudes = self.__config.get('longitudes')
         self.__missing = -9999.0
+        # the cells of the area of interest within the bounds #
+        self.__aoi = get_aoi_mask(self.__config)
+        self.__qc_filter = QCFilter('lst', self.__config.get('qc_rules', 'lst'))
+        conversion = self.__config.get('hdf_conversion')
+        self.__conversion_mode = conversion['mode']
+        self.__converter = HDFConverter(
+            raw_data_dir=self.__raw_data_dir,
+            converted_dir=self.__config.get('scratch_dir').replace("\\", '/') + '/HDF5/LST',
+            converter=conversion['converter'],
+            jobs=conversion['jobs'],
+            keep_originals=conversion['keep_originals']
+        )
+        self.__fingerprint_method = fingerprint_method
         self.netcdf_files = []
 
     def __get_hdf_date(self, file_name):
@@ -72,81 +99,56 @@ class LandSurfaceTemp:
         time_delta = test_date - origin_date
         return int(time_delta.days)
 
-    def __get_calendar_times(self, files):
-        """
-        This function builds a list of the valid times as days since Jan 1, 1900
-        Args:
-            files: list of the HDF file names as strings
-
-        Returns:
-            List (floats) of the valid times as number of days since Jan 1, 1900
-        """
-        origin_date = date(1900, 1, 1)
-        times = []
-        for f in files:
-            (year, month) = self.__working_file_match.match(f).groups()
-            test_date = date(int(year), int(month), 1)
-            time_delta = test_date - origin_date
-            times.append(float(time_delta.days))
-        return times
-
-    def __get_lst_files_by_month(self, month):
-        """
-        This function reads the working data directory to find available files to process by month
-        Returns:
-            List of fully-qualified names
-        """
-        results = []
-        try:
-            test_pattern = self.__file_patterns['lst_netcdf_regex'].split('(0')[0] + str(month) + "\\.nc"
-            file_test = re.compile(r'{}'.format(test_pattern))
-
-            results = [
-                '{}/{}'.format(self.__working_dir, f) for f in sorted(os.listdir(self.__working_dir))
-                if file_test.match(f)
-            ]
-        except IOError as ioe:
-            print(ioe)
-        except Exception as ex:
-            print(ex)
-        finally:
-            return results
-
     def convert_h4_to_h5(self):
         """
+        This function converts the HDF4 files to HDF5 on a pool of workers, skipping the files converted before
+            In 'direct' mode nothing is converted and the HDF4 files are read through GDAL
 
         Returns:
-
+            List of the names of the converted files
         """
         try:
+            if self.__conversion_mode == 'direct':
+                return []
             raw_files = self.__fileHandler.get_raw_file_names('lst_hdf_regex')
-            for f in raw_files:
-                if f.find("_h5") < 0:
-                    raw_file_path = "{}/{}".format(self.__raw_data_dir, f)
-                    file_name = raw_file_path.split('.hdf')[0]
-                    h5_path = file_name + '_h5.hdf'
-                    subprocess.run('./libs/h4toh5convert {} {}'.format(raw_file_path, h5_path), shell=True, check=True)
-                    os.remove(raw_file_path)
-
+            return self.__converter.convert(raw_files)
         except IOError:
             raise
         except Exception:
             raise
 
-    def get_files_to_process(self, all_hdf=False):
+    def __is_raw_file_changed(self, file_name, working_file):
+        """
+        This function tests if a HDF file has been reprocessed (changed in place) since its NetCDF file was created
+        Args:
+            file_name (str): the name of the HDF file
+            working_file (str): the name of the NetCDF file
+
+        Returns:
+            Boolean flag
+        """
+        fingerprint = fingerprint_file("{}/{}".format(self.__raw_data_dir, file_name), self.__fingerprint_method)
+        return is_source_changed(os.path.join(self.__working_dir, working_file), file_name, fingerprint)
+
+    def get_files_to_process(self, all_hdf=False, date_range=None):
         """
         This function gets the list of HDF files to convert to NetCDF subsets
         Args:
             all_hdf (boolean): optional flag to process all HDF files, even if NetCDF versions exist
+            date_range (DateRange): optional range of months; files within the range are processed again,
+                and 'all' is limited to the range
 
         Returns:
-            List of strings of the HDF file names
+            List of strings of the HDF file names; in updates mode the new files, the files within the date range,
+                and the files that have changed since their NetCDF file was created
         """
         files = []
         try:
             raw_files = sorted(self.__fileHandler.get_raw_file_names('lst_hdf_regex'), reverse=True)
-            if all_hdf:  # include all HDF files
-                files = raw_files
+            if date_range is None:
+                date_range = DateRange()
+            if all_hdf:  # include all HDF files within the date range
+                files = [f for f in raw_files if date_range.contains_date(self.__get_hdf_date(f))]
             else:  # determine which HDF files have not been converted to NetCDF
                 working_files = self.__fileHandler.get_working_file_names('lst_netcdf_regex')
                 # parse out the year/days from the file name #
@@ -156,7 +158,11 @@ class LandSurfaceTemp:
                         name = name.split('/')[1]
                     file_date = self.__get_hdf_date(name)
                     test_file = "STEP_0101_LST_{}_{}.nc".format(self.__region, file_date)
-                    if test_file not in working_files:
+                    # convert new files, and any files within the date range since they may have been reprocessed #
+                    if test_file not in working_files or (date_range.is_set and date_range.contains_date(file_date)):
+                        files.append(f)
+                    elif self.__is_raw_file_changed(f, test_file):
+                        # the HDF file has been reprocessed since the NetCDF file was created #
                         files.append(f)
         except IOError:
             raise
@@ -174,7 +180,7 @@ class LandSurfaceTemp:
         Returns:
             None: results are a NetCDF file created in the working directory for the particular year/month
         """
-        raw_file_path = "{}/{}".format(self.__raw_data_dir, file_name)
+        raw_file_path = self.__converter.get_read_path(file_name)
         file_date = self.__get_hdf_date(file_name)
         output_file = os.path.join(self.__working_dir, "STEP_0101_LST_{}_{}.nc".format(self.__region, file_date))
         output_data_set = None
@@ -187,27 +193,35 @@ class LandSurfaceTemp:
                 qc_day = sg.create_sub_grid('QC_Day')
                 qc_night = sg.create_sub_grid('QC_Night')
 
-            # compute the LST delta #
-            filtered_lst_day = ma.masked_where(np.logical_or(qc_day < 16, lst_day == 0), lst_day)
-            filtered_lst_night = ma.masked_where(np.logical_or(qc_night < 16, lst_night == 0), lst_night)
-            delta = np.ma.clip(np.ma.subtract(filtered_lst_day, filtered_lst_night), -40.0, 40.0)
-            lst_delta = np.round(delta.filled(self.__missing), 3)
-
-            # create the output file #
-            out_properties = {
-                'latitudes': self.__latitudes,
-                'longitudes': self.__longitudes,
-                'times': [self.__get_calendar_value(file_name)],
-                'time_units': 'days since 1900-01-01 00:00:00.0 UTC'
-            }
-            output_data_set = netcdf.initialize_dataset(output_file, out_properties)
-
-            # add LST delta to output data set #
-            lst_var = output_data_set.createVariable('LST_Delta', 'float32', ('time', 'latitude', 'longitude'))
-            lst_var.units = "K"
-            lst_var.missing_value = self.__missing
-            lst_var.long_name = "Monthly Land-surface Temperature Day-Night delta"
-            lst_var[0] = lst_delta
+            with span('qc', file=file_name) as s:
+                # compute the LST delta of the values accepted by the QC rules #
+                filtered_lst_day = ma.masked_where(self.__qc_filter.rejected(lst_day, qc_day), lst_day)
+                filtered_lst_night = ma.masked_where(self.__qc_filter.rejected(lst_night, qc_night), lst_night)
+                delta = np.ma.clip(np.ma.subtract(filtered_lst_day, filtered_lst_night), -40.0, 40.0)
+                lst_delta = np.round(delta.filled(self.__missing), 3)
+                s.add_pixels(lst_delta.size)
+
+            with span('write', file=output_file) as s:
+                # create the output file #
+                out_properties = {
+                    'latitudes': self.__latitudes,
+                    'longitudes': self.__longitudes,
+                    'times': [self.__get_calendar_value(file_name)],
+                    'time_units': 'days since 1900-01-01 00:00:00.0 UTC'
+                }
+                output_data_set = netcdf.initialize_dataset(output_file, out_properties)
+                # record the HDF file, to detect when it is reprocessed #
+                set_source(output_data_set, file_name, fingerprint_file("{}/{}".format(self.__raw_data_dir, file_name),
+                                                                        self.__fingerprint_method))
+
+                # add LST delta to output data set #
+                lst_var = output_data_set.createVariable('LST_Delta', 'float32', ('time', 'latitude', 'longitude'))
+                lst_var.units = "K"
+                lst_var.missing_value = self.__missing
+                lst_var.long_name = "Monthly Land-surface Temperature Day-Night delta"
+                lst_var[0] = lst_delta
+                s.add_pixels(lst_delta.size)
+                s.add_bytes_written(lst_delta.size * 4)
         except IOError:
             raise
         except Exception:
@@ -216,9 +230,15 @@ class LandSurfaceTemp:
             if output_data_set is not None:
                 output_data_set.close()
 
-    def update_lst_anomaly_file(self):
+    def update_lst_anomaly_file(self, date_range=None):
         """
         This function processes the files for a particular month and adds the anomaly arrays to the final NetCDF file
+            The files are grouped by month of the year from their dates, so a missing month is left out of the anomalies
+            of its month instead of shifting the months after it, and all the months are computed in one pass
+            With a date range, only the month series that include a month of the range are computed again,
+            as long as the time dimension of the existing file is unchanged; otherwise the file is created again
+        Args:
+            date_range (DateRange): optional range of months that have changed
         """
         output_file = os.path.join(self.__output_dir, "STEP_0101_LST_anomaly_{}.nc".format(self.__region))
         output_data_set = None
@@ -226,38 +246,54 @@ class LandSurfaceTemp:
             # get list of LST NetCDF files #
             self.netcdf_files = sorted(self.__fileHandler.get_working_file_names('lst_netcdf_regex'))
             # initialize the LST anomaly file #
-            out_properties = {
-                'latitudes': self.__latitudes,
-                'longitudes': self.__longitudes,
-                'times': self.__get_calendar_times(self.netcdf_files),
-                'time_units': 'days since 1900-01-01 00:00:00.0 UTC'
-            }
-            print("Creating LST anomaly file")
-            output_data_set = netcdf.initialize_dataset(output_file, out_properties)
-            # add LST delta to output data set #
-            lst_var = output_data_set.createVariable('lst_anom', 'float32', ('time', 'latitude', 'longitude'))
-            lst_var.units = "K"
-            lst_var.missing_value = self.__missing
-            lst_var.long_name = "Monthly Land-surface Temperature anomaly"
-
-            # determine the order of the months #
-            month_list = []
-            for m in range(0, 12):
-                null, month = self.__working_file_match.match(self.netcdf_files[m]).groups()
-                month_list.append(month)
-            # loop thru months and process the anomaly per year #
+            time_index = TimeIndex.from_file_names(self.netcdf_files, self.__working_file_match)
+            times = time_index.times
+            # the months whose NetCDF file has been written since the anomalies were computed #
+            fingerprints = self.__aoi.tag_fingerprints(get_file_fingerprints({
+                ''.join(self.__working_file_match.match(f).groups()): os.path.join(self.__working_dir, f)
+                for f in self.netcdf_files
+            }))
+            update_range = get_update_range(date_range if date_range is not None else DateRange(),
+                                            read_fingerprints(output_file), fingerprints)
+            months_to_update = None
+            if update_range is not None and netcdf.read_times(output_file) == times:
+                # the time dimension is unchanged: update the month series of the date range and changed months in place #
+                months_to_update = update_range.calendar_months(times)
+                if len(months_to_update) == 0:
+                    print("The LST anomaly file is up to date")
+                    return
+                print("Updating LST anomaly file for months: {}".format(months_to_update))
+                output_data_set = netcdf.open_dataset(output_file, 'a')
+                lst_var = output_data_set.variables['lst_anom']
+            else:
+                out_properties = {
+                    'latitudes': self.__latitudes,
+                    'longitudes': self.__longitudes,
+                    'times': times,
+                    'time_units': 'days since 1900-01-01 00:00:00.0 UTC'
+                }
+                print("Creating LST anomaly file")
+                output_data_set = netcdf.initialize_dataset(output_file, out_properties)
+                # add LST delta to output data set #
+                lst_var = output_data_set.createVariable('lst_anom', 'float32', ('time', 'latitude', 'longitude'))
+                lst_var.units = "K"
+                lst_var.missing_value = self.__missing
+                lst_var.long_name = "Monthly Land-surface Temperature anomaly"
+
+            # lay the files out by month of the year and year, with gaps for the missing months #
+            months = list(range(1, 13)) if months_to_update is None else months_to_update
+            positions = time_index.month_year_positions()[np.array(months, dtype=int) - 1]
+            # compute the LST anomalies of the months for every year in one pass #
             stats_ops = StatisticOperations()
-            for idx, m in enumerate(month_list):
-                # get the list of files for a particular month #
-                files = self.__get_lst_files_by_month(m)
-                # compute the LST anomalies per year for a particular month #
-                month_anomalies = stats_ops.compute_anomalies_from_files(files, "LST_Delta")
-                # set the starting index to the month index #
-                index = idx
-                # loop thru the years and add the data to the NetCDF file #
-                for y in month_anomalies:
-                    lst_var[index] = y
-                    index += 12  # increment 1 year
+            files = [os.path.join(self.__working_dir, f) for f in self.netcdf_files]
+            anomalies = stats_ops.compute_anomalies_by_month(files, "LST_Delta", positions, self.__aoi)
+            # add the data to the NetCDF file at the time index of each month and year, back on the grid #
+            with span('write', months=len(months)) as s:
+                written = netcdf.write_month_year(lst_var, positions, self.__aoi.unpack(anomalies, self.__missing))
+                s.add_pixels(written)
+                s.add_bytes_written(written * 4)
+            # record the NetCDF files of the anomalies once all the months are written #
+            set_fingerprints(output_data_set, fingerprints)
         except IOError:
             raise
         except Exception:
@@ -274,35 +310,41 @@ def main(args):
     script_start = datetime.now()
     mode = str(args.mode)
     try:
-        # initialize a new LST class #
-        lst = LandSurfaceTemp()
-
-        lst.convert_h4_to_h5()
-
-        # determine the files to process #
-        if mode == 'all':
-            print("Processing all months for LST.")
-            files_to_process = lst.get_files_to_process(True)
-        else:
-            files_to_process = lst.get_files_to_process()
-            if len(files_to_process) == 0:
-                print("All months have been processed for LST.")
-            else:
-                print("Processing needed months for LST.")
-
-        # convert any unprocessed HDF files to NetCDF format #
-        for f in files_to_process:
-            lst.create_lst_netcdf_file(f)
-
-        # create the LST anomaly file #
-        lst.update_lst_anomaly_file()
+        date_range = DateRange.from_args(args)
+        with span('step', step='0101'):
+            # initialize a new LST class #
+            lst = LandSurfaceTemp(getattr(args, 'fingerprint', 'mtime'))
+
+            lst.convert_h4_to_h5()
+
+            with span('file listing'):
+                # determine the files to process #
+                if mode == 'all':
+                    print("Processing all months for LST.")
+                    files_to_process = lst.get_files_to_process(True, date_range)
+                else:
+                    files_to_process = lst.get_files_to_process(False, date_range)
+                    if len(files_to_process) == 0:
+                        print("All months have been processed for LST.")
+                    else:
+                        print("Processing needed months for LST.")
+
+            # convert any unprocessed HDF files to NetCDF format #
+            for f in files_to_process:
+                lst.create_lst_netcdf_file(f)
+
+            # create the LST anomaly file #
+            lst.update_lst_anomaly_file(date_range)
     except IOError as ioe:
         print(ioe)
+        return 1
     except Exception as ex:
         print(ex)
+        return 1
     finally:
         script_end = datetime.now()
         print("Script execution: {}".format(script_end - script_start))
+    return 0
 
 
 if __name__ == '__main__':
@@ -310,5 +352,9 @@ if __name__ == '__main__':
     parser = ArgumentParser()
     parser.add_argument("-m", "--mode", default="updates",
                         help="The mode of the current processing: updates or all. Default is updates")
+    parser.add_argument("--fingerprint", default="mtime", choices=["mtime", "content"],
+                        help="How reprocessed raw files are detected: mtime (size and modification time) "
+                             "or content (file checksum). Default is mtime")
+    add_date_range_arguments(parser)
     # execute the programs with the supplied options
-    main(parser.parse_args())
+    sys.exit(main(parser.parse_args()))
@@ -1,23 +1,36 @@
 # -*- coding: utf-8 -*-
 import os
+import sys
 from libs.config_reader import ConfigParser
 from libs.file_operations import FileHandler
 from libs.subgrid_calculations import CHIRPSSubGrid
 from libs.statistics_operations import StatisticOperations
+from libs.aoi_mask import get_aoi_mask
 import libs.netcdf_functions as netcdf
+from libs.time_index import TimeIndex
+from libs.profiling import span
+from libs.date_range import DateRange, add_arguments as add_date_range_arguments
 from libs.spi_calculations import calculate_monthly_spi as spi_calc
+from libs.pipeline import fingerprint_file
+from libs.change_tracking import set_source, is_source_changed, get_file_fingerprints, read_fingerprints, \
+    write_fingerprints, get_update_range
 from argparse import ArgumentParser
 import numpy as np
 import numpy.ma as ma
 import re
-from datetime import datetime, date, timedelta
+from datetime import datetime, date
 
 
 class StandardizedPrecipitationIndex:
     """
     This is the core processing class for executing all SPI (standardized precipitation index) operations
     """
-    def __init__(self):
+    def __init__(self, fingerprint_method='mtime'):
+        """
+        Args:
+            fingerprint_method (str): how reprocessed raw files are detected: 'mtime' (size and modification time)
+                or 'content' (file checksum)
+        """
         self.__config = ConfigParser()
         self.__spi_periods = sorted(self.__config.get('spi_periods'))
         self.__raw_data_dir = self.__config.get('raw_data_dirs', 'chirps_tif').replace("\\", '/')
@@ -39,9 +52,13 @@ class StandardizedPrecipitationIndex:
         self.__latitudes = self.__config.get('latitudes')
         self.__longitudes = self.__config.get('longitudes')
         self.__missing = -9999.0
+        # the cells of the area of interest within the bounds #
+        self.__aoi = get_aoi_mask(self.__config)
         self.netcdf_files = []
         self.__precip_times = []
+        self.__time_index = TimeIndex()
         self.__start_index = {}
+        self.__fingerprint_method = fingerprint_method
 
     def __get_chirps_date(self, file_name):
         """
@@ -85,49 +102,18 @@ class StandardizedPrecipitationIndex:
         time_delta = test_date - origin_date
         return int(time_delta.days)
 
-    @staticmethod
-    def __get_calendar_times(files, match_regex):
-        """
-        This function builds a list of the valid times as days since Jan 1, 1900
-        Args:
-            files: list of the file names as strings
-            match_regex: regex of the file name pattern to parse
-
-        Returns:
-            List (floats) of the valid times as number of days since Jan 1, 1900
-        """
-        origin_date = date(1900, 1, 1)
-        times = []
-        for f in files:
-            (year, month) = match_regex.match(f).groups()
-            test_date = date(int(year), int(month), 1)
-            time_delta = test_date - origin_date
-            times.append(float(time_delta.days))
-        return times
-
     def __get_calendar_times_by_month(self, desired_month, period):
         """
         This function determines the time index values from the list of available dates that match a particular month of the year
         Args:
             desired_month (int): numeric value of the month (1 - 12)
+            period (int): the numeric value of the totaling period; the first (period - 1) times have no total
 
         Returns:
             list of the indices that match the desired dates
         """
-        try:
-            origin_date = date(1900, 1, 1)
-            indices = []
-            # loop thru the times of the precip file and find the indices by month #
-            for i in range(self.__start_index[period], len(self.__precip_times)):
-                time = self.__precip_times[i]
-                valid_time = origin_date + timedelta(days=int(time))
-                if valid_time.month == desired_month:
-                    indices.append(i)
-            return indices
-        except ValueError:
-            raise
-        except Exception:
-            raise
+        indices = self.__time_index.month_indices(desired_month)
+        return indices[indices >= self.__start_index[period]].tolist()
 
     def __get_chirps_files_by_month(self, month):
         """
@@ -179,12 +165,13 @@ class StandardizedPrecipitationIndex:
         """
         This function loads the precipitation values for a particular month and desired totaling period (1-month, 3-month, etc.)
             and calculates the SPI for that data
+            The values are packed to the cells of the AOI as they are read
         Args:
             month (int): the numeric value of the month (1 - 12)
             period (int): the numeric value of the totaling period
 
         Returns:
-            list of 2D numpy arrays, and a list of the time dimension indices
+            numpy array (years, cells) of the SPI values, and a list of the time dimension indices
         """
         precip_file = os.path.join(self.__working_dir, "STEP_0103_Precip_Totals_{}.nc".format(self.__region))
         input_dataset = netcdf.open_dataset(precip_file)
@@ -193,11 +180,15 @@ class StandardizedPrecipitationIndex:
             # determine the time positions for the month #
             times = self.__get_calendar_times_by_month(month, period)
             # extract the period precipitation values for the month series #
-            for t in times:
-                v = netcdf.extract_data(input_dataset, 'precip_{}_month'.format(period), t)
-                precip_values.append(np.where(v == self.__missing, 0.0, v))
+            with span('read', month=month, period=period) as s:
+                for t in times:
+                    v = self.__aoi.pack(netcdf.extract_data(input_dataset, 'precip_{}_month'.format(period), t))
+                    precip_values.append(np.where(v == self.__missing, 0.0, v))
+                    s.add_pixels(v.size)
             # compute the SPI values #
-            spi_values = spi_calc(precip_values)
+            with span('spi', month=month, period=period) as s:
+                spi_values = spi_calc(precip_values)
+                s.add_pixels(np.size(spi_values))
             # cleanup memory #
             del precip_values
             # return the SPI values #
@@ -211,20 +202,51 @@ class StandardizedPrecipitationIndex:
         finally:
             input_dataset.close()
 
-    def get_chirps_files_to_process(self, all_tif=False):
+    def __get_raw_files_by_month(self):
+        """
+        This function gets the CHIRPS files of the raw data directory, one per month
+            The files are either the downloaded archives (chirps-v2.0.YYYY.MM.tif.gz) or extracted TIF files
+            (cYYYYMM.tif); when both exist for a month the extracted TIF is used
+        Returns:
+            List of strings of the file names, in date order
+        """
+        files_by_month = {}
+        for f in sorted(self.__fileHandler.get_raw_file_names('chirps_tif_regex'), key=lambda f: f.endswith('.gz')):
+            files_by_month.setdefault(self.__get_chirps_date(f), f)
+        return [files_by_month[d] for d in sorted(files_by_month)]
+
+    def __is_raw_file_changed(self, file_name, working_file):
+        """
+        This function tests if a TIF file has been reprocessed (changed in place) since its NetCDF file was created
+        Args:
+            file_name (str): the name of the TIF file
+            working_file (str): the name of the NetCDF file
+
+        Returns:
+            Boolean flag
+        """
+        fingerprint = fingerprint_file("{}/{}".format(self.__raw_data_dir, file_name), self.__fingerprint_method)
+        return is_source_changed(os.path.join(self.__working_dir, working_file), file_name, fingerprint)
+
+    def get_chirps_files_to_process(self, all_tif=False, date_range=None):
         """
         This function gets the list of TIF files to convert to NetCDF subsets
         Args:
             all_tif (boolean): optional flag to process all TIF files, even if NetCDF versions exist
+            date_range (DateRange): optional range of months; files within the range are processed again,
+                and 'all' is limited to the range
 
         Returns:
-            List of strings of the TIF file names
+            List of strings of the TIF file names; in updates mode the new files, the files within the date range,
+                and the files that have changed since their NetCDF file was created
         """
         files = []
         try:
-            raw_files = self.__fileHandler.get_raw_file_names('chirps_tif_regex')
-            if all_tif:  # include all TIF files
-                files = raw_files
+            raw_files = self.__get_raw_files_by_month()
+            if date_range is None:
+                date_range = DateRange()
+            if all_tif:  # include all TIF files within the date range
+                files = [f for f in raw_files if date_range.contains_date(self.__get_chirps_date(f))]
             else:  # determine which TIF files have not been converted to NetCDF
                 working_files = self.__fileHandler.get_working_file_names('chirps_netcdf_regex')
                 # compare the raw files with the processed files #
@@ -234,9 +256,13 @@ class StandardizedPrecipitationIndex:
                     file_date = "{}{}".format(year, month)
                     # prepare the NetCDF filename to test for #
                     test_file = "STEP_0103_CHIRPS_{}_{}.nc".format(self.__region, file_date)
-                    if test_file not in working_files:
+                    # convert new files, and any files within the date range since they may have been reprocessed #
+                    if test_file not in working_files or (date_range.is_set and date_range.contains_date(file_date)):
                         # add the file name to the list to process #
                         files.append(f)
+                    elif self.__is_raw_file_changed(f, test_file):
+                        # the TIF file has been reprocessed since the NetCDF file was created #
+                        files.append(f)
         except IOError:
             raise
         except Exception:
@@ -262,21 +288,27 @@ class StandardizedPrecipitationIndex:
             with CHIRPSSubGrid(self.__bounds, raw_file_path) as sg:
                 precip_data = sg.create_sub_grid()
 
-            # create the output file #
-            out_properties = {
-                'latitudes': self.__latitudes,
-                'longitudes': self.__longitudes,
-                'times': [self.__get_chirps_calendar_value(file_name)],
-                'time_units': 'days since 1900-01-01 00:00:00.0 UTC'
-            }
-            output_data_set = netcdf.initialize_dataset(output_file, out_properties)
-
-            # add precipitation data to output data set #
-            precip_var = output_data_set.createVariable('precip_mm', 'float32', ('time', 'latitude', 'longitude'))
-            precip_var.units = "mm"
-            precip_var.missing_value = self.__missing
-            precip_var.long_name = "Monthly precipitation amount"
-            precip_var[0] = precip_data
+            with span('write', file=output_file) as s:
+                # create the output file #
+                out_properties = {
+                    'latitudes': self.__latitudes,
+                    'longitudes': self.__longitudes,
+                    'times': [self.__get_chirps_calendar_value(file_name)],
+                    'time_units': 'days since 1900-01-01 00:00:00.0 UTC'
+                }
+                output_data_set = netcdf.initialize_dataset(output_file, out_properties)
+                # record the TIF file, to detect when it is reprocessed #
+                set_source(output_data_set, file_name, fingerprint_file("{}/{}".format(self.__raw_data_dir, file_name),
+                                                                        self.__fingerprint_method))
+
+                # add precipitation data to output data set #
+                precip_var = output_data_set.createVariable('precip_mm', 'float32', ('time', 'latitude', 'longitude'))
+                precip_var.units = "mm"
+                precip_var.missing_value = self.__missing
+                precip_var.long_name = "Monthly precipitation amount"
+                precip_var[0] = precip_data
+                s.add_pixels(precip_data.size)
+                s.add_bytes_written(precip_data.size * 4)
         except IOError:
             raise
         except Exception:
@@ -301,130 +333,166 @@ class StandardizedPrecipitationIndex:
         min_range = min(self.__spi_periods)
         max_range = max(self.__spi_periods)
         try:
-            chirps_files = sorted(self.__fileHandler.get_working_file_names('chirps_netcdf_regex'))
-
-            # get the valid times of the totals #
-            self.__precip_times = self.__get_calendar_times(chirps_files, self.__working_chirps_file_match)
-
-            # create the output file #
-            out_properties = {
-                'latitudes': self.__latitudes,
-                'longitudes': self.__longitudes,
-                'times': self.__precip_times,
-                'time_units': 'days since 1900-01-01 00:00:00.0 UTC'
-            }
-            output_data_set = netcdf.initialize_dataset(output_file, out_properties)
-
-            # add precipitation data to output data set #
-            rows = len(self.__latitudes)
-            columns = len(self.__longitudes)
-            precip_vars = []
-            empty_set = np.full((rows, columns), self.__missing)
-            for p in self.__spi_periods:
-                self.__start_index[p] = (p - 1)
-                precip_var = output_data_set.createVariable('precip_{}_month'.format(p), 'float32', ('time', 'latitude', 'longitude'))
-                precip_var.units = "mm"
-                precip_var.missing_value = self.__missing
-                precip_var.long_name = "{} Month precipitation amount".format(p)
-                for t in range(0, len(self.__precip_times)):
-                    precip_var[t] = empty_set
-                precip_vars.append(precip_var)
-            # separate 1-month periods from any that need totals #
-            if min_range == 1:
-                for i in range(0, len(chirps_files)):
-                    precip_vars[0][i] = self.__get_precip_from_netcdf(chirps_files[i])
-            # continue with the remaining periods #
-            if max_range > 1:
-                # load the range of the longest period, minus 1 month #
-                precip_values = []
-                for i in range(0, max_range):
-                    precip_values.append(self.__get_precip_from_netcdf(chirps_files[i]))
-                # loop thru the remaining times and create the monthly totals #
-                for i in range((max_range - 1), len(chirps_files)):
-                    offset = i - (max_range - 1)
-                    # load the current month #
-                    precip_values.append(self.__get_precip_from_netcdf(chirps_files[i]))
-                    # compute the monthly totals and append the values to the output array #
-                    for j, period in enumerate(self.__spi_periods):
-                        # determine the number of sub-totals within the max range period #
-                        """
-                        Example: assuming we want SPI values for 3-month, and 9-month ranges
-                            Our maximum range is 9 months for the current data set
-                            We have:
-                                7 3-month values starting at the 3rd index
-                                1 9-month value starting at the 9th index
-                        """
-                        if period > 1:
-                            first = 0
-                            last = period
-                            # loop thru the current subset of precipitation values and create the totals #
-                            for s in range(self.__start_index[period], max_range):
-                                first += 1
-                                last += 1
-                                total_precip = ma.sum(ma.masked_equal(precip_values[first:last], self.__missing), axis=0)
-                                precip_vars[j][s + offset] = total_precip.filled(self.__missing)
-                    # remove the first date from the precip array #
-                    precip_values = precip_values[1:]
-                del precip_values
-        except IOError as ioe:
-            print(ioe)
-        except Exception as ex:
-            print(ex)
+            with span('totals') as totals_span:
+                chirps_files = sorted(self.__fileHandler.get_working_file_names('chirps_netcdf_regex'))
+
+                # get the valid times of the totals #
+                self.__time_index = TimeIndex.from_file_names(chirps_files, self.__working_chirps_file_match)
+                self.__precip_times = self.__time_index.times
+
+                # create the output file #
+                out_properties = {
+                    'latitudes': self.__latitudes,
+                    'longitudes': self.__longitudes,
+                    'times': self.__precip_times,
+                    'time_units': 'days since 1900-01-01 00:00:00.0 UTC'
+                }
+                output_data_set = netcdf.initialize_dataset(output_file, out_properties)
+
+                # add precipitation data to output data set #
+                rows = len(self.__latitudes)
+                columns = len(self.__longitudes)
+                precip_vars = []
+                empty_set = np.full((rows, columns), self.__missing)
+                for p in self.__spi_periods:
+                    self.__start_index[p] = (p - 1)
+                    precip_var = output_data_set.createVariable('precip_{}_month'.format(p), 'float32', ('time', 'latitude', 'longitude'))
+                    precip_var.units = "mm"
+                    precip_var.missing_value = self.__missing
+                    precip_var.long_name = "{} Month precipitation amount".format(p)
+                    for t in range(0, len(self.__precip_times)):
+                        precip_var[t] = empty_set
+                    precip_vars.append(precip_var)
+                # separate 1-month periods from any that need totals #
+                if min_range == 1:
+                    for i in range(0, len(chirps_files)):
+                        precip_vars[0][i] = self.__get_precip_from_netcdf(chirps_files[i])
+                # continue with the remaining periods #
+                if max_range > 1:
+                    # load the range of the longest period, minus 1 month #
+                    precip_values = []
+                    for i in range(0, max_range):
+                        precip_values.append(self.__get_precip_from_netcdf(chirps_files[i]))
+                    # loop thru the remaining times and create the monthly totals #
+                    for i in range((max_range - 1), len(chirps_files)):
+                        offset = i - (max_range - 1)
+                        # load the current month #
+                        precip_values.append(self.__get_precip_from_netcdf(chirps_files[i]))
+                        # compute the monthly totals and append the values to the output array #
+                        for j, period in enumerate(self.__spi_periods):
+                            # determine the number of sub-totals within the max range period #
+                            """
+                            Example: assuming we want SPI values for 3-month, and 9-month ranges
+                                Our maximum range is 9 months for the current data set
+                                We have:
+                                    7 3-month values starting at the 3rd index
+                                    1 9-month value starting at the 9th index
+                            """
+                            if period > 1:
+                                first = 0
+                                last = period
+                                # loop thru the current subset of precipitation values and create the totals #
+                                for s in range(self.__start_index[period], max_range):
+                                    first += 1
+                                    last += 1
+                                    total_precip = ma.sum(ma.masked_equal(precip_values[first:last], self.__missing), axis=0)
+                                    precip_vars[j][s + offset] = total_precip.filled(self.__missing)
+                        totals_span.add_pixels(precip_values[-1].size)
+                        # remove the first date from the precip array #
+                        precip_values = precip_values[1:]
+                    del precip_values
+        except IOError:
+            raise
+        except Exception:
+            raise
         finally:
             if output_data_set is not None:
                 output_data_set.close()
 
-    def create_spi_anomaly_file(self):
+    def create_spi_anomaly_file(self, date_range=None):
         """
         This function processes the SPI per month series and adds the anomaly values to the final NetCDF file
+            With a date range, or when the NetCDF files of some months have been written again, only the month series
+            that include one of these months (or a multi-month total containing it) are computed again,
+            as long as the time dimension of the existing file is unchanged
+        Args:
+            date_range (DateRange): optional range of months that have changed
         """
         output_file = os.path.join(self.__output_dir, "STEP_0103_SPI_anomaly_{}.nc".format(self.__region))
         try:
-            # initialize the SPI anomaly file #
-            out_properties = {
-                'latitudes': self.__latitudes,
-                'longitudes': self.__longitudes,
-                'times': self.__precip_times,
-                'time_units': 'days since 1900-01-01 00:00:00.0 UTC'
-            }
-            print("Creating SPI anomaly file")
-            output_data_set = netcdf.initialize_dataset(output_file, out_properties)
-            # add SPI anomaly to output data set #
-            rows = len(self.__latitudes)
-            columns = len(self.__longitudes)
-            empty_set = np.full((rows, columns), self.__missing)
-            for p in self.__spi_periods:
-                spi_var = output_data_set.createVariable('spi_{}_anom'.format(p), 'float32', ('time', 'latitude', 'longitude'))
-                spi_var.units = "none"
-                spi_var.missing_value = self.__missing
-                spi_var.long_name = "Monthly SPI anomaly ({} month precip totals)".format(p)
-                for t in range(0, self.__start_index[p]):
-                    spi_var[t] = empty_set
-            # close the file and cleanup memory $
-            output_data_set.close()
-            del rows, columns, empty_set
+            # the months whose NetCDF file has been written since the anomalies were computed #
+            fingerprints = self.__aoi.tag_fingerprints(get_file_fingerprints({
+                ''.join(self.__working_chirps_file_match.match(f).groups()): os.path.join(self.__working_dir, f)
+                for f in self.__fileHandler.get_working_file_names('chirps_netcdf_regex')
+            }))
+            update_range = get_update_range(date_range if date_range is not None else DateRange(),
+                                            read_fingerprints(output_file), fingerprints)
+            update_in_place = update_range is not None and netcdf.read_times(output_file) == self.__precip_times
+            if update_in_place:
+                print("Updating SPI anomaly file for {}".format(update_range))
+            else:
+                # initialize the SPI anomaly file #
+                out_properties = {
+                    'latitudes': self.__latitudes,
+                    'longitudes': self.__longitudes,
+                    'times': self.__precip_times,
+                    'time_units': 'days since 1900-01-01 00:00:00.0 UTC'
+                }
+                print("Creating SPI anomaly file")
+                output_data_set = netcdf.initialize_dataset(output_file, out_properties)
+                # add SPI anomaly to output data set #
+                rows = len(self.__latitudes)
+                columns = len(self.__longitudes)
+                empty_set = np.full((rows, columns), self.__missing)
+                for p in self.__spi_periods:
+                    spi_var = output_data_set.createVariable('spi_{}_anom'.format(p), 'float32', ('time', 'latitude', 'longitude'))
+                    spi_var.units = "none"
+                    spi_var.missing_value = self.__missing
+                    spi_var.long_name = "Monthly SPI anomaly ({} month precip totals)".format(p)
+                    for t in range(0, self.__start_index[p]):
+                        spi_var[t] = empty_set
+                # close the file and cleanup memory $
+                output_data_set.close()
+                del rows, columns, empty_set
 
             # loop thru the months and compute the anomaly series #
             stats_ops = StatisticOperations()
+            updated = not update_in_place
             for i, p in enumerate(self.__spi_periods):
+                months_to_update = None
+                if update_in_place:
+                    # the totals of the (p - 1) months after the range also include months of the range #
+                    months_to_update = update_range.extend(p - 1).calendar_months(self.__precip_times)
+                    if len(months_to_update) == 0:
+                        print("-- SPI anomalies are up to date for {}-month totals".format(p))
+                        continue
+                    updated = True
                 # open the NetCDF file in append mode #
                 output_data_set = netcdf.open_dataset(output_file, 'a')
                 spi_var = output_data_set.variables['spi_{}_anom'.format(p)]
                 for m in range(1, 13):
+                    if months_to_update is not None and m not in months_to_update:
+                        continue
                     # compute the spi values #
                     (spi, times) = self.__create_spi_data_from_precip(m, p)
                     # compute the monthly anomalies #
                     anomalies = stats_ops.compute_anomalies_from_values(spi)
                     # cleanup memory #
                     del spi
-                    # add the anomalies to the NetCDF file #
-                    for idx, t in enumerate(times):
-                        spi_var[t] = anomalies[idx]
+                    # add the anomalies to the NetCDF file, back on the grid #
+                    with span('write', month=m, period=p) as s:
+                        for idx, t in enumerate(times):
+                            spi_var[t] = self.__aoi.unpack(anomalies[idx], self.__missing)
+                            s.add_pixels(np.size(anomalies[idx]))
+                            s.add_bytes_written(np.size(anomalies[idx]) * 4)
                     # cleanup memory #
                     del anomalies
                 # close file to write the data #
                 output_data_set.close()
                 print("-- SPI anomalies calculated for {}-month totals".format(p))
+            if updated:
+                # record the NetCDF files of the anomalies once all the months are written #
+                write_fingerprints(output_file, fingerprints)
         except IOError:
             raise
         except ValueError:
@@ -440,38 +508,45 @@ def main(args):
     script_start = datetime.now()
     mode = str(args.mode)
     try:
-        # initialize a new SPI class #
-        spi = StandardizedPrecipitationIndex()
-
-        # determine the files to process #
-        if mode == 'all':
-            print("Processing all files for CHIRPS.")
-            files_to_process = spi.get_chirps_files_to_process(True)
-        else:
-            files_to_process = spi.get_chirps_files_to_process()
-            if len(files_to_process) == 0:
-                print("All files have been processed for CHIRPS.")
-            else:
-                print("Processing needed files for CHIRPS.")
-        # convert any unprocessed TIF files to NetCDF format #
-        for f in files_to_process:
-            spi.create_chirps_netcdf_file(f)
-
-        # create the 3-month precip totals #
-        print("Creating precipitation totals")
-        spi.create_precip_from_chirps()
-
-        # create the SPI anomaly file #
-        spi.create_spi_anomaly_file()
+        date_range = DateRange.from_args(args)
+        with span('step', step='0103'):
+            # initialize a new SPI class #
+            spi = StandardizedPrecipitationIndex(getattr(args, 'fingerprint', 'mtime'))
+
+            with span('file listing'):
+                # determine the files to process #
+                if mode == 'all':
+                    print("Processing all files for CHIRPS.")
+                    files_to_process = spi.get_chirps_files_to_process(True, date_range)
+                else:
+                    files_to_process = spi.get_chirps_files_to_process(False, date_range)
+                    if len(files_to_process) == 0:
+                        print("All files have been processed for CHIRPS.")
+                    else:
+                        print("Processing needed files for CHIRPS.")
+            # convert any unprocessed TIF files to NetCDF format #
+            for f in files_to_process:
+                spi.create_chirps_netcdf_file(f)
+
+            # create the 3-month precip totals #
+            print("Creating precipitation totals")
+            spi.create_precip_from_chirps()
+
+            # create the SPI anomaly file #
+            spi.create_spi_anomaly_file(date_range)
     except ValueError as ve:
         print(ve)
+        return 1
     except IOError as ioe:
         print(ioe)
+        return 1
     except Exception as ex:
         print(ex)
+        return 1
     finally:
         script_end = datetime.now()
         print("Script execution: {}".format(script_end - script_start))
+    return 0
 
 
 if __name__ == '__main__':
@@ -479,5 +554,9 @@ if __name__ == '__main__':
     parser = ArgumentParser()
     parser.add_argument("-m", "--mode", default="updates",
                         help="The mode of the current processing: updates or all. Default is updates")
+    parser.add_argument("--fingerprint", default="mtime", choices=["mtime", "content"],
+                        help="How reprocessed raw files are detected: mtime (size and modification time) "
+                             "or content (file checksum). Default is mtime")
+    add_date_range_arguments(parser)
     # execute the programs with the supplied options
-    main(parser.parse_args())
+    sys.exit(main(parser.parse_args()))
@@ -1,9 +1,14 @@
 # -*- coding: utf-8 -*-
 import os
+import sys
 from libs.config_reader import ConfigParser
 from libs.file_operations import FileHandler
 from libs.subgrid_calculations import NetCDFSubGrid
 import libs.netcdf_functions as netcdf
+from libs.profiling import span
+from libs.date_range import DateRange, add_arguments as add_date_range_arguments
+from libs.pipeline import fingerprint_file
+from libs.change_tracking import set_source, is_source_changed
 from argparse import ArgumentParser
 import numpy as np
 import re
@@ -14,7 +19,12 @@ class SoilMoisture:
     """
     This is the core processing class for executing all soil moisture creation operations
     """
-    def __init__(self):
+    def __init__(self, fingerprint_method='mtime'):
+        """
+        Args:
+            fingerprint_method (str): how reprocessed raw files are detected: 'mtime' (size and modification time)
+                or 'content' (file checksum)
+        """
         self.__config = ConfigParser()
         self.__raw_data_dir = self.__config.get('raw_data_dirs', 'fldas_data').replace("\\", '/')
         self.__working_dir = self.__config.get('scratch_dir').replace("\\", '/') + '/SM'
@@ -34,6 +44,7 @@ class SoilMoisture:
         self.__longitudes = self.__config.get('longitudes')
         self.__missing = -9999.0
         self.__soil_units = ""
+        self.__fingerprint_method = fingerprint_method
 
     def __get_fldas_date(self, file_name):
         """
@@ -62,20 +73,38 @@ class SoilMoisture:
         time_delta = test_date - origin_date
         return int(time_delta.days)
 
-    def get_fldas_files_to_process(self, all_dates=False):
+    def __is_raw_file_changed(self, file_name, working_file):
+        """
+        This function tests if a FLDAS file has been reprocessed (changed in place) since its Soil Moisture file was created
+        Args:
+            file_name (str): the name of the FLDAS file
+            working_file (str): the name of the Soil Moisture file
+
+        Returns:
+            Boolean flag
+        """
+        fingerprint = fingerprint_file("{}/{}".format(self.__raw_data_dir, file_name), self.__fingerprint_method)
+        return is_source_changed(os.path.join(self.__working_dir, working_file), file_name, fingerprint)
+
+    def get_fldas_files_to_process(self, all_dates=False, date_range=None):
         """
         This function gets the list of FLDAS files to convert to Soil Moisture subsets
         Args:
             all_dates (boolean): optional flag to process all dates files, even if Soil Moisture versions exist
+            date_range (DateRange): optional range of months; files within the range are processed again,
+                and 'all' is limited to the range
 
         Returns:
-            List of strings of the FLDAS file names
+            List of strings of the FLDAS file names; in updates mode the new files, the files within the date range,
+                and the files that have changed since their Soil Moisture file was created
         """
         files = []
         try:
             raw_files = self.__fileHandler.get_raw_file_names('fldas_data_regex')
-            if all_dates:  # include all FLDAS files
-                files = raw_files
+            if date_range is None:
+                date_range = DateRange()
+            if all_dates:  # include all FLDAS files within the date range
+                files = [f for f in raw_files if date_range.contains_date(self.__get_fldas_date(f))]
             else:  # determine which FLDAS files have not been converted to Soil Moisture SubGrids
                 working_files = self.__fileHandler.get_working_file_names('sm_netcdf_regex')
                 # compare the raw files with the processed files #
@@ -85,9 +114,13 @@ class SoilMoisture:
                     file_date = "{}{}".format(year, month)
                     # prepare the NetCDF filename to test for #
                     test_file = "STEP_0104_SM_{}_{}.nc".format(self.__region, file_date)
-                    if test_file not in working_files:
+                    # convert new files, and any files within the date range since they may have been reprocessed #
+                    if test_file not in working_files or (date_range.is_set and date_range.contains_date(file_date)):
                         # add the file name to the list to process #
                         files.append(f)
+                    elif self.__is_raw_file_changed(f, test_file):
+                        # the FLDAS file has been reprocessed since the Soil Moisture file was created #
+                        files.append(f)
         except IOError:
             raise
         except Exception:
@@ -108,18 +141,22 @@ class SoilMoisture:
         try:
             # create the SubGrids of the raw data #
             with NetCDFSubGrid(self.__bounds, file_path, True) as sg:
-                soil_00_10 = sg.create_sub_grid('SoilMoi00_10cm_tavg')
-                soil_10_40 = sg.create_sub_grid('SoilMoi10_40cm_tavg')
-                soil_40_100 = sg.create_sub_grid('SoilMoi40_100cm_tavg')
-                soil_100_200 = sg.create_sub_grid('SoilMoi100_200cm_tavg')
+                # the 4 layers are read from the AOI window in one pass and interpolated together #
+                soil_layers = sg.create_sub_grids(['SoilMoi00_10cm_tavg', 'SoilMoi10_40cm_tavg',
+                                                   'SoilMoi40_100cm_tavg', 'SoilMoi100_200cm_tavg'])
                 self.soil_units = sg.units
 
-            # create new root zone parameters: partials weighted by % of total depth #
-            root_zone1 = np.round((soil_00_10 * 0.2) + (soil_10_40 * 0.8), 6)
-            root_zone2 = np.round((soil_00_10 * 0.1) + (soil_10_40 * 0.3) + (soil_40_100 * 0.6), 6)
-            total_zone = np.round((soil_00_10 * 0.05) + (soil_10_40 * 0.15) + (soil_40_100 * 0.3) + (soil_100_200 * 0.5), 6)
+            with span('root zones'):
+                # create new root zone parameters: partials weighted by % of total depth #
+                # rows: root zone 1 (0-40 cm), root zone 2 (0-100 cm), total column (0-200 cm); columns: the 4 layers #
+                zone_weights = np.array([[0.2, 0.8, 0.0, 0.0],
+                                         [0.1, 0.3, 0.6, 0.0],
+                                         [0.05, 0.15, 0.3, 0.5]])
+                zones = np.round(np.einsum('zl,lij->zij', zone_weights, soil_layers), 6)
 
-            return np.flipud(root_zone1), np.flipud(root_zone2), np.flipud(total_zone)  # flip arrays to match N-S direction of other data
+            # flip arrays to match N-S direction of other data #
+            root_zone1, root_zone2, total_zone = zones[:, ::-1, :]
+            return root_zone1, root_zone2, total_zone
         except ValueError:
             raise
         except Exception:
@@ -142,36 +179,41 @@ class SoilMoisture:
             # generate soil moisture parameters #
             root_zone1, root_zone2, total_zone = self.__create_soil_moisture_parameters(raw_file_path)
 
-            # create the output file #
-            out_properties = {
-                'latitudes': self.__latitudes,
-                'longitudes': self.__longitudes,
-                'times': [self.__get_fldas_calendar_value(file_name)],
-                'time_units': 'days since 1900-01-01 00:00:00.0 UTC'
-            }
-            output_data_set = netcdf.initialize_dataset(output_file, out_properties)
-
-            # add soil moisture parameters to output data set #
-            root_zone1_var = output_data_set.createVariable('RootZone_SM', 'float32', ('time', 'latitude', 'longitude'))
-            root_zone1_var.units = self.soil_units
-            root_zone1_var.missing_value = self.__missing
-            root_zone1_var.standard_name = "soil_moisture_content"
-            root_zone1_var.long_name = "soil moisture content 0cm to 40cm"
-            root_zone1_var[0] = root_zone1
-
-            root_zone2_var = output_data_set.createVariable('RootZone2_SM', 'float32', ('time', 'latitude', 'longitude'))
-            root_zone2_var.units = self.soil_units
-            root_zone2_var.missing_value = self.__missing
-            root_zone2_var.standard_name = "soil_moisture_content"
-            root_zone2_var.long_name = "soil moisture content 0cm to 100cm"
-            root_zone2_var[0] = root_zone2
-
-            total_zone_var = output_data_set.createVariable('TotalColumn_SM', 'float32', ('time', 'latitude', 'longitude'))
-            total_zone_var.units = self.soil_units
-            total_zone_var.missing_value = self.__missing
-            total_zone_var.standard_name = "soil_moisture_content"
-            total_zone_var.long_name = "soil moisture content 0cm to 200cm"
-            total_zone_var[0] = total_zone
+            with span('write', file=output_file) as s:
+                # create the output file #
+                out_properties = {
+                    'latitudes': self.__latitudes,
+                    'longitudes': self.__longitudes,
+                    'times': [self.__get_fldas_calendar_value(file_name)],
+                    'time_units': 'days since 1900-01-01 00:00:00.0 UTC'
+                }
+                output_data_set = netcdf.initialize_dataset(output_file, out_properties)
+                # record the FLDAS file, to detect when it is reprocessed #
+                set_source(output_data_set, file_name, fingerprint_file(raw_file_path, self.__fingerprint_method))
+
+                # add soil moisture parameters to output data set #
+                root_zone1_var = output_data_set.createVariable('RootZone_SM', 'float32', ('time', 'latitude', 'longitude'))
+                root_zone1_var.units = self.soil_units
+                root_zone1_var.missing_value = self.__missing
+                root_zone1_var.standard_name = "soil_moisture_content"
+                root_zone1_var.long_name = "soil moisture content 0cm to 40cm"
+                root_zone1_var[0] = root_zone1
+
+                root_zone2_var = output_data_set.createVariable('RootZone2_SM', 'float32', ('time', 'latitude', 'longitude'))
+                root_zone2_var.units = self.soil_units
+                root_zone2_var.missing_value = self.__missing
+                root_zone2_var.standard_name = "soil_moisture_content"
+                root_zone2_var.long_name = "soil moisture content 0cm to 100cm"
+                root_zone2_var[0] = root_zone2
+
+                total_zone_var = output_data_set.createVariable('TotalColumn_SM', 'float32', ('time', 'latitude', 'longitude'))
+                total_zone_var.units = self.soil_units
+                total_zone_var.missing_value = self.__missing
+                total_zone_var.standard_name = "soil_moisture_content"
+                total_zone_var.long_name = "soil moisture content 0cm to 200cm"
+                total_zone_var[0] = total_zone
+                s.add_pixels(root_zone1.size * 3)
+                s.add_bytes_written(root_zone1.size * 3 * 4)
         except IOError:
             raise
         except Exception:
@@ -188,29 +230,35 @@ def main(args):
     script_start = datetime.now()
     mode = str(args.mode)
     try:
-        # initialize a new soil moisture class #
-        soil_moisture = SoilMoisture()
-        # determine the files to process #
-        files_to_process = []
-        if mode == 'all':
-            print("Processing all months.")
-            files_to_process = soil_moisture.get_fldas_files_to_process(True)
-        else:
-            files_to_process = soil_moisture.get_fldas_files_to_process()
-            if len(files_to_process) == 0:
-                print("All months have been processed for 5km Soil Moisture.")
-            else:
-                print("Processing needed months for 5km Soil Moisture.")
-        # create any SubGrids required for processing #
-        for f in files_to_process:
-            soil_moisture.create_soil_moisture_file(f)
+        date_range = DateRange.from_args(args)
+        with span('step', step='0104'):
+            # initialize a new soil moisture class #
+            soil_moisture = SoilMoisture(getattr(args, 'fingerprint', 'mtime'))
+            with span('file listing'):
+                # determine the files to process #
+                files_to_process = []
+                if mode == 'all':
+                    print("Processing all months.")
+                    files_to_process = soil_moisture.get_fldas_files_to_process(True, date_range)
+                else:
+                    files_to_process = soil_moisture.get_fldas_files_to_process(False, date_range)
+                    if len(files_to_process) == 0:
+                        print("All months have been processed for 5km Soil Moisture.")
+                    else:
+                        print("Processing needed months for 5km Soil Moisture.")
+            # create any SubGrids required for processing #
+            for f in files_to_process:
+                soil_moisture.create_soil_moisture_file(f)
     except IOError as ioe:
         print(ioe)
+        return 1
     except Exception as ex:
         print(ex)
+        return 1
     finally:
         script_end = datetime.now()
         print("Script execution: {}".format(script_end - script_start))
+    return 0
 
 
 if __name__ == '__main__':
@@ -218,5 +266,9 @@ if __name__ == '__main__':
     parser = ArgumentParser()
     parser.add_argument("-m", "--mode", default="updates",
                         help="The mode of the current processing: updates or all. Default is updates")
+    parser.add_argument("--fingerprint", default="mtime", choices=["mtime", "content"],
+                        help="How reprocessed raw files are detected: mtime (size and modification time) "
+                             "or content (file checksum). Default is mtime")
+    add_date_range_arguments(parser)
     # execute the programs with the supplied options
-    main(parser.parse_args())
+    sys.exit(main(parser.parse_args()))
@@ -1,8 +1,15 @@
 # -*- coding: utf-8 -*-
 import os
+import sys
 from libs.config_reader import ConfigParser
 from libs.statistics_operations import StatisticOperations
+from libs.aoi_mask import get_aoi_mask
 import libs.netcdf_functions as netcdf
+from libs.time_index import TimeIndex
+from libs.profiling import span
+from libs.date_range import DateRange, add_arguments as add_date_range_arguments
+from libs.change_tracking import read_fingerprints, write_fingerprints, get_update_range
+from argparse import ArgumentParser
 import numpy as np
 from datetime import datetime
 
@@ -11,7 +18,13 @@ class NormalizedDifferenceVegetationIndexRanking:
     """
     This is the core processing class for executing all NDVI (normalized difference vegetation index) ranking operations
     """
-    def __init__(self):
+    def __init__(self, date_range=None):
+        """
+        Args:
+            date_range (DateRange): optional range of months that have changed; only the month series that include
+                a month of the range, or a month whose inputs have changed since the output was ranked, are ranked
+                again when the time dimension of the existing output is unchanged
+        """
         self.__config = ConfigParser()
         self.__stats = StatisticOperations()
         self.__output_dir = self.__config.get('output_dir').replace("\\", '/')
@@ -22,13 +35,24 @@ class NormalizedDifferenceVegetationIndexRanking:
         self.__latitudes = self.__config.get('latitudes')
         self.__longitudes = self.__config.get('longitudes')
         self.__times = self.__input_data_set.variables['time'][:]
-        self.__number_of_months = len(self.__times)
         self.__missing = -9999.0
+        # the cells of the area of interest within the bounds #
+        self.__aoi = get_aoi_mask(self.__config)
+        self.__date_range = date_range if date_range is not None else DateRange()
+        # the fingerprints of the inputs of each month, recorded by the anomaly step #
+        self.__fingerprints = read_fingerprints(self.__input_data_set)
+        self.__update_in_place = False
         # initialize the output file and prepare internal value lists #
         self.__initialize_ranking_file()
 
     def __initialize_ranking_file(self):
         self.__output_file = os.path.join(self.__output_dir, "STEP_0202_NDVI_anomaly_pct_rank_{}.nc".format(self.__region))
+        # keep the existing file when the time dimension is unchanged and only some months are updated #
+        update_range = get_update_range(self.__date_range, read_fingerprints(self.__output_file), self.__fingerprints)
+        if update_range is not None and netcdf.read_times(self.__output_file) == [float(t) for t in self.__times]:
+            self.__date_range = update_range
+            self.__update_in_place = True
+            return
         output_data_set = None
         try:
             # create the output file #
@@ -46,36 +70,60 @@ class NormalizedDifferenceVegetationIndexRanking:
             lst_rank.missing_value = self.__missing
             lst_rank.standard_name = "ndvi_anomaly_pct_rank"
             lst_rank.long_name = "percent ranked NDVI anomaly"
-        except IOError as ioe:
-            print(ioe)
-        except Exception as ex:
-            print(ex)
+        except IOError:
+            raise
+        except Exception:
+            raise
         finally:
             if output_data_set is not None:
                 output_data_set.close()
 
-    def rank_parameter(self, index):
+    def get_months(self):
+        """
+        This function determines the months of the year to rank
+        Returns:
+            List of the months of the year (1 - 12): all of them, or only the months of the date range and the
+                changed months when the existing file is updated
+        """
+        if self.__update_in_place:
+            return self.__date_range.calendar_months(self.__times)
+        return list(range(1, 13))
+
+    def record_fingerprints(self):
+        """
+        This function records the input fingerprints in the output, once all the month series are ranked
+        """
+        if self.__fingerprints is not None:
+            write_fingerprints(self.__output_file, self.__fingerprints)
+
+    def rank_months(self, months):
+        """
+        This function ranks the NDVI anomalies of the months of the year in one pass
+            The times are grouped by month of the year from their dates, so a missing month is left out of the ranks
+            of its month instead of shifting the months after it
+        Args:
+            months (list): the months of the year (1 - 12) to rank
+        """
         output_data_set = None
         try:
-            # determine the number of years for the month #
-            years = int(self.__number_of_months / 12)
-            if index < (self.__number_of_months % 12):
-                years += 1
-            # load the data for the current month #
-            data = []
-            t = index  # set the input time to the starting index
-            for y in range(0, years):
-                data.append(netcdf.extract_data(self.__input_data_set, 'ndvi_anom', t))
-                t += 12  # increment by 1 year
+            positions = TimeIndex.from_times(self.__times).month_year_positions()[np.array(months, dtype=int) - 1]
+            # load the data of the AOI cells and lay it out by month of the year and year #
+            with span('read', months=len(months)) as s:
+                data = self.__aoi.pack(netcdf.extract_data(self.__input_data_set, 'ndvi_anom', -1))
+                s.add_pixels(data.size)
+                s.add_bytes_read(data.size * 4)
+                month_data = self.__stats.group_by_month(data, positions)
+                del data
             # rank the data by year #
-            ranked_data = self.__stats.rank_parameter(data)
+            ranked_data = self.__stats.rank_stack(month_data, 1, (positions < 0)[:, :, np.newaxis])
             # open file for appending #
-            output_data_set = netcdf.open_dataset(self.__output_file, 'a')
-            # loop thru the years and set the data to the correct time index #
-            t = index
-            for y in range(0, len(ranked_data)):
-                output_data_set.variables['ndvi_anom_pct_rank'][t] = ranked_data[y]
-                t += 12
+            with span('write', months=len(months)) as s:
+                output_data_set = netcdf.open_dataset(self.__output_file, 'a')
+                # set the data to the time index of each month and year, back on the grid #
+                written = netcdf.write_month_year(output_data_set.variables['ndvi_anom_pct_rank'], positions,
+                                                  self.__aoi.unpack(ranked_data, self.__missing))
+                s.add_pixels(written)
+                s.add_bytes_written(written * 4)
         except IOError:
             raise
         except Exception:
@@ -85,26 +133,39 @@ class NormalizedDifferenceVegetationIndexRanking:
                 output_data_set.close()
 
 
-def main():
+def main(args=None):
     """
     This is the main entry point for the program
     """
     script_start = datetime.now()
     try:
-        # initialize a new soil moisture class #
-        rankings = NormalizedDifferenceVegetationIndexRanking()
-        # loop thru the months and rank the NDVI anomalies #
-        print("Ranking NDVI anomaly data...")
-        for index in range(0, 12):
-            rankings.rank_parameter(index)
+        date_range = DateRange.from_args(args)
+        with span('step', step='0202'):
+            # initialize a new soil moisture class #
+            rankings = NormalizedDifferenceVegetationIndexRanking(date_range)
+            # loop thru the months and rank the NDVI anomalies #
+            print("Ranking NDVI anomaly data...")
+            months = rankings.get_months()
+            if len(months) == 0:
+                print("The NDVI rankings are up to date")
+            else:
+                rankings.rank_months(months)
+                rankings.record_fingerprints()
     except IOError as ioe:
         print(ioe)
+        return 1
     except Exception as ex:
         print(ex)
+        return 1
     finally:
         script_end = datetime.now()
         print("Script execution: {}".format(script_end - script_start))
+    return 0
 
 
 if __name__ == '__main__':
-    main()
+    # set up the command line argument parser
+    parser = ArgumentParser()
+    add_date_range_arguments(parser)
+    # execute the program with the supplied options
+    sys.exit(main(parser.parse_args()))
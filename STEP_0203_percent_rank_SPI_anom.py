@@ -1,8 +1,15 @@
 # -*- coding: utf-8 -*-
 import os
+import sys
 from libs.config_reader import ConfigParser
 from libs.statistics_operations import StatisticOperations
+from libs.aoi_mask import get_aoi_mask
 import libs.netcdf_functions as netcdf
+from libs.time_index import TimeIndex
+from libs.profiling import span
+from libs.date_range import DateRange, add_arguments as add_date_range_arguments
+from libs.change_tracking import read_fingerprints, write_fingerprints, get_update_range
+from argparse import ArgumentParser
 import numpy as np
 from datetime import datetime
 
@@ -11,7 +18,13 @@ class StandardizedPrecipitationIndexRanking:
     """
     This is the core processing class for executing all SPI (standardized precipitation index) ranking operations
     """
-    def __init__(self):
+    def __init__(self, date_range=None):
+        """
+        Args:
+            date_range (DateRange): optional range of months that have changed; only the month series that include
+                a month of the range, or a month whose precipitation has changed since the output was ranked, are
+                ranked again when the time dimension of the existing output is unchanged
+        """
         self.__config = ConfigParser()
         self.__stats = StatisticOperations()
         self.__spi_periods = sorted(self.__config.get('spi_periods'))
@@ -23,11 +36,13 @@ class StandardizedPrecipitationIndexRanking:
         self.__latitudes = self.__config.get('latitudes')
         self.__longitudes = self.__config.get('longitudes')
         self.__times = self.__input_data_set.variables['time'][:]
-        self.__number_of_months = len(self.__times)
         self.__missing = -9999.0
-        self.__rows = len(self.__latitudes)
-        self.__columns = len(self.__longitudes)
-        self.__empty_set = np.full((self.__rows, self.__columns), self.__missing)
+        # the cells of the area of interest within the bounds #
+        self.__aoi = get_aoi_mask(self.__config)
+        self.__date_range = date_range if date_range is not None else DateRange()
+        # the fingerprints of the precipitation of each month, recorded by the anomaly step #
+        self.__fingerprints = read_fingerprints(self.__input_data_set)
+        self.__update_in_place = False
         # initialize the output file and prepare internal value lists #
         self.__initialize_ranking_file()
 
@@ -38,6 +53,12 @@ class StandardizedPrecipitationIndexRanking:
             None: File is initialized and referenced in the class
         """
         self.__output_file = os.path.join(self.__output_dir, "STEP_0203_SPI_anomaly_pct_rank_{}.nc".format(self.__region))
+        # keep the existing file when the time dimension is unchanged and only some months are updated #
+        update_range = get_update_range(self.__date_range, read_fingerprints(self.__output_file), self.__fingerprints)
+        if update_range is not None and netcdf.read_times(self.__output_file) == [float(t) for t in self.__times]:
+            self.__date_range = update_range
+            self.__update_in_place = True
+            return
         output_data_set = None
         try:
             # create the output file #
@@ -56,52 +77,49 @@ class StandardizedPrecipitationIndexRanking:
                 lst_rank.missing_value = self.__missing
                 lst_rank.standard_name = "spi_{}_anom_pct_rank".format(p)
                 lst_rank.long_name = "percent ranked SPI anomaly"
-        except IOError as ioe:
-            print(ioe)
-        except Exception as ex:
-            print(ex)
+        except IOError:
+            raise
+        except Exception:
+            raise
         finally:
             if output_data_set is not None:
                 output_data_set.close()
 
-    def __rank_parameter(self, period, index):
+    def __rank_months(self, period, months):
         """
-        This function executes the statistical ranking for a particular parameter and month from the SPI values.
+        This function executes the statistical ranking of the months of the year in one pass from the SPI values.
             The data is written to the out NetCDF file
+            The times are grouped by month of the year from their dates; the missing months and the months without
+            totals (the first period - 1 months of the series) are left out of the ranks and written as missing
         Args:
             period (int): the value of the monthly total period of precipitation used (e.g. 9-month totals to represent a month)
-            index (int): the 0-11 index value of the month to rank
+            months (list): the months of the year (1 - 12) to rank
 
         Returns:
             None: data is directly written to the output file
         """
         output_data_set = None
         try:
-            # open file for appending #
-            output_data_set = netcdf.open_dataset(self.__output_file, 'a')
-            # determine the number of years for the month #
-            years = int(self.__number_of_months / 12)
-            if index < (self.__number_of_months % 12):
-                years += 1
-            # load the data for the current month #
-            data = []
-            t = index  # set the input time to the starting index
-            valid_index = index
-            for y in range(0, years):
-                values = netcdf.extract_data(self.__input_data_set, 'spi_{}_anom'.format(period), t)
-                if np.amax(values) > self.__missing:  # append the data for ranking
-                    data.append(values)
-                else:  # set the output data to missing, and skip to the next year
-                    output_data_set.variables['spi_{}_anom_pct_rank'.format(period)][t] = self.__empty_set
-                    valid_index += 12
-                t += 12  # increment by 1 year
+            positions = TimeIndex.from_times(self.__times).month_year_positions()[np.array(months, dtype=int) - 1]
+            # load the data of the AOI cells and lay it out by month of the year and year #
+            with span('read', period=period, months=len(months)) as s:
+                data = self.__aoi.pack(netcdf.extract_data(self.__input_data_set, 'spi_{}_anom'.format(period), -1))
+                s.add_pixels(data.size)
+                s.add_bytes_read(data.size * 4)
+                month_data = self.__stats.group_by_month(data, positions)
+                del data
+            # skip the years without any SPI value #
+            gaps = (positions < 0) | (np.amax(month_data, axis=2) <= self.__missing)
             # rank the data by year #
-            ranked_data = self.__stats.rank_parameter(data)
-            # loop thru the years and set the data to the correct time index #
-            t = valid_index
-            for y in range(0, len(ranked_data)):
-                output_data_set.variables['spi_{}_anom_pct_rank'.format(period)][t] = ranked_data[y]
-                t += 12
+            ranked_data = self.__stats.rank_stack(month_data, 1, gaps[:, :, np.newaxis])
+            # open file for appending #
+            with span('write', period=period, months=len(months)) as s:
+                output_data_set = netcdf.open_dataset(self.__output_file, 'a')
+                # set the data to the time index of each month and year, back on the grid #
+                written = netcdf.write_month_year(output_data_set.variables['spi_{}_anom_pct_rank'.format(period)],
+                                                  positions, self.__aoi.unpack(ranked_data, self.__missing))
+                s.add_pixels(written)
+                s.add_bytes_written(written * 4)
         except IOError:
             raise
         except Exception:
@@ -117,32 +135,52 @@ class StandardizedPrecipitationIndexRanking:
             None
         """
         # loop thru the parameters in the SPI anomaly file #
+        updated = not self.__update_in_place
         for p in self.__spi_periods:
-            # rank each month series #
-            for index in range(0, 12):
-                self.__rank_parameter(p, index)
+            months = list(range(1, 13))
+            if self.__update_in_place:
+                # the totals of the (p - 1) months after the range also include months of the range #
+                months = self.__date_range.extend(p - 1).calendar_months(self.__times)
+                if len(months) == 0:
+                    print("-- SPI rankings are up to date for {}-month totals".format(p))
+                    continue
+                updated = True
+            # rank the month series of all the months #
+            self.__rank_months(p, months)
             print("-- SPI anomalies ranked for {}-month totals".format(p))
+        if updated and self.__fingerprints is not None:
+            # record the precipitation of the rankings once all the month series are ranked #
+            write_fingerprints(self.__output_file, self.__fingerprints)
 
 
-def main():
+def main(args=None):
     """
     This is the main entry point for the program
     """
     script_start = datetime.now()
     try:
-        # initialize a new soil moisture class #
-        rankings = StandardizedPrecipitationIndexRanking()
-        # loop thru the months and rank the SPI anomalies #
-        print("Ranking SPI anomaly data...")
-        rankings.rank_spi_parameters()
+        date_range = DateRange.from_args(args)
+        with span('step', step='0203'):
+            # initialize a new soil moisture class #
+            rankings = StandardizedPrecipitationIndexRanking(date_range)
+            # loop thru the months and rank the SPI anomalies #
+            print("Ranking SPI anomaly data...")
+            rankings.rank_spi_parameters()
     except IOError as ioe:
         print(ioe)
+        return 1
     except Exception as ex:
         print(ex)
+        return 1
     finally:
         script_end = datetime.now()
         print("Script execution: {}".format(script_end - script_start))
+    return 0
 
 
 if __name__ == '__main__':
-    main()
+    # set up the command line argument parser
+    parser = ArgumentParser()
+    add_date_range_arguments(parser)
+    # execute the program with the supplied options
+    sys.exit(main(parser.parse_args()))
@@ -1,19 +1,32 @@
 # -*- coding: utf-8 -*-
 import os
+import sys
 from libs.config_reader import ConfigParser
 from libs.file_operations import FileHandler
 from libs.statistics_operations import StatisticOperations
+from libs.aoi_mask import get_aoi_mask
 import libs.netcdf_functions as netcdf
+from libs.time_index import TimeIndex
+from libs.profiling import span
+from libs.date_range import DateRange, add_arguments as add_date_range_arguments
+from libs.change_tracking import get_file_fingerprints, read_fingerprints, write_fingerprints, get_update_range
+from argparse import ArgumentParser
 import numpy as np
 import re
-from datetime import datetime, date
+from datetime import datetime
 
 
 class SoilMoistureRanking:
     """
     This is the core processing class for executing all soil moisture ranking operations
     """
-    def __init__(self):
+    def __init__(self, date_range=None):
+        """
+        Args:
+            date_range (DateRange): optional range of months that have changed; only the months of the year within
+                the range, or of a month whose Soil Moisture file has been written since the output was ranked, are
+                ranked again when the time dimension of the existing output is unchanged
+        """
         self.__config = ConfigParser()
         self.__stats = StatisticOperations()
         self.__working_dir = self.__config.get('scratch_dir').replace("\\", '/') + '/SM'
@@ -33,48 +46,17 @@ class SoilMoistureRanking:
         self.__longitudes = self.__config.get('longitudes')
         self.__times = []
         self.__missing = -9999.0
-        self.moisture_data = {}
+        # the cells of the area of interest within the bounds #
+        self.__aoi = get_aoi_mask(self.__config)
+        self.__parameters = ['RootZone_SM', 'RootZone2_SM', 'TotalColumn_SM']
+        self.moisture_data = None
+        self.__date_range = date_range if date_range is not None else DateRange()
+        self.__months_to_update = None
+        self.__positions = None
+        self.__fingerprints = None
         # initialize the output file and prepare internal value lists #
         self.__initialize_ranking_file()
 
-    def __get_calendar_times(self):
-        """
-        This function builds a list of the valid times as days since Jan 1, 1900
-
-        Returns:
-            List (floats) of the valid times as number of days since Jan 1, 1900
-        """
-        origin_date = date(1900, 1, 1)
-        times = []
-        for f in self.__netcdf_files:
-            (year, month) = self.__working_file_match.match(f).groups()
-            test_date = date(int(year), int(month), 1)
-            time_delta = test_date - origin_date
-            times.append(float(time_delta.days))
-        return times
-
-    def __get_moisture_files_by_month(self, month):
-        """
-        This function reads the working data directory to find available files to process by month
-        Returns:
-            List of fully-qualified names
-        """
-        results = []
-        try:
-            test_pattern = self.__file_patterns['sm_netcdf_regex'].split('(0')[0] + str(month) + "\\.nc"
-            file_test = re.compile(r'{}'.format(test_pattern))
-
-            results = [
-                '{}/{}'.format(self.__working_dir, f) for f in os.listdir(self.__working_dir)
-                if file_test.match(f)
-            ]
-        except IOError as ioe:
-            print(ioe)
-        except Exception as ex:
-            print(ex)
-        finally:
-            return results
-
     def __initialize_ranking_file(self):
         self.__output_file = os.path.join(self.__output_dir, "STEP_0204_SM_pct_rank_{}.nc".format(self.__region))
         output_data_set = None
@@ -82,7 +64,18 @@ class SoilMoistureRanking:
             # get a sorted list of the NetCDF files #
             self.__netcdf_files = sorted(self.__fileHandler.get_working_file_names('sm_netcdf_regex'))
             # get the list of valid times #
-            self.__times = self.__get_calendar_times()
+            self.__times = TimeIndex.from_file_names(self.__netcdf_files, self.__working_file_match).times
+            # the fingerprints of the Soil Moisture files of each month #
+            self.__fingerprints = self.__aoi.tag_fingerprints(get_file_fingerprints({
+                ''.join(self.__working_file_match.match(f).groups()): os.path.join(self.__working_dir, f)
+                for f in self.__netcdf_files
+            }))
+            # keep the existing file when the time dimension is unchanged and only some months are updated #
+            update_range = get_update_range(self.__date_range, read_fingerprints(self.__output_file),
+                                            self.__fingerprints)
+            if update_range is not None and netcdf.read_times(self.__output_file) == self.__times:
+                self.__months_to_update = update_range.calendar_months(self.__times)
+                return
             # create the output file #
             out_properties = {
                 'latitudes': self.__latitudes,
@@ -110,62 +103,79 @@ class SoilMoistureRanking:
             total_column_rank.missing_value = self.__missing
             total_column_rank.standard_name = "total_column_sm_pct_rank"
             total_column_rank.long_name = "percent ranked total column soil moisture"
-        except IOError as ioe:
-            print(ioe)
-        except Exception as ex:
-            print(ex)
-        finally:
-            if output_data_set is not None:
-                output_data_set.close()
-
-    def get_month_order(self):
-        month_list = []
-        try:
-            # determine the order of the months by checking the first 12 sorted file names #
-            for m in range(0, 12):
-                null, month = self.__working_file_match.match(self.__netcdf_files[m]).groups()
-                month_list.append(month)
         except IOError:
             raise
         except Exception:
             raise
         finally:
-            return month_list
+            if output_data_set is not None:
+                output_data_set.close()
 
-    def load_soil_moisture_data(self, month):
-        try:
-            files = self.__get_moisture_files_by_month(month)
-            # set the placeholder arrays #
-            self.moisture_data['RootZone_SM'] = []
-            self.moisture_data['RootZone2_SM'] = []
-            self.moisture_data['TotalColumn_SM'] = []
+    def get_months(self):
+        """
+        This function determines the months of the year to rank
+        Returns:
+            List of the months of the year (1 - 12): all of them, or only the months of the date range and the
+                changed months when the existing file is updated
+        """
+        if self.__months_to_update is not None:
+            return self.__months_to_update
+        return list(range(1, 13))
+
+    def record_fingerprints(self):
+        """
+        This function records the fingerprints of the Soil Moisture files in the output, once the months are ranked
+        """
+        write_fingerprints(self.__output_file, self.__fingerprints)
 
-            for f in files:
-                data_set = netcdf.open_dataset(f)
-                # get root zone values #
-                self.moisture_data['RootZone_SM'].append(netcdf.extract_data(data_set, 'RootZone_SM'))
-                # get root zone values #
-                self.moisture_data['RootZone2_SM'].append(netcdf.extract_data(data_set, 'RootZone2_SM'))
-                # get root zone values #
-                self.moisture_data['TotalColumn_SM'].append(netcdf.extract_data(data_set, 'TotalColumn_SM'))
-                # close data file #
-                data_set.close()
+    def load_soil_moisture_data(self, months):
+        """
+        This function loads the three soil moisture parameters of the months of the year of every year into one
+            stacked array (parameters, months, years, cells) of the AOI cells
+            The files are laid out by month of the year and year from their dates, so a missing month is a gap of its
+            year instead of shifting the months after it
+        Args:
+            months (list): the months of the year (1 - 12) to load
+        """
+        try:
+            time_index = TimeIndex.from_file_names(self.__netcdf_files, self.__working_file_match)
+            self.__positions = time_index.month_year_positions()[np.array(months, dtype=int) - 1]
+            with span('read', months=len(months)) as s:
+                self.moisture_data = np.full((len(self.__parameters),) + self.__positions.shape +
+                                             (len(self.__aoi.cells),), self.__missing)
+                for m, y in zip(*np.nonzero(self.__positions >= 0)):
+                    file_path = os.path.join(self.__working_dir, self.__netcdf_files[self.__positions[m, y]])
+                    data_set = netcdf.open_dataset(file_path)
+                    # get the root zone, root zone2 and total column values #
+                    for i, p in enumerate(self.__parameters):
+                        self.moisture_data[i, m, y] = self.__aoi.pack(netcdf.extract_data(data_set, p))
+                    # close data file #
+                    data_set.close()
+                    s.add_file_read(file_path)
         except IOError:
             raise
         except Exception:
             raise
 
-    def rank_parameter(self, parameter, index):
+    def rank_parameters(self):
+        """
+        This function ranks the three soil moisture parameters of the loaded months in one pass, and writes them to
+            the output file in one open
+        """
         output_data_set = None
-        out_parameter = '{}_pct_rank'.format(parameter)
         try:
-            ranked_data = self.__stats.rank_parameter(self.moisture_data[parameter])
+            gaps = (self.__positions < 0)[np.newaxis, :, :, np.newaxis]
+            ranked_data = self.__stats.rank_stack(self.moisture_data, 2, gaps)
             # open file for appending #
-            output_data_set = netcdf.open_dataset(self.__output_file, 'a')
-            # loop thru the years and set the data to the correct time index #
-            for y in range(0, len(ranked_data)):
-                output_data_set.variables[out_parameter][index] = ranked_data[y]
-                index += 12
+            with span('write', parameters=len(self.__parameters)) as s:
+                output_data_set = netcdf.open_dataset(self.__output_file, 'a')
+                for i, p in enumerate(self.__parameters):
+                    out_parameter = '{}_pct_rank'.format(p)
+                    # set the data to the time index of each month and year, back on the grid #
+                    written = netcdf.write_month_year(output_data_set.variables[out_parameter], self.__positions,
+                                                      self.__aoi.unpack(ranked_data[i], self.__missing))
+                    s.add_pixels(written)
+                    s.add_bytes_written(written * 4)
         except IOError:
             raise
         except Exception:
@@ -175,36 +185,43 @@ class SoilMoistureRanking:
                 output_data_set.close()
 
 
-def main():
+def main(args=None):
     """
     This is the main entry point for the program
     """
     script_start = datetime.now()
     try:
-        # initialize a new soil moisture class #
-        rankings = SoilMoistureRanking()
-        # loop thru the months and rank the three soil moisture parameters #
-        for index, month in enumerate(rankings.get_month_order()):
-            print("Ranking data for month: {}".format(month))
-            # load data #
-            rankings.load_soil_moisture_data(month)
-
-            # rank root zone data #
-            rankings.rank_parameter('RootZone_SM', index)
-
-            # rank root zone2 data #
-            rankings.rank_parameter('RootZone2_SM', index)
-
-            # rank total column data #
-            rankings.rank_parameter('TotalColumn_SM', index)
+        date_range = DateRange.from_args(args)
+        with span('step', step='0204'):
+            # initialize a new soil moisture class #
+            rankings = SoilMoistureRanking(date_range)
+            # rank the three soil moisture parameters of the months #
+            months = rankings.get_months()
+            if len(months) == 0:
+                print("The soil moisture rankings are up to date")
+            else:
+                print("Ranking data for months: {}".format(', '.join('{:02d}'.format(m) for m in months)))
+                # load data #
+                rankings.load_soil_moisture_data(months)
+
+                # rank the root zone, root zone2 and total column data #
+                rankings.rank_parameters()
+                rankings.record_fingerprints()
     except IOError as ioe:
         print(ioe)
+        return 1
     except Exception as ex:
         print(ex)
+        return 1
     finally:
         script_end = datetime.now()
         print("Script execution: {}".format(script_end - script_start))
+    return 0
 
 
 if __name__ == '__main__':
-    main()
+    # set up the command line argument parser
+    parser = ArgumentParser()
+    add_date_range_arguments(parser)
+    # execute the program with the supplied options
+    sys.exit(main(parser.parse_args()))
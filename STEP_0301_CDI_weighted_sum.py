@@ -1,23 +1,49 @@
 # -*- coding: utf-8 -*-
+import json
 import os
+import re
 import sys
 from libs.config_reader import ConfigParser
 import libs.netcdf_functions as netcdf
+from libs.profiling import span
+from libs.aoi_mask import get_aoi_mask
+from libs.date_range import DateRange, add_arguments as add_date_range_arguments
+from libs.time_index import TimeIndex
+from libs.change_tracking import read_fingerprints, set_fingerprints, combine_fingerprints, get_update_range, \
+    extend_update_range, SPI_FINGERPRINTS_ATTRIBUTE
+from argparse import ArgumentParser
 import numpy as np
-import numpy.ma as ma
 from datetime import datetime
 
 
 class CompositeDroughtIndicator:
     """
     This is the core processing class for executing all CDI operations
+        Besides the weights of the CDI, the configuration may list named weight scenarios
+        (cdi_parameters.scenarios, e.g. {"no_sm": {"lst": 0.3, "ndvi": 0.3, "spi": 0.4, "sm": 0.0}});
+        the ranked inputs are read once and the weighted sums of all the scenarios are computed together,
+        each scenario in its own variable (cdi_weighted_sum_<name>) next to cdi_weighted_sum
+        The dates are those that the inputs weighted in the CDI have in common, so a scenario never changes the dates
+        of the CDI; a scenario has missing values for the dates that one of its inputs does not have (e.g. the soil
+        moisture, which usually lags the other inputs), and those dates are listed in the unavailable_dates attribute
+        of its variable so the ranking step leaves them out of the ranks
     """
-    def __init__(self):
+    def __init__(self, date_range=None):
+        """
+        Args:
+            date_range (DateRange): optional range of months that have changed; only the dates in the months of the
+                year within the range, or of a month whose inputs have changed since the output was summed, are
+                summed again when the time dimension of the existing output is unchanged
+        """
         self.__config = ConfigParser()
         self.__output_dir = self.__config.get('output_dir').replace("\\", '/')
         self.__region = self.__config.get('region_name')
         self.__bounds = self.__config.get('bounds')
         self.__cdi_weights = self.__config.get('cdi_parameters', 'weights')
+        # the weights of each output variable: the CDI weights, then the named scenarios #
+        self.__scenarios = [('cdi_weighted_sum', self.__cdi_weights)]
+        for name, weights in sorted(self.__config.get('cdi_parameters').get('scenarios', {}).items()):
+            self.__scenarios.append(('cdi_weighted_sum_{}'.format(name), weights))
         self.__parameter_names = self.__config.get('cdi_parameters', 'names')
         self.__ranking_files = {
             "lst": os.path.join(self.__output_dir, "STEP_0201_LST_anomaly_pct_rank_{}.nc".format(self.__region)),
@@ -26,43 +52,57 @@ class CompositeDroughtIndicator:
             "sm": os.path.join(self.__output_dir, "STEP_0204_SM_pct_rank_{}.nc".format(self.__region))
         }
         self.__cdi_inputs = []
+        # the inputs with a weight > 0.0 in the CDI itself, which determine the dates #
+        self.__main_inputs = [param for param in self.__cdi_weights if self.__cdi_weights[param] > 0]
         self.__datasets = {}
         self.__common_times = []
+        self.__common_index = TimeIndex()
         self.__times = {}
-        self.__last_time_index = 0
+        self.__time_indices = {}
         self.__latitudes = self.__config.get('latitudes')
         self.__longitudes = self.__config.get('longitudes')
         self.__missing = -9999.0
-        self.__rows = len(self.__latitudes)
-        self.__columns = len(self.__longitudes)
-        self.__empty_set = np.full((self.__rows, self.__columns), self.__missing)
+        # the cells of the area of interest within the bounds #
+        self.__aoi = get_aoi_mask(self.__config)
+        # the number of dates summed at once #
+        self.__block_size = 120
+        self.__date_range = date_range if date_range is not None else DateRange()
+        self.__extension = 0
+        if any(weights.get('spi', 0) > 0 for null, weights in self.__scenarios):
+            # the multi-month SPI totals after the range also include months of the range #
+            self.__extension = max(self.__config.get('spi_periods')) - 1
         self.__check_weight_totals()
         self.__get_data_sets()
 
     def __check_weight_totals(self):
         """
-        This function verifies the total weights set in the configuration
-         and alerts the user if the total value is not 1.0
+        This function verifies the total weights set in the configuration, and the names of the weight scenarios,
+         and alerts the user if a total value is not 1.0
         Returns:
             None: Exits if there is invalid input
         """
-        total_weight = 0
-        for param in self.__cdi_weights:
-            total_weight += self.__cdi_weights[param]
-        if total_weight != 1.0:
-            print("Total CDI weight is not equal to 1.0.\nPlease adjust the weights in the configuration to total 1.0")
-            sys.exit(1)
+        for variable, weights in self.__scenarios:
+            if not re.match(r'^\w+$', variable):
+                print("Invalid CDI weight scenario name: {}\nPlease use letters, digits and underscores".format(variable))
+                sys.exit(1)
+            total_weight = 0
+            for param in weights:
+                total_weight += weights[param]
+            if not np.isclose(total_weight, 1.0):
+                print("Total CDI weight is not equal to 1.0 for {}.\nPlease adjust the weights in the configuration "
+                      "to total 1.0".format(variable))
+                sys.exit(1)
 
     def __get_cdi_inputs(self):
         """
         This function loads the CDI input weights form the configuration file and adds any weights > 0.0 to the list of inputs to use
             This allows easy adjustment of the individual parameters and their weights for the CDI
+            An input is used when it has a weight > 0.0 in the CDI or in any of the weight scenarios
         Returns:
             None: parameter strings are stored in the class
         """
         for param in self.__cdi_weights:
-            weight = self.__cdi_weights[param]
-            if weight > 0:
+            if any(weights.get(param, 0) > 0 for null, weights in self.__scenarios):
                 self.__cdi_inputs.append(param)
 
     def __get_data_sets(self):
@@ -80,108 +120,169 @@ class CompositeDroughtIndicator:
         except Exception:
             raise
 
-    def __get_time_range(self, source):
-        """
-        This function gets the indices from an input time dimension where the NetCDF dates match the common dates between all inputs
-        Args:
-            source (str): the name of the input parameter
-
-        Returns:
-            list of indices matching the common dates to use
-        """
-        try:
-            start_idx = 0
-            end_idx = 0
-            date_list = self.__times[source]
-            for d, date in enumerate(date_list):
-                if date == self.__common_times[0]:
-                    start_idx = d
-                elif date == self.__common_times[self.__last_time_index]:
-                    end_idx = d + 1
-            return range(start_idx, end_idx)
-        except ValueError:
-            raise
-        except Exception:
-            raise
-
     def get_common_dates(self):
         """
-        This function compares the dates of all the CDI inputs to determine what dates all inputs have in common
+        This function compares the dates of the inputs weighted in the CDI to determine what dates they have in
+            common, and maps the common dates to their time indices in each input (the inputs may have gaps)
+            An input used only by scenarios may not have every common date; its missing dates map to -1
         Returns:
             None: values are directly stored to the class
         """
         try:
-            sets = []
-            # load the time arrays from the ranking files #
+            # load the time axes from the ranking files #
+            for param in self.__cdi_inputs:
+                self.__times[param] = TimeIndex.from_times(netcdf.extract_data(self.__datasets[param], 'time', -1))
+            # find the common dates between the inputs of the CDI #
+            first = self.__times[self.__main_inputs[0]]
+            self.__common_index = first.intersection(*[self.__times[p] for p in self.__main_inputs[1:]])
+            self.__common_times = self.__common_index.times
+            # the positions of the common dates in each input (-1 where an input of the scenarios has no value) #
             for param in self.__cdi_inputs:
-                self.__times[param] = netcdf.extract_data(self.__datasets[param], 'time', -1)
-                sets.append(set(self.__times[param]))
-            # find the common dates between the four lists #
-            intersections = set.intersection(*sets)
-            date_list = list(intersections)
-            self.__common_times = sorted(date_list)
-            self.__last_time_index = len(self.__common_times) - 1
+                self.__time_indices[param] = self.__times[param].positions(self.__common_index)
         except IOError:
             raise
         except Exception:
             raise
 
+    def __get_unavailable_dates(self, weights):
+        """
+        This function finds the common dates that an input weighted in a scenario does not have
+        Args:
+            weights (dictionary): the weights of the scenario
+
+        Returns:
+            List of 'YYYYMM' dates
+        """
+        unavailable = np.zeros(len(self.__common_index), dtype=bool)
+        for param in self.__cdi_inputs:
+            if weights.get(param, 0) > 0:
+                unavailable |= self.__time_indices[param] < 0
+        return [d for d, u in zip(self.__common_index.dates(), unavailable.tolist()) if u]
+
+    def __get_fingerprints(self):
+        """
+        This function combines the input fingerprints recorded in the ranking files, for every date of any input
+        Returns:
+            Dictionary of 'YYYYMM' date: fingerprint, or None if an input has none recorded
+        """
+        fingerprint_sets = [read_fingerprints(self.__datasets[param]) for param in self.__cdi_inputs]
+        if any(f is None for f in fingerprint_sets):
+            return None
+        dates = sorted(set().union(*fingerprint_sets))
+        # changing the weights of the CDI or of a scenario changes every date #
+        weights = json.dumps(self.__scenarios, sort_keys=True)
+        return combine_fingerprints(fingerprint_sets + [{d: weights for d in dates}], dates)
+
     def compute_sum(self):
         """
         This function creates the weighted sum for each date of the CDI
             If any input data array is completely empty for a given data, the sum is set to empty data for that date
+            (only the inputs with a weight > 0.0 in a scenario count for its sums)
+            The inputs are read as blocks of dates, and each block is summed as a single weighted contraction over the
+            cells of the AOI
+            The existing file is updated in place when it holds the leading common dates: the new dates are appended,
+            and since the ranked inputs only change for the months of the year of the new dates (and of the date
+            range, and of the months whose inputs have changed), only the dates in those months are summed again
+            The weights of all the scenarios form a (scenarios, parameters) matrix, so every scenario is summed in
+            the same contraction
         Returns:
             None: data is written directly to the output NetCDF file
         """
         output_file = os.path.join(self.__output_dir, "STEP_0301_CDI_weighted_sum_{}.nc".format(self.__region))
         output_data_set = None
         try:
-            # create the output file #
-            print("Initializing the weighted sum file.")
-            out_properties = {
-                'latitudes': self.__latitudes,
-                'longitudes': self.__longitudes,
-                'times': self.__common_times,
-                'time_units': 'days since 1900-01-01 00:00:00.0 UTC'
-            }
-            output_data_set = netcdf.initialize_dataset(output_file, out_properties)
-            # variables #
-            cdi_sum = output_data_set.createVariable('cdi_weighted_sum', 'float32', ('time', 'latitude', 'longitude'))
-            cdi_sum.units = '1'
-            cdi_sum.missing_value = self.__missing
-            cdi_sum.standard_name = "cdi_weighted_sum"
-            cdi_sum.long_name = "Weighted Composite Drought Indicator"
-
-            # determine the data ranges for each parameter #
-            data_ranges = {}
-            for param in self.__cdi_inputs:
-                data_ranges[param] = self.__get_time_range(param)
+            months_to_update = None
+            common_times = self.__common_times
+            fingerprints = self.__get_fingerprints()
+            spi_fingerprints = read_fingerprints(self.__datasets['spi']) if 'spi' in self.__datasets else None
+            update_range = get_update_range(self.__date_range, read_fingerprints(output_file), fingerprints)
+            # the months after a changed SPI month change with the multi-month totals, not those after a changed month
+            # of the other inputs #
+            update_range = extend_update_range(update_range, self.__extension,
+                                               read_fingerprints(output_file, SPI_FINGERPRINTS_ATTRIBUTE),
+                                               spi_fingerprints)
+            variables = [variable for variable, null in self.__scenarios]
+            append_index = netcdf.get_append_index(output_file, common_times, variables)
+            if append_index is not None and (append_index < len(common_times) or update_range is not None):
+                # update the existing file in place #
+                months_to_update = set(self.__common_index.month_of_year[append_index:].tolist())
+                if update_range is not None:
+                    months_to_update.update(update_range.calendar_months(common_times))
+                months_to_update = sorted(months_to_update)
+                if len(months_to_update) == 0:
+                    print("The weighted sum file is up to date")
+                    return
+                print("Updating the weighted sum file for months: {}".format(months_to_update))
+                output_data_set = netcdf.open_dataset(output_file, 'a')
+                if append_index < len(common_times):
+                    # append the new dates #
+                    output_data_set.variables['time'][append_index:] = common_times[append_index:]
+                cdi_sums = [output_data_set.variables[v] for v in variables]
+            else:
+                # create the output file #
+                print("Initializing the weighted sum file.")
+                out_properties = {
+                    'latitudes': self.__latitudes,
+                    'longitudes': self.__longitudes,
+                    'times': self.__common_times,
+                    'time_units': 'days since 1900-01-01 00:00:00.0 UTC',
+                    'unlimited_time': True
+                }
+                output_data_set = netcdf.initialize_dataset(output_file, out_properties)
+                # variables #
+                cdi_sums = []
+                for variable, weights in self.__scenarios:
+                    cdi_sum = output_data_set.createVariable(variable, 'float32', ('time', 'latitude', 'longitude'))
+                    cdi_sum.units = '1'
+                    cdi_sum.missing_value = self.__missing
+                    cdi_sum.standard_name = variable
+                    cdi_sum.long_name = "Weighted Composite Drought Indicator"
+                    cdi_sums.append(cdi_sum)
+            # record the weights of each variable, and the dates it has no value for #
+            for cdi_sum, (variable, weights) in zip(cdi_sums, self.__scenarios):
+                cdi_sum.weights = json.dumps(weights, sort_keys=True)
+                cdi_sum.unavailable_dates = json.dumps(self.__get_unavailable_dates(weights))
+
+            # select the dates to sum #
+            time_indices = list(range(0, len(self.__common_times)))
+            if months_to_update is not None:
+                time_indices = np.flatnonzero(np.isin(self.__common_index.month_of_year, months_to_update)).tolist()
+            # the (scenario, parameter) weights, and the inputs each scenario uses #
+            weights = np.array([[w.get(param, 0.0) for param in self.__cdi_inputs] for null, w in self.__scenarios])
+            used = (weights > 0).astype(float)
 
-            # load the data from each source using the common dates #
+            # load the data from each source using the common dates, one block of dates at a time #
             print("Processing CDI values...")
-            for t in range(0, len(self.__common_times)):
-                cdi_weight_sum = None
-                valid_data = True
-                for param in self.__cdi_inputs:
-                    # get the applicable data #
-                    data = ma.masked_equal(netcdf.extract_data(self.__datasets[param], self.__parameter_names[param],
-                                                               data_ranges[param][t]), self.__missing)
-                    # verify we have data to add to the sum #
-                    if np.amax(data) < 0.0:
-                        valid_data = False
-                    else:
-                        # weight the data #
-                        weighted_data = data * self.__cdi_weights[param]
-                        # update the weighted sum #
-                        if cdi_weight_sum is None:
-                            cdi_weight_sum = weighted_data
-                        else:
-                            cdi_weight_sum += weighted_data
-                # add the weighted sum to the NetCDF file #
-                if valid_data:
-                    cdi_sum[t] = cdi_weight_sum.filled(self.__missing)
-                else:
-                    cdi_sum[t] = self.__empty_set
+            with span('sum', times=len(time_indices)) as s:
+                for b in range(0, len(time_indices), self.__block_size):
+                    block = time_indices[b:b + self.__block_size]
+                    # stack the inputs as (parameter, time, cell) #
+                    data = np.empty((len(self.__cdi_inputs), len(block), len(self.__aoi.cells)))
+                    for p, param in enumerate(self.__cdi_inputs):
+                        positions = self.__time_indices[param][block]
+                        # the dates an input of the scenarios does not have are missing #
+                        available = positions >= 0
+                        data[p][~available] = self.__missing
+                        if np.any(available):
+                            data[p][available] = self.__aoi.pack(netcdf.extract_data_indices(
+                                self.__datasets[param], self.__parameter_names[param],
+                                positions[available].tolist()))
+                    missing = data == self.__missing
+                    # a date is empty if any input has no valid value >= 0.0 #
+                    empty_inputs = np.amax(np.where(missing, -np.inf, data), axis=2) < 0.0
+                    # weight and sum the inputs of every scenario (in the order of the inputs, as a sum of each weighted input) #
+                    cdi_weight_sum = np.einsum('sp,ptc->stc', weights, data)
+                    cdi_weight_sum[np.einsum('sp,ptc->stc', used, missing.astype(float)) > 0] = self.__missing
+                    cdi_weight_sum[np.dot(used, empty_inputs) > 0] = self.__missing
+                    s.add_pixels(data.size)
+                    # add the weighted sums to the NetCDF file, back on the grid #
+                    for i, cdi_sum in enumerate(cdi_sums):
+                        cdi_sum[netcdf.time_selection(block)] = self.__aoi.unpack(cdi_weight_sum[i], self.__missing)
+            if fingerprints is not None:
+                # record the inputs of the sums once all the dates are written #
+                set_fingerprints(output_data_set, fingerprints)
+                if spi_fingerprints is not None:
+                    set_fingerprints(output_data_set, spi_fingerprints, SPI_FINGERPRINTS_ATTRIBUTE)
         except ValueError:
             raise
         except IOError:
@@ -193,28 +294,38 @@ class CompositeDroughtIndicator:
                 output_data_set.close()
 
 
-def main():
+def main(args=None):
     """
     This is the main entry point for the program
     """
     script_start = datetime.now()
     try:
-        # initialize a new soil moisture class #
-        cdi = CompositeDroughtIndicator()
-        # get the common dates between the sets #
-        cdi.get_common_dates()
-        # compute the weighted sum #
-        cdi.compute_sum()
+        date_range = DateRange.from_args(args)
+        with span('step', step='0301'):
+            # initialize a new soil moisture class #
+            cdi = CompositeDroughtIndicator(date_range)
+            # get the common dates between the sets #
+            cdi.get_common_dates()
+            # compute the weighted sum #
+            cdi.compute_sum()
     except ValueError as ve:
         print(ve)
+        return 1
     except IOError as ioe:
         print(ioe)
+        return 1
     except Exception as ex:
         print(ex)
+        return 1
     finally:
         script_end = datetime.now()
         print("Script execution: {}".format(script_end - script_start))
+    return 0
 
 
 if __name__ == '__main__':
-    main()
+    # set up the command line argument parser
+    parser = ArgumentParser()
+    add_date_range_arguments(parser)
+    # execute the program with the supplied options
+    sys.exit(main(parser.parse_args()))
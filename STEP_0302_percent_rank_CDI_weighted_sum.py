@@ -1,8 +1,18 @@
 # -*- coding: utf-8 -*-
+import json
 import os
+import sys
+import re
 from libs.config_reader import ConfigParser
 from libs.statistics_operations import StatisticOperations
+from libs.aoi_mask import get_aoi_mask
 import libs.netcdf_functions as netcdf
+from libs.time_index import TimeIndex
+from libs.profiling import span
+from libs.date_range import DateRange, add_arguments as add_date_range_arguments
+from libs.change_tracking import read_fingerprints, write_fingerprints, get_update_range, extend_update_range, \
+    SPI_FINGERPRINTS_ATTRIBUTE
+from argparse import ArgumentParser
 import numpy as np
 from datetime import datetime
 
@@ -10,8 +20,16 @@ from datetime import datetime
 class CompositeDroughtIndicatorRanking:
     """
     This is the core processing class for executing all CDI ranking operations
+        The weighted sum of the CDI (cdi_weighted_sum) and of each weight scenario (cdi_weighted_sum_<name>) is ranked
+        to its own variable (cdi_wt_sum_pr and cdi_wt_sum_pr_<name>)
     """
-    def __init__(self):
+    def __init__(self, date_range=None):
+        """
+        Args:
+            date_range (DateRange): optional range of months that have changed; only the month series that include
+                a month of the range, a new month, or a month whose inputs have changed since the output was ranked,
+                are ranked again when the existing output is updated
+        """
         self.__config = ConfigParser()
         self.__stats = StatisticOperations()
         self.__output_dir = self.__config.get('output_dir').replace("\\", '/')
@@ -22,8 +40,25 @@ class CompositeDroughtIndicatorRanking:
         self.__latitudes = self.__config.get('latitudes')
         self.__longitudes = self.__config.get('longitudes')
         self.__times = self.__input_data_set.variables['time'][:]
+        # the weighted sums of the CDI and of the weight scenarios, and their ranked variables #
+        self.__variables = sorted(v for v in self.__input_data_set.variables if re.match(r'^cdi_weighted_sum(_\w+)?$', v))
+        self.__ranked_variables = [v.replace('cdi_weighted_sum', 'cdi_wt_sum_pr', 1) for v in self.__variables]
         self.__number_of_months = len(self.__times)
         self.__missing = -9999.0
+        # the cells of the area of interest within the bounds #
+        self.__aoi = get_aoi_mask(self.__config)
+        self.__date_range = date_range if date_range is not None else DateRange()
+        # the fingerprints of the inputs of each month, recorded by the weighted sum step #
+        self.__fingerprints = read_fingerprints(self.__input_data_set)
+        self.__spi_fingerprints = read_fingerprints(self.__input_data_set, SPI_FINGERPRINTS_ATTRIBUTE)
+        self.__extension = 0
+        cdi_parameters = self.__config.get('cdi_parameters')
+        scenario_weights = [cdi_parameters['weights']] + list(cdi_parameters.get('scenarios', {}).values())
+        if any(weights.get('spi', 0) > 0 for weights in scenario_weights):
+            # the multi-month SPI totals after the range also include months of the range #
+            self.__extension = max(self.__config.get('spi_periods')) - 1
+        self.__update_in_place = False
+        self.__append_index = self.__number_of_months
         # initialize the output file and prepare internal value lists #
         self.__initialize_ranking_file()
 
@@ -31,51 +66,121 @@ class CompositeDroughtIndicatorRanking:
         self.__output_file = os.path.join(self.__output_dir, "STEP_0302_CDI_pct_rank_{}.nc".format(self.__region))
         output_data_set = None
         try:
+            # keep the existing file when it holds the leading months, and append the new months #
+            update_range = get_update_range(self.__date_range, read_fingerprints(self.__output_file), self.__fingerprints)
+            # only the months after a changed SPI month were summed again with the multi-month totals #
+            update_range = extend_update_range(update_range, self.__extension,
+                                               read_fingerprints(self.__output_file, SPI_FINGERPRINTS_ATTRIBUTE),
+                                               self.__spi_fingerprints)
+            append_index = netcdf.get_append_index(self.__output_file, self.__times, self.__ranked_variables)
+            if append_index is not None and (append_index < self.__number_of_months or update_range is not None):
+                self.__date_range = update_range if update_range is not None else DateRange()
+                self.__update_in_place = True
+                self.__append_index = append_index
+                if append_index < self.__number_of_months:
+                    output_data_set = netcdf.open_dataset(self.__output_file, 'a')
+                    output_data_set.variables['time'][append_index:] = self.__times[append_index:]
+                return
             # create the output file #
             out_properties = {
                 'latitudes': self.__latitudes,
                 'longitudes': self.__longitudes,
                 'times': self.__times,
-                'time_units': 'days since 1900-01-01 00:00:00.0 UTC'
+                'time_units': 'days since 1900-01-01 00:00:00.0 UTC',
+                'unlimited_time': True
             }
             output_data_set = netcdf.initialize_dataset(self.__output_file, out_properties)
 
             # variables #
-            lst_rank = output_data_set.createVariable('cdi_wt_sum_pr', 'float32', ('time', 'latitude', 'longitude'))
-            lst_rank.units = '1'
-            lst_rank.missing_value = self.__missing
-            lst_rank.standard_name = "cdi_weighted_pct_rank"
-            lst_rank.long_name = "percent ranked weighted sum CDI"
-        except IOError as ioe:
-            print(ioe)
-        except Exception as ex:
-            print(ex)
+            for ranked_variable in self.__ranked_variables:
+                lst_rank = output_data_set.createVariable(ranked_variable, 'float32', ('time', 'latitude', 'longitude'))
+                lst_rank.units = '1'
+                lst_rank.missing_value = self.__missing
+                lst_rank.standard_name = ranked_variable.replace('cdi_wt_sum_pr', 'cdi_weighted_pct_rank', 1)
+                lst_rank.long_name = "percent ranked weighted sum CDI"
+        except IOError:
+            raise
+        except Exception:
+            raise
         finally:
             if output_data_set is not None:
                 output_data_set.close()
 
-    def rank_parameter(self, index):
+    def get_months(self):
+        """
+        This function determines the months of the year to rank
+        Returns:
+            List of the months of the year (1 - 12): all of them, or only the months of the date range, the new
+                months and the changed months when the existing file is updated
+        """
+        if self.__update_in_place:
+            months = set(TimeIndex.from_times(self.__times).month_of_year[self.__append_index:].tolist())
+            if self.__date_range.is_set:
+                months.update(self.__date_range.calendar_months(self.__times))
+            return sorted(months)
+        return list(range(1, 13))
+
+    def record_fingerprints(self):
+        """
+        This function records the input fingerprints in the output, once all the month series are ranked
+        """
+        if self.__fingerprints is not None:
+            write_fingerprints(self.__output_file, self.__fingerprints)
+            if self.__spi_fingerprints is not None:
+                write_fingerprints(self.__output_file, self.__spi_fingerprints, SPI_FINGERPRINTS_ATTRIBUTE)
+
+    def __get_unavailable_dates(self):
+        """
+        This function reads the dates that the weighted sum of each scenario has no value for, because one of its
+            inputs does not have them (recorded by the weighted sum step)
+        Returns:
+            2D boolean numpy array (times, variables)
+        """
+        dates = TimeIndex.from_times(self.__times).dates()
+        unavailable = np.zeros((len(dates), len(self.__variables)), dtype=bool)
+        for i, v in enumerate(self.__variables):
+            variable = self.__input_data_set.variables[v]
+            if 'unavailable_dates' in variable.ncattrs():
+                unavailable[:, i] = np.isin(dates, json.loads(variable.unavailable_dates))
+        return unavailable
+
+    def rank_months(self, months):
+        """
+        This function ranks the CDI weighted sums of the months of the year in one pass
+            The times are grouped by month of the year from their dates, so a missing month is left out of the ranks
+            of its month instead of shifting the months after it
+            The weighted sums of the scenarios are stacked and ranked together; the dates a scenario has no value for
+            are left out of its ranks like the missing months
+        Args:
+            months (list): the months of the year (1 - 12) to rank
+        """
         output_data_set = None
         try:
-            # determine the number of years for the month #
-            years = int(self.__number_of_months / 12)
-            if index < (self.__number_of_months % 12):
-                years += 1
-            # load the data for the current month #
-            data = []
-            t = index  # set the input time to the starting index
-            for y in range(0, years):
-                data.append(netcdf.extract_data(self.__input_data_set, 'cdi_weighted_sum', t))
-                t += 12  # increment by 1 year
-            # rank the data by year #
-            ranked_data = self.__stats.rank_parameter(data)
+            positions = TimeIndex.from_times(self.__times).month_year_positions()[np.array(months, dtype=int) - 1]
+            # load the data of the AOI cells as (time, scenario, cell) and lay it out by month of the year and year #
+            with span('read', months=len(months), scenarios=len(self.__variables)) as s:
+                data = np.stack([self.__aoi.pack(netcdf.extract_data(self.__input_data_set, v, -1))
+                                 for v in self.__variables], axis=1)
+                s.add_pixels(data.size)
+                s.add_bytes_read(data.size * 4)
+                month_data = self.__stats.group_by_month(data, positions)
+                del data
+            # rank the data by year, leaving out the missing months and the dates a scenario has no value for #
+            gaps = (positions < 0)[:, :, np.newaxis] | self.__get_unavailable_dates()[positions]
+            ranked_data = self.__stats.rank_stack(month_data, 1, gaps[:, :, :, np.newaxis])
             # open file for appending #
-            output_data_set = netcdf.open_dataset(self.__output_file, 'a')
-            # loop thru the years and set the data to the correct time index #
-            t = index
-            for y in range(0, len(ranked_data)):
-                output_data_set.variables['cdi_wt_sum_pr'][t] = ranked_data[y]
-                t += 12
+            with span('write', months=len(months), scenarios=len(self.__variables)) as s:
+                output_data_set = netcdf.open_dataset(self.__output_file, 'a')
+                # set the data to the time index of each month and year, back on the grid #
+                for i, ranked_variable in enumerate(self.__ranked_variables):
+                    written = netcdf.write_month_year(output_data_set.variables[ranked_variable], positions,
+                                                      self.__aoi.unpack(ranked_data[:, :, i], self.__missing))
+                    # record the weights of the ranked sums #
+                    if 'weights' in self.__input_data_set.variables[self.__variables[i]].ncattrs():
+                        output_data_set.variables[ranked_variable].weights = \
+                            self.__input_data_set.variables[self.__variables[i]].weights
+                    s.add_pixels(written)
+                    s.add_bytes_written(written * 4)
         except IOError:
             raise
         except Exception:
@@ -85,26 +190,39 @@ class CompositeDroughtIndicatorRanking:
                 output_data_set.close()
 
 
-def main():
+def main(args=None):
     """
     This is the main entry point for the program
     """
     script_start = datetime.now()
     try:
-        # initialize a new CDI Ranking class #
-        rankings = CompositeDroughtIndicatorRanking()
-        # loop thru the months and rank the CDI values #
-        print("Ranking CDI weighted sum data...")
-        for index in range(0, 12):
-            rankings.rank_parameter(index)
+        date_range = DateRange.from_args(args)
+        with span('step', step='0302'):
+            # initialize a new CDI Ranking class #
+            rankings = CompositeDroughtIndicatorRanking(date_range)
+            # loop thru the months and rank the CDI values #
+            print("Ranking CDI weighted sum data...")
+            months = rankings.get_months()
+            if len(months) == 0:
+                print("The CDI rankings are up to date")
+            else:
+                rankings.rank_months(months)
+                rankings.record_fingerprints()
     except IOError as ioe:
         print(ioe)
+        return 1
     except Exception as ex:
         print(ex)
+        return 1
     finally:
         script_end = datetime.now()
         print("Script execution: {}".format(script_end - script_start))
+    return 0
 
 
 if __name__ == '__main__':
-    main()
+    # set up the command line argument parser
+    parser = ArgumentParser()
+    add_date_range_arguments(parser)
+    # execute the program with the supplied options
+    sys.exit(main(parser.parse_args()))
@@ -1,21 +1,189 @@
 # -*- coding: utf-8 -*-
 import os
+import sys
+import re
+from xml.sax.saxutils import escape
 from libs.config_reader import ConfigParser
 from libs.file_operations import FileHandler
 import libs.netcdf_functions as netcdf
+from libs.profiling import span
+from libs.date_range import DateRange, add_arguments as add_date_range_arguments
+from libs.time_index import TimeIndex
 from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import rasterio
 from rasterio.transform import Affine
-from datetime import datetime, date, timedelta
+from datetime import datetime
+
+
+def write_geotiff(file_path, data, profile):
+    """
+    This function writes a single band GeoTiff image and closes it
+    Args:
+        file_path (str): fully-qualified path/name of the GeoTiff
+        data: 2D numpy array of the image values
+        profile (dict): the rasterio creation options
+
+    Returns:
+        Integer number of pixels written
+    """
+    with rasterio.open(file_path, 'w', **profile) as output:
+        output.write(data.astype(rasterio.float32), 1)
+    return data.size
+
+
+class GeoTiffWriter:
+    """
+    This class writes GeoTiff images in the selected format, on a pool of threads when more than one is requested
+        GDAL releases the GIL while encoding and writing, so the images of all parameters and times are written
+        concurrently while the next slices are read from the NetCDF files
+    """
+    def __init__(self, output_format='gtiff', compress=None, threads=1):
+        """
+        Args:
+            output_format (str): gtiff (plain GeoTiff) or cog (Cloud Optimized GeoTiff with internal overviews)
+            compress (str): optional compression: none, deflate, zstd or lzw. Default is deflate for cog, none for gtiff
+            threads (int): the number of images to write at the same time
+        """
+        if output_format not in ['gtiff', 'cog']:
+            raise ValueError("Unknown GeoTiff format '{}': use gtiff or cog".format(output_format))
+        if compress is None:
+            compress = 'deflate' if output_format == 'cog' else 'none'
+        self.__options = {}
+        if output_format == 'cog':
+            # tiled, with overviews computed from the valid pixels #
+            self.__options['driver'] = 'COG'
+            self.__options['blocksize'] = 256
+            self.__options['overview_resampling'] = 'average'
+            if compress != 'none':
+                self.__options['compress'] = compress.upper()
+                self.__options['predictor'] = 'YES'
+        else:
+            self.__options['driver'] = 'GTiff'
+            if compress != 'none':
+                self.__options['compress'] = compress.upper()
+                self.__options['predictor'] = 3
+                self.__options['tiled'] = True
+                self.__options['blockxsize'] = 256
+                self.__options['blockysize'] = 256
+        self.__executor = ThreadPoolExecutor(max_workers=threads) if threads > 1 else None
+        # limit the slices held in memory while they wait for a thread #
+        self.__max_pending = threads * 2
+        self.__pending = set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        try:
+            if exc_type is None:
+                self.wait()
+        finally:
+            if self.__executor is not None:
+                self.__executor.shutdown(wait=True)
+
+    def create_profile(self, rows, columns, crs, transform, missing, count=1):
+        """
+        This function creates the rasterio creation options of an image
+        Returns:
+            Dictionary of options
+        """
+        profile = {
+            'width': columns,
+            'height': rows,
+            'count': count,
+            'dtype': rasterio.float32,
+            'crs': crs,
+            'transform': transform,
+            'nodata': missing
+        }
+        profile.update(self.__options)
+        return profile
+
+    def write(self, file_path, data, profile):
+        """
+        This function writes an image, or queues it when a pool of threads is used
+        Args:
+            file_path (str): fully-qualified path/name of the GeoTiff
+            data: 2D numpy array of the image values
+            profile (dict): the rasterio creation options
+        """
+        if self.__executor is None:
+            write_geotiff(file_path, data, profile)
+            return
+        if len(self.__pending) >= self.__max_pending:
+            done, self.__pending = wait(self.__pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                future.result()
+        self.__pending.add(self.__executor.submit(write_geotiff, file_path, data, profile))
+
+    def wait(self):
+        """
+        This function waits for the queued images to be written, and raises the first error of any of them
+        """
+        pending, self.__pending = self.__pending, set()
+        for future in pending:
+            future.result()
+
+
+def write_vrt_index(file_path, tif_files, descriptions, rows, columns, crs, transform, missing):
+    """
+    This function writes a VRT file that presents single band GeoTiffs of the same grid as the bands of one image
+    Args:
+        file_path (str): fully-qualified path/name of the VRT
+        tif_files (list): the GeoTiffs, in band order; the paths are stored relative to the VRT
+        descriptions (list): the description of each band, e.g. the 'YYYYMM' date
+        rows (int): the image height
+        columns (int): the image width
+        crs (str): the coordinate reference system
+        transform (Affine): the image transformation
+        missing (float): the missing value
+
+    Returns:
+        None
+    """
+    lines = [
+        '<VRTDataset rasterXSize="{}" rasterYSize="{}">'.format(columns, rows),
+        '  <SRS>{}</SRS>'.format(escape(rasterio.crs.CRS.from_string(crs).to_wkt())),
+        '  <GeoTransform>{}</GeoTransform>'.format(', '.join(repr(float(v)) for v in transform.to_gdal()))
+    ]
+    for b, (tif_file, description) in enumerate(zip(tif_files, descriptions)):
+        lines += [
+            '  <VRTRasterBand dataType="Float32" band="{}">'.format(b + 1),
+            '    <Description>{}</Description>'.format(escape(description)),
+            '    <NoDataValue>{}</NoDataValue>'.format(missing),
+            '    <SimpleSource>',
+            '      <SourceFilename relativeToVRT="1">{}</SourceFilename>'.format(
+                escape(os.path.relpath(tif_file, os.path.dirname(file_path)).replace("\\", '/'))),
+            '      <SourceBand>1</SourceBand>',
+            '      <SourceProperties RasterXSize="{0}" RasterYSize="{1}" DataType="Float32" '
+            'BlockXSize="{0}" BlockYSize="1" />'.format(columns, rows),
+            '      <SrcRect xOff="0" yOff="0" xSize="{0}" ySize="{1}" />'.format(columns, rows),
+            '      <DstRect xOff="0" yOff="0" xSize="{0}" ySize="{1}" />'.format(columns, rows),
+            '    </SimpleSource>',
+            '  </VRTRasterBand>'
+        ]
+    lines.append('</VRTDataset>')
+    with open(file_path, 'w') as fh:
+        fh.write('\n'.join(lines) + '\n')
 
 
 class NetCDFtoTIFF:
     """
     This is the core processing class for executing GeoTiff export
+        The layout of the export is one of:
+            monthly  a single band GeoTiff per month
+            stack    a GeoTiff per parameter with a band per month (the band descriptions hold the 'YYYYMM' dates)
+            vrt      the monthly GeoTiffs and a VRT index with all the monthly GeoTiffs of the parameter as bands
     """
-    def __init__(self, parameter, mode, cdi_date=None):
+    def __init__(self, parameter, mode, cdi_date=None, date_range=None, writer=None, layout='monthly'):
+        if layout not in ['monthly', 'stack', 'vrt']:
+            raise ValueError("Unknown export layout '{}': use monthly, stack or vrt".format(layout))
         self.__parameter = parameter
         self.cdi_date = cdi_date
+        self.__date_range = date_range if date_range is not None else DateRange()
+        self.__writer = writer if writer is not None else GeoTiffWriter()
+        self.__layout = layout
         self.__config = ConfigParser()
         self.__mode = mode
         self.__cdi_weights = self.__config.get('cdi_parameters', 'weights')
@@ -38,26 +206,33 @@ class NetCDFtoTIFF:
                 file_patterns=self.__file_patterns
             )
             self.__times = None
-            self.__data = None
+            self.__time_indices = None
+            self.__source = None
+            self.__source_parameter = None
             self.__transform = None
             self.__projection = '+proj=latlong'
             self.__missing = -9999.0
-            # load the time(s) and data #
+            # find the time(s) to export #
             self.__get_data()
             # get the transformation #
             self.__get_transformation()
             # export the image(s) #
-            self.__export_geotiffs()
+            if self.__layout == 'stack':
+                self.__export_stack()
+            else:
+                self.__export_geotiffs()
+                if self.__layout == 'vrt':
+                    self.__export_vrt_index()
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.__times = None
-        self.__data = None
+        self.__time_indices = None
 
     def __get_data(self):
         """
-        This function loads the applicable time(s) and data array(s) from the appropriate NetCDF file
-            containing the CDI input or ranked sum
+        This function finds the applicable time(s) in the appropriate NetCDF file containing the CDI input or ranked sum
+            The data arrays are read one time at a time during the export
         Returns:
             None: results are stored directly in the class instance
         """
@@ -75,14 +250,17 @@ class NetCDFtoTIFF:
         input_parameters['cdi'] = "cdi_wt_sum_pr"
         # extract the time(s) and data #
         try:
-            source = input_files[self.__parameter]
-            source_parameter = input_parameters[self.__parameter]
-            input_data_set = netcdf.open_dataset(source)
-            if self.__mode == 'all':
-                self.__times = input_data_set.variables['time'][:]
-                self.__data = netcdf.extract_data(input_data_set, source_parameter, -1)
+            self.__source = input_files[self.__parameter]
+            self.__source_parameter = input_parameters[self.__parameter]
+            input_data_set = netcdf.open_dataset(self.__source)
+            all_times = input_data_set.variables['time'][:]
+            if self.__date_range.is_set:
+                # export the months within the date range #
+                self.__time_indices = self.__date_range.time_indices(all_times)
+            elif self.__mode == 'all' or self.__layout == 'stack':
+                # a stack always holds the complete time series #
+                self.__time_indices = list(range(0, len(all_times)))
             else:
-                all_times = input_data_set.variables['time'][:]
                 last = len(all_times) - 1
                 if self.cdi_date is not None:
                     for idx, d in enumerate(all_times):
@@ -92,10 +270,9 @@ class NetCDFtoTIFF:
                 else:
                     # update the last CDI date for the 'latest' mode #
                     self.cdi_date = all_times[last]
-                # extract the data for the last CDI month #
-                self.__times = [all_times[last]]
-                self.__data = [netcdf.extract_data(input_data_set, source_parameter, last)]
-
+                # export the last CDI month #
+                self.__time_indices = [last]
+            self.__times = [all_times[i] for i in self.__time_indices]
         except IOError:
             raise
         except Exception:
@@ -123,43 +300,89 @@ class NetCDFtoTIFF:
         Returns:
             String of the year/month in 'YYMM' format
         """
-        origin_date = date(1900, 1, 1)
-        data_date = origin_date + timedelta(days=time)
-        return data_date.strftime('%Y%m')
+        return TimeIndex.from_times([time]).dates()[0]
 
     def __export_geotiffs(self):
         """
-        This function takes the loaded NetCDF data and generates a GeoTiff image for each date requested
+        This function reads the NetCDF data one date at a time and generates a GeoTiff image for each date requested
+            The images are written by the writer, which may still be writing them when this function returns
         Returns:
             None
         """
-        output = None
+        input_data_set = None
+        profile = self.__writer.create_profile(self.__rows, self.__cols, self.__projection, self.__transform, self.__missing)
         try:
             # loop thru times and generate a GeoTiff for each date #
-            for t, time in enumerate(self.__times):
-                date_str = self.create_date_string(int(time))
-                filename = os.path.join(self.__working_dir, "STEP_0303_{}_pct_rank_{}_{}.tif".format(self.__parameter.upper(), self.__region, date_str))
-                # create new GeoTiff #
-                output = rasterio.open(
-                    filename,
-                    'w',
-                    driver='GTiff',
-                    width=self.__cols,
-                    height=self.__rows,
-                    count=1,
-                    dtype=rasterio.float32,
-                    crs=self.__projection,
-                    transform=self.__transform
-                )
-                # write the data to the image #
-                output.write(self.__data[t].astype(rasterio.float32), 1)
+            with span('write', parameter=self.__parameter) as s:
+                input_data_set = netcdf.open_dataset(self.__source)
+                for t, date_str in zip(self.__time_indices, TimeIndex.from_times(self.__times).dates()):
+                    filename = os.path.join(self.__working_dir, "STEP_0303_{}_pct_rank_{}_{}.tif".format(self.__parameter.upper(), self.__region, date_str))
+                    # read the data and write it to a new GeoTiff #
+                    data = netcdf.extract_data(input_data_set, self.__source_parameter, t)
+                    self.__writer.write(filename, data, profile)
+                    s.add_pixels(data.size)
+                    s.add_bytes_written(data.size * 4)
+        except IOError:
+            raise
+        except Exception:
+            raise
+        finally:
+            if input_data_set is not None:
+                input_data_set.close()
+
+    def __export_stack(self):
+        """
+        This function reads the NetCDF data one date at a time and writes each date as a band of a single GeoTiff
+            The file name holds the first and last date, and each band description holds its 'YYYYMM' date
+        Returns:
+            None
+        """
+        if len(self.__times) == 0:
+            return
+        input_data_set = None
+        date_strings = TimeIndex.from_times(self.__times).dates()
+        filename = os.path.join(self.__working_dir, "STEP_0303_{}_pct_rank_{}_{}_{}.tif".format(
+            self.__parameter.upper(), self.__region, date_strings[0], date_strings[-1]))
+        profile = self.__writer.create_profile(self.__rows, self.__cols, self.__projection, self.__transform,
+                                               self.__missing, len(self.__times))
+        try:
+            with span('write', parameter=self.__parameter, layout='stack') as s:
+                input_data_set = netcdf.open_dataset(self.__source)
+                with rasterio.open(filename, 'w', **profile) as output:
+                    for b, t in enumerate(self.__time_indices):
+                        data = netcdf.extract_data(input_data_set, self.__source_parameter, t)
+                        output.write(data.astype(rasterio.float32), b + 1)
+                        output.set_band_description(b + 1, date_strings[b])
+                        s.add_pixels(data.size)
+                        s.add_bytes_written(data.size * 4)
+                    output.update_tags(first_date=date_strings[0], last_date=date_strings[-1])
         except IOError:
             raise
         except Exception:
             raise
         finally:
-            if output is not None:
-                output.close()
+            if input_data_set is not None:
+                input_data_set.close()
+
+    def __export_vrt_index(self):
+        """
+        This function writes a VRT index over all the monthly GeoTiffs of the parameter, with a band per month
+            The index is created again from the files in the GeoTiff directory, so it also lists earlier exports
+        Returns:
+            None
+        """
+        pattern = re.compile(r'^STEP_0303_{}_pct_rank_{}_(\d{{6}})\.tif$'.format(self.__parameter.upper(),
+                                                                               re.escape(self.__region)))
+        monthly_files = {}
+        for filename in os.listdir(self.__working_dir):
+            match = pattern.match(filename)
+            if match is not None:
+                monthly_files[match.group(1)] = os.path.join(self.__working_dir, filename)
+        date_strings = sorted(monthly_files)
+        filename = os.path.join(self.__working_dir, "STEP_0303_{}_pct_rank_{}.vrt".format(self.__parameter.upper(),
+                                                                                      self.__region))
+        write_vrt_index(filename, [monthly_files[d] for d in date_strings], date_strings, self.__rows, self.__cols,
+                        self.__projection, self.__transform, self.__missing)
 
 
 def main(args):
@@ -169,21 +392,31 @@ def main(args):
     mode = str(args.mode)
     script_start = datetime.now()
     try:
-        # set the list of parameters to convert: cdi must be first #
-        parameters = ["cdi", "lst", "ndvi", "spi", "sm"]
-        cdi_date = None
-        for p in parameters:
-            # initialize a new TIFF export class #
-            with NetCDFtoTIFF(p, mode, cdi_date) as tif_exporter:
-                if cdi_date is None:
-                    cdi_date = tif_exporter.cdi_date
+        date_range = DateRange.from_args(args)
+        # the options are not defined when the step is run by STEP_0000 #
+        output_format = getattr(args, 'format', 'gtiff')
+        compress = getattr(args, 'compress', None)
+        threads = getattr(args, 'threads', 1)
+        layout = getattr(args, 'layout', 'monthly')
+        with span('step', step='0303'), GeoTiffWriter(output_format, compress, threads) as writer:
+            # set the list of parameters to convert: cdi must be first #
+            parameters = ["cdi", "lst", "ndvi", "spi", "sm"]
+            cdi_date = None
+            for p in parameters:
+                # initialize a new TIFF export class #
+                with NetCDFtoTIFF(p, mode, cdi_date, date_range, writer, layout) as tif_exporter:
+                    if cdi_date is None:
+                        cdi_date = tif_exporter.cdi_date
     except IOError as ioe:
         print(ioe)
+        return 1
     except Exception as ex:
         print(ex)
+        return 1
     finally:
         script_end = datetime.now()
         print("Script execution: {}".format(script_end - script_start))
+    return 0
 
 
 if __name__ == '__main__':
@@ -191,5 +424,15 @@ if __name__ == '__main__':
     parser = ArgumentParser()
     parser.add_argument("-m", "--mode", default="updates",
                         help="The times to export: latest or all. Default is updates")
+    parser.add_argument("-f", "--format", default="gtiff", choices=["gtiff", "cog"],
+                        help="The GeoTiff format: gtiff or cog (tiled Cloud Optimized GeoTiff with overviews). Default is gtiff")
+    parser.add_argument("-c", "--compress", default=None, choices=["none", "deflate", "zstd", "lzw"],
+                        help="The GeoTiff compression. Default is deflate for cog and none for gtiff")
+    parser.add_argument("-t", "--threads", default=4, type=int,
+                        help="The number of GeoTiffs to write at the same time. Default is 4")
+    parser.add_argument("-l", "--layout", default="monthly", choices=["monthly", "stack", "vrt"],
+                        help="The files to export: monthly (a GeoTiff per month), stack (a GeoTiff per parameter with "
+                             "a band per month) or vrt (monthly GeoTiffs and a VRT index of all months). Default is monthly")
+    add_date_range_arguments(parser)
     # execute the program with the supplied option
-    main(parser.parse_args())
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+import csv
+import os
+import sys
+from libs.config_reader import ConfigParser, get_zone_file
+import libs.netcdf_functions as netcdf
+from libs.profiling import span
+from libs.date_range import DateRange, add_arguments as add_date_range_arguments
+from libs.time_index import TimeIndex
+from libs.zonal_statistics import get_zone_index, compute_zonal_statistics
+from argparse import ArgumentParser
+from datetime import datetime
+
+
+class ZonalStatistics:
+    """
+    This is the core processing class for the zonal statistics of the percentile rank and CDI outputs
+        The zones (e.g. districts) of a polygon file are rasterized once onto the project grid and cached,
+        and the statistics of every zone are written to a CSV table per parameter, with a row per date and zone
+    """
+    def __init__(self, date_range=None):
+        self.__config = ConfigParser()
+        self.__date_range = date_range if date_range is not None else DateRange()
+        self.__region = self.__config.get('region_name')
+        self.__output_dir = self.__config.get('output_dir').replace("\\", '/')
+        self.__scratch_dir = self.__config.get('scratch_dir').replace("\\", '/')
+        self.__zone_file = get_zone_file(self.__config)
+        self.__zone_name_field = self.__config.get('zone_name_field')
+        self.__latitudes = self.__config.get('latitudes')
+        self.__longitudes = self.__config.get('longitudes')
+        self.__cdi_weights = self.__config.get('cdi_parameters', 'weights')
+        # the drought classes are the classes of the maps #
+        self.__class_limits = [limit for limit, color in self.__config.get('map_colors')]
+        self.__missing = -9999.0
+        self.__block_size = 120
+        self.__index = None
+
+    def get_zone_index(self):
+        """
+        This function rasterizes the zones, or loads them from the cache in the scratch directory
+        Returns:
+            ZoneIndex object
+        """
+        if self.__index is None:
+            if self.__zone_file == '':
+                raise ValueError("No zone_file is configured for the zonal statistics")
+            cache_file = os.path.join(self.__scratch_dir, "STEP_0304_zones_{}.npz".format(self.__region))
+            self.__index = get_zone_index(self.__zone_file, self.__latitudes, self.__longitudes, cache_file,
+                                          self.__zone_name_field)
+        return self.__index
+
+    def get_parameters(self):
+        """
+        This function lists the parameters with an output to summarize: the CDI and its weighted inputs
+        Returns:
+            List of parameter names
+        """
+        return ['cdi'] + [p for p in ['lst', 'ndvi', 'spi', 'sm'] if self.__cdi_weights[p] > 0]
+
+    def __get_columns(self):
+        """
+        This function creates the header of the output tables
+        Returns:
+            List of column names
+        """
+        columns = ['date', 'zone', 'area_km2', 'valid_pct', 'mean', 'min', 'max']
+        return columns + ['pct_le_{:g}'.format(limit) for limit in self.__class_limits]
+
+    def __read_kept_rows(self, output_file, columns):
+        """
+        This function reads the rows of an existing table that are outside the date range, so they are kept
+            when only the months within the range are computed again
+        Returns:
+            List of rows (lists of strings)
+        """
+        if not self.__date_range.is_set or not os.path.isfile(output_file):
+            return []
+        with open(output_file, 'r', newline='') as fh:
+            reader = csv.reader(fh)
+            if next(reader, None) != columns:
+                return []
+            return [row for row in reader if not self.__date_range.contains_date(row[0])]
+
+    def summarize(self, parameter):
+        """
+        This function computes the statistics of every zone for every date of a parameter's output
+            and writes them to a CSV table
+        Args:
+            parameter (str): the name of the parameter (cdi, lst, ndvi, spi or sm)
+
+        Returns:
+            String of the output file name
+        """
+        # define the available file names for the sources #
+        input_files = {
+            "lst": os.path.join(self.__output_dir, "STEP_0201_LST_anomaly_pct_rank_{}.nc".format(self.__region)),
+            "ndvi": os.path.join(self.__output_dir, "STEP_0202_NDVI_anomaly_pct_rank_{}.nc".format(self.__region)),
+            "spi": os.path.join(self.__output_dir, "STEP_0203_SPI_anomaly_pct_rank_{}.nc".format(self.__region)),
+            "sm": os.path.join(self.__output_dir, "STEP_0204_SM_pct_rank_{}.nc".format(self.__region)),
+            "cdi": os.path.join(self.__output_dir, "STEP_0302_CDI_pct_rank_{}.nc".format(self.__region))
+        }
+        # define the NetCDF parameter names for each source #
+        input_parameters = self.__config.get('cdi_parameters', 'names')
+        input_parameters['cdi'] = "cdi_wt_sum_pr"
+        output_file = os.path.join(self.__output_dir, "STEP_0304_{}_zonal_statistics_{}.csv".format(
+            parameter.upper(), self.__region))
+        index = self.get_zone_index()
+        columns = self.__get_columns()
+        rows = self.__read_kept_rows(output_file, columns)
+        input_data_set = None
+        try:
+            with span('zonal statistics', parameter=parameter, zones=len(index.names)) as s:
+                input_data_set = netcdf.open_dataset(input_files[parameter])
+                times = input_data_set.variables['time'][:]
+                dates = TimeIndex.from_times(times).dates()
+                if self.__date_range.is_set:
+                    time_indices = self.__date_range.time_indices(times)
+                else:
+                    time_indices = list(range(0, len(times)))
+                # read and aggregate the dates in blocks #
+                for b in range(0, len(time_indices), self.__block_size):
+                    block = time_indices[b:b + self.__block_size]
+                    data = netcdf.extract_data_indices(input_data_set, input_parameters[parameter], block)
+                    results = compute_zonal_statistics(data, index, self.__class_limits, self.__missing)
+                    for i, t in enumerate(block):
+                        date_string = dates[t]
+                        for z, name in enumerate(index.names):
+                            row = [date_string, name, round(index.zone_areas[z], 2), round(results['valid_pct'][i, z], 2)]
+                            row += [round(results[k][i, z], 4) for k in ['mean', 'min', 'max']]
+                            row += [round(v, 2) for v in results['class_pct'][i, z]]
+                            rows.append(row)
+                    s.add_pixels(data.size)
+            # keep the rows in date order, with the zones in file order #
+            rows.sort(key=lambda r: r[0])
+            with open(output_file, 'w', newline='') as fh:
+                writer = csv.writer(fh)
+                writer.writerow(columns)
+                writer.writerows(rows)
+        except IOError:
+            raise
+        except Exception:
+            raise
+        finally:
+            if input_data_set is not None:
+                input_data_set.close()
+        return output_file
+
+
+def main(args):
+    """
+    This is the main entry point for the program
+    """
+    script_start = datetime.now()
+    try:
+        with span('step', step='0304'):
+            statistics = ZonalStatistics(DateRange.from_args(args))
+            index = statistics.get_zone_index()
+            print("Computing the statistics of {} zones...".format(len(index.names)))
+            for p in statistics.get_parameters():
+                output_file = statistics.summarize(p)
+                print("-- {} zonal statistics written to {}".format(p.upper(), output_file))
+    except IOError as ioe:
+        print(ioe)
+        return 1
+    except Exception as ex:
+        print(ex)
+        return 1
+    finally:
+        script_end = datetime.now()
+        print("Script execution: {}".format(script_end - script_start))
+    return 0
+
+
+if __name__ == '__main__':
+    # set up the command line argument parser
+    parser = ArgumentParser()
+    add_date_range_arguments(parser)
+    # execute the program with the supplied options
+    sys.exit(main(parser.parse_args()))
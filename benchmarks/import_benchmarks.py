@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+import os
+import platform
+import re
+import statistics
+import subprocess
+import sys
+import time
+from argparse import ArgumentParser
+from datetime import datetime
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+from benchmarks.stage_benchmarks import git_commit, write_results  # noqa: E402
+
+"""
+Import-time benchmark for the CDI scripts
+    Every target is started in a fresh interpreter, so the measured time includes the imports the target pulls in.
+    The interpreter start-up ('python -c pass') is measured as well, so it can be subtracted.
+    The -X importtime output of the last run is used to list the slowest top-level packages of each target.
+Usage (from the repository root):
+    python -m benchmarks.import_benchmarks --repeat 5 --output imports.csv
+"""
+
+FIELDS = ['target', 'repeat', 'min_s', 'median_s', 'mean_s', 'slowest_imports', 'commit', 'python', 'timestamp']
+
+STEP_MODULES = [
+    'STEP_0101_read_hdf_create_LST_anom_netcdf',
+    'STEP_0102_read_hdf_create_NDVI_anom_netcdf',
+    'STEP_0103_read_chirps_create_precip_netcdf_and_spi_netcdf',
+    'STEP_0104_create_5km_soil_moisture_netcdf',
+    'STEP_0201_percent_rank_LST_anom_netcdf',
+    'STEP_0202_percent_rank_NDVI_anom_netcdf',
+    'STEP_0203_percent_rank_SPI_anom',
+    'STEP_0204_percent_rank_soil_moisture_netcdf',
+    'STEP_0301_CDI_weighted_sum',
+    'STEP_0302_percent_rank_CDI_weighted_sum',
+    'STEP_0303_export_ranking_data_rasters'
+]
+
+LIB_MODULES = [
+    'libs.pipeline',
+    'libs.profiling',
+    'libs.subgrid_calculations',
+    'libs.statistics_operations',
+    'libs.spi_calculations'
+]
+
+IMPORT_TIME = re.compile(r'import time:\s+(\d+)\s+\|\s+(\d+)\s+\|\s*(\S+)')
+LOCAL_PACKAGES = ['site', 'encodings', 'libs', 'benchmarks']
+
+# the packages a target must start without; the orchestrator leaves them to the step modules it runs #
+LIGHT_TARGETS = {
+    'STEP_0000 --help': ['numpy', 'netCDF4']
+}
+
+
+def default_targets():
+    """
+    This function returns the targets to measure: the interpreter start-up, the orchestrator CLI and every module
+
+    Returns:
+        List of (name, interpreter arguments) tuples
+    """
+    targets = [
+        ('python start-up', ['-c', 'pass']),
+        ('STEP_0000 --help', ['STEP_0000_execute_all_steps.py', '--help'])
+    ]
+    for module in LIB_MODULES + STEP_MODULES:
+        targets.append((module, ['-c', 'import {}'.format(module)]))
+    return targets
+
+
+def slowest_imports(import_log, count=3):
+    """
+    This function finds the slowest third-party packages in the -X importtime output
+        The cumulative time of a package includes the packages it imports itself (e.g. netCDF4 includes numpy)
+    Args:
+        import_log (str): the stderr of the interpreter
+        count (int): the number of packages to return
+
+    Returns:
+        String of 'package=milliseconds' values, slowest first
+    """
+    totals = {}
+    for line in import_log.splitlines():
+        match = IMPORT_TIME.search(line)
+        if match is None:
+            continue
+        package = match.group(3).split('.')[0]
+        # skip the interpreter start-up and the modules of this repository #
+        if package in LOCAL_PACKAGES or package.startswith('STEP_'):
+            continue
+        totals[package] = max(totals.get(package, 0), int(match.group(2)))
+    ranked = sorted(totals.items(), key=lambda item: item[1], reverse=True)[:count]
+    return ' '.join("{}={:.1f}ms".format(name, micro_seconds / 1000.0) for name, micro_seconds in ranked)
+
+
+def check_light_imports(name, import_log):
+    """
+    This function verifies that a target did not import the packages it must start without
+    Args:
+        name (str): the target name
+        import_log (str): the -X importtime output of the target
+    """
+    loaded = set()
+    for line in import_log.splitlines():
+        match = IMPORT_TIME.search(line)
+        if match is not None:
+            loaded.add(match.group(3).split('.')[0])
+    heavy = [package for package in LIGHT_TARGETS.get(name, []) if package in loaded]
+    if len(heavy) > 0:
+        raise RuntimeError("{} imports {} at start-up; import them where they are used".format(name, ', '.join(heavy)))
+
+
+def time_target(arguments, repeat):
+    """
+    This function starts a fresh interpreter for the target several times and measures the wall time of each run
+    Args:
+        arguments (list): the interpreter arguments
+        repeat (int): the number of runs
+
+    Returns:
+        List of run times in seconds, and the -X importtime output of the last run
+    """
+    times = []
+    import_log = ''
+    for r in range(repeat):
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, '-X', 'importtime'] + arguments, cwd=REPO_ROOT,
+                                stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+        times.append(time.perf_counter() - start)
+        if result.returncode != 0:
+            raise RuntimeError("{} failed:\n{}".format(' '.join(arguments), result.stderr[-2000:]))
+        import_log = result.stderr
+    return times, import_log
+
+
+def main(args):
+    commit = git_commit()
+    results = []
+    for name, arguments in default_targets():
+        if args.targets and name not in args.targets:
+            continue
+        times, import_log = time_target(arguments, args.repeat)
+        check_light_imports(name, import_log)
+        median = statistics.median(times)
+        result = {
+            'target': name,
+            'repeat': args.repeat,
+            'min_s': round(min(times), 6),
+            'median_s': round(median, 6),
+            'mean_s': round(statistics.mean(times), 6),
+            'slowest_imports': slowest_imports(import_log),
+            'commit': commit,
+            'python': platform.python_version(),
+            'timestamp': datetime.now().isoformat(timespec='seconds')
+        }
+        results.append(result)
+        print("{:<60} median {:>7.3f} s  {}".format(name, median, result['slowest_imports']))
+    if args.output is not None:
+        write_results(results, args.output, FIELDS)
+        print("Results written to {}".format(args.output))
+
+
+if __name__ == '__main__':
+    # set up the command line argument parser
+    parser = ArgumentParser()
+    parser.add_argument("-r", "--repeat", default=5, type=int,
+                        help="The number of timed runs of each target. Default is 5")
+    parser.add_argument("-t", "--targets", nargs='+', default=None,
+                        help="Only measure the named targets, e.g. libs.spi_calculations. Default is all targets")
+    parser.add_argument("-o", "--output", default=None,
+                        help="Path of a .csv or .json file to write the results to")
+    # execute the benchmarks with the supplied options
+    main(parser.parse_args())
@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+import contextlib
+import csv
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from argparse import ArgumentParser
+from datetime import datetime
+
+import numpy as np
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+from benchmarks.synthetic_data import SyntheticProject, LST_GROUP  # noqa: E402
+
+"""
+Per-stage benchmark harness for the CDI processing
+    For every requested size (years x AOI size) a synthetic project is generated, and each stage is timed in isolation:
+        hdf subset        HDFSubGrid read/subset of one MOD21C3 file
+        chirps subset     CHIRPSSubGrid read/subset of one CHIRPS GeoTIFF
+        fldas interpolate NetCDFSubGrid read/interpolation of one FLDAS layer
+        anomaly           StatisticOperations.compute_anomalies_from_values for one calendar month over all years
+        rank              StatisticOperations.rank_parameter for one calendar month over all years
+        spi               calculate_monthly_spi for one calendar month over all years
+        cdi sum           CompositeDroughtIndicator.compute_sum (STEP_0301) over all months
+        geotiff export    NetCDFtoTIFF (STEP_0303) of every month of the ranked CDI
+        zonal statistics  ZonalStatistics (STEP_0304) of every month of the ranked CDI, with the cached zone index
+    The results (min/median/mean wall time and pixel throughput) are printed and optionally written to CSV or JSON,
+    tagged with the git commit, so runs before and after a change can be compared.
+Usage (from the repository root):
+    python -m benchmarks.stage_benchmarks --years 3 10 --aoi-size 1 2 --repeat 3 --output results.csv
+"""
+
+FIELDS = ['stage', 'years', 'aoi_deg', 'rows', 'columns', 'repeat', 'min_s', 'median_s', 'mean_s', 'pixels',
+          'pixels_per_s', 'commit', 'python', 'timestamp']
+
+
+def git_commit():
+    """
+    This function returns the abbreviated commit of the repository, or 'unknown' outside of a git checkout
+    """
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+@contextlib.contextmanager
+def project_directory(path):
+    """
+    This function runs the enclosed code from the project directory, since ConfigParser reads ./*.conf
+    """
+    current = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(current)
+
+
+def time_stage(func, repeat, quiet=True):
+    """
+    This function runs a stage several times and measures the wall time of each run
+    Args:
+        func: the function to run; returns the number of pixels processed
+        repeat (int): the number of runs
+        quiet (boolean): flag to discard the output printed by the stage
+
+    Returns:
+        List of run times in seconds, and the pixel count of the last run
+    """
+    times = []
+    pixels = 0
+    for r in range(repeat):
+        start = time.perf_counter()
+        if quiet:
+            with contextlib.redirect_stdout(io.StringIO()):
+                pixels = func()
+        else:
+            pixels = func()
+        times.append(time.perf_counter() - start)
+    return times, pixels
+
+
+class StageBenchmarks:
+    """
+    This class defines the benchmarked stages for one synthetic project
+    """
+    def __init__(self, project):
+        self.project = project
+        self.bounds = project.bounds
+        self.__years = project.years
+        self.__random = np.random.default_rng(1)
+
+    def __first(self, key):
+        directory = self.project.dirs[key]
+        return os.path.join(directory, sorted(os.listdir(directory))[0])
+
+    def __monthly_values(self, low, high):
+        return self.__random.uniform(low, high, (self.__years, self.project.rows, self.project.columns))
+
+    def hdf_subset(self):
+        from libs.subgrid_calculations import HDFSubGrid
+        with HDFSubGrid(self.bounds, self.__first('lst_hdf'), LST_GROUP) as sg:
+            data = sg.create_sub_grid('LST_Day')
+        return data.size
+
+    def chirps_subset(self):
+        from libs.subgrid_calculations import CHIRPSSubGrid
+        with CHIRPSSubGrid(self.bounds, self.__first('chirps_tif')) as sg:
+            data = sg.create_sub_grid()
+        return data.size
+
+    def fldas_interpolate(self):
+        from libs.subgrid_calculations import NetCDFSubGrid
+        with NetCDFSubGrid(self.bounds, self.__first('fldas_data'), True) as sg:
+            data = sg.create_sub_grid('SoilMoi00_10cm_tavg')
+        return data.size
+
+    def anomaly(self):
+        from libs.statistics_operations import StatisticOperations
+        values = self.__monthly_values(280.0, 320.0)
+        StatisticOperations().compute_anomalies_from_values(values)
+        return values.size
+
+    def rank(self):
+        from libs.statistics_operations import StatisticOperations
+        values = self.__monthly_values(-3.0, 3.0)
+        StatisticOperations().rank_parameter(values)
+        return values.size
+
+    def spi(self):
+        from libs.spi_calculations import calculate_monthly_spi
+        values = self.__monthly_values(0.0, 150.0)
+        calculate_monthly_spi(values)
+        return values.size
+
+    def cdi_sum(self):
+        from STEP_0301_CDI_weighted_sum import CompositeDroughtIndicator
+        cdi = CompositeDroughtIndicator()
+        cdi.get_common_dates()
+        cdi.compute_sum()
+        return len(self.project.months) * self.project.rows * self.project.columns * 3
+
+    def geotiff_export(self):
+        from STEP_0303_export_ranking_data_rasters import NetCDFtoTIFF
+        with NetCDFtoTIFF('cdi', 'all'):
+            pass
+        return len(self.project.months) * self.project.rows * self.project.columns
+
+    def zonal_statistics(self):
+        from STEP_0304_zonal_statistics import ZonalStatistics
+        ZonalStatistics().summarize('cdi')
+        return len(self.project.months) * self.project.rows * self.project.columns
+
+    def stages(self):
+        return [
+            ('hdf subset', self.hdf_subset),
+            ('chirps subset', self.chirps_subset),
+            ('fldas interpolate', self.fldas_interpolate),
+            ('anomaly', self.anomaly),
+            ('rank', self.rank),
+            ('spi', self.spi),
+            ('cdi sum', self.cdi_sum),
+            ('geotiff export', self.geotiff_export),
+            ('zonal statistics', self.zonal_statistics)
+        ]
+
+
+def write_results(results, output_file, fields=FIELDS):
+    """
+    This function writes the benchmark results to a CSV or JSON file (chosen by the file extension)
+    Args:
+        results (list): the result dictionaries
+        output_file (str): path of the file to write
+        fields (list): the CSV column names
+    """
+    if output_file.lower().endswith('.json'):
+        with open(output_file, 'w') as fh:
+            fh.write(json.dumps(results, indent=2))
+    else:
+        with open(output_file, 'w', newline='') as fh:
+            writer = csv.DictWriter(fh, fieldnames=fields)
+            writer.writeheader()
+            writer.writerows(results)
+
+
+def main(args):
+    commit = git_commit()
+    selected = set(args.stages) if args.stages else None
+    results = []
+    for years in args.years:
+        for aoi_size in args.aoi_size:
+            project_dir = os.path.join(args.work_dir, "cdi_{}y_{}deg".format(years, aoi_size))
+            project = SyntheticProject(project_dir, years, aoi_size)
+            if not os.path.isfile(os.path.join(project.root, 'cdi_project_settings.conf')) or args.regenerate:
+                print("Generating synthetic data: {} years, {} degrees...".format(years, aoi_size))
+                project.create()
+            benchmarks = StageBenchmarks(project)
+            with project_directory(project.root):
+                for name, func in benchmarks.stages():
+                    if selected is not None and name not in selected:
+                        continue
+                    times, pixels = time_stage(func, args.repeat, not args.verbose)
+                    median = statistics.median(times)
+                    result = {
+                        'stage': name,
+                        'years': years,
+                        'aoi_deg': aoi_size,
+                        'rows': project.rows,
+                        'columns': project.columns,
+                        'repeat': args.repeat,
+                        'min_s': round(min(times), 6),
+                        'median_s': round(median, 6),
+                        'mean_s': round(statistics.mean(times), 6),
+                        'pixels': pixels,
+                        'pixels_per_s': round(pixels / median, 1) if median > 0 else None,
+                        'commit': commit,
+                        'python': platform.python_version(),
+                        'timestamp': datetime.now().isoformat(timespec='seconds')
+                    }
+                    results.append(result)
+                    print("{:<18} {:>3} years {:>5} deg  median {:>10.4f} s  {:>14,.0f} pixels/s".format(
+                        name, years, aoi_size, median, result['pixels_per_s'] or 0))
+    if args.output is not None:
+        write_results(results, args.output)
+        print("Results written to {}".format(args.output))
+
+
+if __name__ == '__main__':
+    # set up the command line argument parser
+    parser = ArgumentParser()
+    parser.add_argument("-y", "--years", nargs='+', default=[3], type=int,
+                        help="The number(s) of years of synthetic data. Default is 3")
+    parser.add_argument("-a", "--aoi-size", nargs='+', default=[2.0], type=float,
+                        help="The AOI width/height(s) in degrees. Default is 2.0")
+    parser.add_argument("-r", "--repeat", default=3, type=int,
+                        help="The number of timed runs of each stage. Default is 3")
+    parser.add_argument("-s", "--stages", nargs='+', default=None,
+                        help="Only run the named stages, e.g. rank 'cdi sum'. Default is all stages")
+    parser.add_argument("-o", "--output", default=None,
+                        help="Path of a .csv or .json file to write the results to")
+    parser.add_argument("-w", "--work-dir", default="./benchmarks/work",
+                        help="The directory for the synthetic projects. Default is ./benchmarks/work")
+    parser.add_argument("--regenerate", action="store_true",
+                        help="Create the synthetic data again, even if it already exists")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="Show the output printed by the stages")
+    # execute the benchmarks with the supplied options
+    arguments = parser.parse_args()
+    arguments.work_dir = os.path.abspath(arguments.work_dir)
+    main(arguments)
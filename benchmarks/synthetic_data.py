@@ -0,0 +1,378 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import sys
+from argparse import ArgumentParser
+from datetime import date
+
+import h5py
+import numpy as np
+import rasterio
+from netCDF4 import Dataset
+from rasterio.transform import Affine
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+import libs.netcdf_functions as netcdf  # noqa: E402
+
+"""
+Synthetic input generator for benchmarking the CDI stages
+    Creates a self-contained project directory (the three .conf files plus the source/ tree) containing:
+        MOD21C3 LST and MOD13C2 NDVI monthly CMG files in HDF5 layout (as produced by h4toh5convert)
+        CHIRPS monthly GeoTIFFs
+        FLDAS monthly NetCDF files
+        percent-rank NetCDF files for the CDI inputs (STEP_0201 - STEP_0204) and the ranked CDI (STEP_0302)
+    The raw files cover the global grids of the real products; values are only generated inside a padded AOI window
+    and the rest of the grid holds the fill value, so the files stay small on disk.
+Usage (from the repository root):
+    python -m benchmarks.synthetic_data --output /tmp/cdi_synthetic --years 3 --aoi-size 2.0
+"""
+
+MISSING = -9999.0
+TIME_UNITS = 'days since 1900-01-01 00:00:00.0 UTC'
+LST_GROUP = 'MODIS_MONTHLY_CMG_LST'
+NDVI_GROUP = 'MOD_Grid_monthly_CMG_VI'
+FLDAS_LAYERS = ['SoilMoi00_10cm_tavg', 'SoilMoi10_40cm_tavg', 'SoilMoi40_100cm_tavg', 'SoilMoi100_200cm_tavg']
+
+
+class SyntheticProject:
+    """
+    This class writes a synthetic CDI project for a configurable number of years and AOI size
+    """
+    def __init__(self, root, years=3, aoi_size=2.0, start_year=2001, region='Synthetic', n_lat=-25.675, w_lon=30.675, seed=0):
+        """
+        Args:
+            root (str): directory to create the project in
+            years (int): number of years of monthly data to create
+            aoi_size (float): width and height of the area of interest in degrees
+            start_year (int): the first year of data
+            region (str): the region name used in the output file names
+            n_lat (float): north latitude of the AOI (0.05 degree cell center)
+            w_lon (float): west longitude of the AOI (0.05 degree cell center)
+            seed (int): random seed
+        """
+        self.root = os.path.abspath(root)
+        self.years = int(years)
+        self.start_year = int(start_year)
+        self.region = region
+        cells = max(2, int(round(aoi_size * 20)))
+        self.bounds = {
+            'n_lat': round(n_lat, 3),
+            's_lat': round(n_lat - (cells - 1) * 0.05, 3),
+            'w_lon': round(w_lon, 3),
+            'e_lon': round(w_lon + (cells - 1) * 0.05, 3)
+        }
+        self.rows = cells
+        self.columns = cells
+        self.__random = np.random.default_rng(seed)
+        self.dirs = {
+            'lst_hdf': os.path.join(self.root, 'source', 'input_data', 'MOD21C3_LST'),
+            'ndvi_hdf': os.path.join(self.root, 'source', 'input_data', 'MOD13C2_NDVI'),
+            'chirps_tif': os.path.join(self.root, 'source', 'input_data', 'CHIRPS'),
+            'fldas_data': os.path.join(self.root, 'source', 'input_data', 'soil_moisture'),
+            'scratch_dir': os.path.join(self.root, 'source', 'working_data'),
+            'output_dir': os.path.join(self.root, 'source', 'output_data'),
+            'geotiff_dir': os.path.join(self.root, 'source', 'output_data', 'GeoTiffs')
+        }
+
+    @property
+    def months(self):
+        """
+        Returns:
+            List of (year, month) tuples covered by the project
+        """
+        return [(self.start_year + m // 12, m % 12 + 1) for m in range(self.years * 12)]
+
+    @property
+    def latitudes(self):
+        return [round(self.bounds['n_lat'] - j * 0.05, 3) for j in range(self.rows)]
+
+    @property
+    def longitudes(self):
+        return [round(self.bounds['w_lon'] + i * 0.05, 3) for i in range(self.columns)]
+
+    @staticmethod
+    def calendar_value(year, month):
+        return float((date(year, month, 1) - date(1900, 1, 1)).days)
+
+    def create(self):
+        """
+        This function writes the configuration, all raw inputs and the ranked inputs of the CDI
+        """
+        self.write_config()
+        for (year, month) in self.months:
+            self.write_lst_hdf(year, month)
+            self.write_ndvi_hdf(year, month)
+            self.write_chirps_tif(year, month)
+            self.write_fldas_netcdf(year, month)
+        self.write_rank_files()
+        return self
+
+    def write_config(self):
+        """
+        This function writes the three configuration files used by libs.config_reader.ConfigParser
+        """
+        for d in self.dirs.values():
+            os.makedirs(d, exist_ok=True)
+        for sub_dir in ['LST', 'NDVI', 'SPI', 'SM']:
+            os.makedirs(os.path.join(self.dirs['scratch_dir'], sub_dir), exist_ok=True)
+            os.makedirs(os.path.join(self.dirs['geotiff_dir'], sub_dir), exist_ok=True)
+        os.makedirs(os.path.join(self.dirs['geotiff_dir'], 'CDI'), exist_ok=True)
+        project = {
+            "region_name": self.region,
+            "bounds": self.bounds,
+            "spi_periods": [3],
+            "cdi_parameters": {
+                "names": {
+                    "lst": "lst_anom_pct_rank",
+                    "ndvi": "ndvi_anom_pct_rank",
+                    "spi": "spi_3_anom_pct_rank",
+                    "sm": "RootZone2_SM_pct_rank"
+                },
+                "weights": {"lst": 0.3, "ndvi": 0.3, "spi": 0.4, "sm": 0.0}
+            },
+            # the map colors, QC rules and HDF conversion settings are copied from the repository, like the file patterns #
+            "map_colors": self.__repository_config('cdi_project_settings.conf')['map_colors'],
+            "zone_name_field": "name",
+            "qc_rules": self.__repository_config('cdi_project_settings.conf')['qc_rules'],
+            "hdf_conversion": self.__repository_config('cdi_project_settings.conf')['hdf_conversion']
+        }
+        directories = {
+            "raw_data_dirs": {k: './' + os.path.relpath(self.dirs[k], self.root) for k in ['lst_hdf', 'ndvi_hdf', 'chirps_tif', 'fldas_data']},
+            "hdf_groups": {"lst": LST_GROUP, "ndvi": NDVI_GROUP},
+            "scratch_dir": './' + os.path.relpath(self.dirs['scratch_dir'], self.root),
+            "geotiff_dir": './' + os.path.relpath(self.dirs['geotiff_dir'], self.root),
+            "output_dir": './' + os.path.relpath(self.dirs['output_dir'], self.root),
+            "map_sources_dir": "./source/mapping/data",
+            "map_export_dir": "./source/mapping/output/maps",
+            "map_overlay": "",
+            "zone_file": "./source/zones.geojson",
+            "aoi_file": ""
+        }
+        # the file patterns are copied from the repository so the generator follows any changes to them #
+        patterns = self.__repository_config('cdi_pattern_settings.conf')
+        for name, values in [('cdi_project_settings.conf', project), ('cdi_directory_settings.conf', directories), ('cdi_pattern_settings.conf', patterns)]:
+            with open(os.path.join(self.root, name), 'w') as fh:
+                fh.write(json.dumps(values, indent=4))
+        self.write_zones()
+
+    def write_zones(self, divisions=3):
+        """
+        This function writes a GeoJSON file of divisions x divisions rectangular zones covering the AOI
+            The zone edges do not follow the grid cell edges, so the cells along them are split between zones
+        """
+        north = self.bounds['n_lat'] + 0.025
+        west = self.bounds['w_lon'] - 0.025
+        height = (self.rows * 0.05) / divisions
+        width = (self.columns * 0.05) / divisions
+        features = []
+        for j in range(divisions):
+            for i in range(divisions):
+                top, left = north - j * height, west + i * width
+                ring = [[left, top], [left + width, top], [left + width, top - height], [left, top - height], [left, top]]
+                features.append({
+                    "type": "Feature",
+                    "properties": {"name": "Zone {}".format(j * divisions + i + 1)},
+                    "geometry": {"type": "Polygon", "coordinates": [ring]}
+                })
+        with open(os.path.join(self.root, 'source', 'zones.geojson'), 'w') as fh:
+            fh.write(json.dumps({"type": "FeatureCollection", "features": features}))
+
+    @staticmethod
+    def __repository_config(name):
+        with open(os.path.join(REPO_ROOT, name), 'r') as fh:
+            return json.loads(fh.read())
+
+    def __window(self, top_lat, left_lon, resolution, pad=2):
+        """
+        This function determines the array window of a global grid that covers the AOI plus a small pad
+        Args:
+            top_lat (float): latitude of the top edge of the global grid
+            left_lon (float): longitude of the left edge of the global grid
+            resolution (float): grid spacing in degrees
+            pad (int): number of extra cells around the AOI
+
+        Returns:
+            Tuple of (first row, last row, first column, last column)
+        """
+        first_row = int(np.floor((top_lat - self.bounds['n_lat']) / resolution)) - pad
+        last_row = int(np.ceil((top_lat - self.bounds['s_lat']) / resolution)) + pad
+        first_column = int(np.floor((self.bounds['w_lon'] - left_lon) / resolution)) - pad
+        last_column = int(np.ceil((self.bounds['e_lon'] - left_lon) / resolution)) + pad
+        return max(first_row, 0), last_row, max(first_column, 0), last_column
+
+    def __seasonal_field(self, shape, month, mean, amplitude, noise):
+        """
+        This function creates a smooth seasonal field with random year-to-year variation
+        """
+        season = np.cos((month - 1) / 12.0 * 2.0 * np.pi)
+        gradient = np.linspace(-0.5, 0.5, shape[1])[np.newaxis, :]
+        return mean + amplitude * season + gradient * amplitude + self.__random.normal(0.0, noise, shape)
+
+    def __write_hdf(self, file_path, group, fields):
+        """
+        This function writes a HDF5 file with the layout produced by h4toh5convert: /<group>/Data Fields/<parameter>
+        Args:
+            file_path (str): fully-qualified path of the file to create
+            group (str): name of the grid group
+            fields (dict): parameter name to (global array, scale factor, units)
+        """
+        with h5py.File(file_path, 'w') as fh:
+            data_fields = fh.create_group(group).create_group('Data Fields')
+            for name, (values, scale, units) in fields.items():
+                variable = data_fields.create_dataset(name, data=values, compression='gzip', chunks=(400, 800))
+                variable.attrs['scale_factor'] = scale
+                variable.attrs['units'] = units
+
+    def write_lst_hdf(self, year, month):
+        """
+        This function writes a MOD21C3 file: LST_Day/LST_Night are uint16 Kelvin scaled by 0.02 (0 is fill),
+            QC_Day/QC_Night are uint8 where values below 16 are rejected by STEP_0101
+        """
+        doy = date(year, month, 1).timetuple().tm_yday
+        file_path = os.path.join(self.dirs['lst_hdf'], 'MOD21C3.A{}{:03d}.061.synthetic.hdf'.format(year, doy))
+        y0, y1, x0, x1 = self.__window(90.0, -180.0, 0.05)
+        shape = (y1 - y0, x1 - x0)
+        fields = {}
+        for name, mean in [('LST_Day', 305.0), ('LST_Night', 285.0)]:
+            values = np.zeros((3600, 7200), dtype=np.uint16)
+            values[y0:y1, x0:x1] = np.clip(self.__seasonal_field(shape, month, mean, 8.0, 2.0) / 0.02, 7500, 65535).astype(np.uint16)
+            fields[name] = (values, 0.02, 'K')
+        for name in ['QC_Day', 'QC_Night']:
+            values = np.zeros((3600, 7200), dtype=np.uint8)
+            values[y0:y1, x0:x1] = self.__random.choice(np.array([0, 17, 65, 129], dtype=np.uint8), size=shape, p=[0.05, 0.45, 0.3, 0.2])
+            fields[name] = (values, 1.0, 'none')
+        self.__write_hdf(file_path, LST_GROUP, fields)
+        return file_path
+
+    def write_ndvi_hdf(self, year, month):
+        """
+        This function writes a MOD13C2 file: NDVI is int16 scaled by 0.0001 (-3000 is fill),
+            VI Quality is uint16 with a mix of values accepted and rejected by STEP_0102
+        """
+        doy = date(year, month, 1).timetuple().tm_yday
+        file_path = os.path.join(self.dirs['ndvi_hdf'], 'MOD13C2.A{}{:03d}.061.synthetic.hdf'.format(year, doy))
+        y0, y1, x0, x1 = self.__window(90.0, -180.0, 0.05)
+        shape = (y1 - y0, x1 - x0)
+        ndvi = np.full((3600, 7200), -3000, dtype=np.int16)
+        ndvi[y0:y1, x0:x1] = np.clip(self.__seasonal_field(shape, month, 0.45, 0.15, 0.05) / 0.0001, -2000, 10000).astype(np.int16)
+        quality = np.zeros((3600, 7200), dtype=np.uint16)
+        quality[y0:y1, x0:x1] = self.__random.choice(np.array([2116, 12000, 14000, 18000, 20000], dtype=np.uint16), size=shape, p=[0.05, 0.4, 0.3, 0.05, 0.2])
+        fields = {
+            'CMG 0.05 Deg Monthly NDVI': (ndvi, 0.0001, 'NDVI'),
+            'CMG 0.05 Deg Monthly VI Quality': (quality, 1.0, 'bit field')
+        }
+        self.__write_hdf(file_path, NDVI_GROUP, fields)
+        return file_path
+
+    def write_chirps_tif(self, year, month):
+        """
+        This function writes a quasi-global CHIRPS monthly GeoTIFF (50S - 50N at 0.05 degrees) of precipitation in mm
+        """
+        file_path = os.path.join(self.dirs['chirps_tif'], 'c{}{:02d}.tif'.format(year, month))
+        y0, y1, x0, x1 = self.__window(50.0, -180.0, 0.05)
+        values = np.full((2000, 7200), MISSING, dtype=np.float32)
+        precip = self.__seasonal_field((y1 - y0, x1 - x0), month, 60.0, 50.0, 25.0)
+        values[y0:y1, x0:x1] = np.maximum(precip, 0.0)
+        with rasterio.open(file_path, 'w', driver='GTiff', width=7200, height=2000, count=1, dtype='float32',
+                           crs='EPSG:4326', transform=Affine(0.05, 0.0, -180.0, 0.0, -0.05, 50.0), nodata=MISSING,
+                           compress='deflate', tiled=True) as output:
+            output.write(values, 1)
+        return file_path
+
+    def write_fldas_netcdf(self, year, month):
+        """
+        This function writes a global FLDAS monthly file (60S - 90N at 0.1 degrees) with the four soil moisture layers
+            The latitudes run from south to north, as in the real product
+        """
+        file_path = os.path.join(self.dirs['fldas_data'], 'FLDAS_NOAH01_C_GL_M.A{}{:02d}.001.nc'.format(year, month))
+        latitudes = np.round(np.arange(-59.95, 90.0, 0.1), 3)
+        longitudes = np.round(np.arange(-179.95, 180.0, 0.1), 3)
+        # window in the south-to-north grid #
+        first_row = max(int(np.floor((self.bounds['s_lat'] + 59.95) / 0.1)) - 3, 0)
+        last_row = int(np.ceil((self.bounds['n_lat'] + 59.95) / 0.1)) + 4
+        first_column = max(int(np.floor((self.bounds['w_lon'] + 179.95) / 0.1)) - 3, 0)
+        last_column = int(np.ceil((self.bounds['e_lon'] + 179.95) / 0.1)) + 4
+        data_set = Dataset(file_path, 'w', format='NETCDF4')
+        try:
+            data_set.createDimension('time', 1)
+            data_set.createDimension('Y', len(latitudes))
+            data_set.createDimension('X', len(longitudes))
+            time_var = data_set.createVariable('time', 'f8', ('time',))
+            time_var.units = 'days since 1900-01-01 00:00:00'
+            time_var[:] = [self.calendar_value(year, month)]
+            y_var = data_set.createVariable('Y', 'f4', ('Y',))
+            y_var[:] = latitudes
+            x_var = data_set.createVariable('X', 'f4', ('X',))
+            x_var[:] = longitudes
+            shape = (last_row - first_row, last_column - first_column)
+            for depth, name in enumerate(FLDAS_LAYERS):
+                variable = data_set.createVariable(name, 'f4', ('time', 'Y', 'X'), fill_value=MISSING, zlib=True)
+                variable.units = 'm^3 m-3'
+                values = np.full((len(latitudes), len(longitudes)), MISSING, dtype=np.float32)
+                values[first_row:last_row, first_column:last_column] = np.clip(self.__seasonal_field(shape, month, 0.25 + 0.02 * depth, 0.05, 0.02), 0.01, 0.6)
+                variable[0] = values
+        finally:
+            data_set.close()
+        return file_path
+
+    def __write_ranked_file(self, file_path, variables):
+        """
+        This function writes a percent-rank NetCDF file in the layout of netcdf_functions.initialize_dataset
+        """
+        times = [self.calendar_value(y, m) for (y, m) in self.months]
+        properties = {'latitudes': self.latitudes, 'longitudes': self.longitudes, 'times': times, 'time_units': TIME_UNITS}
+        data_set = netcdf.initialize_dataset(file_path, properties)
+        try:
+            for name in variables:
+                variable = data_set.createVariable(name, 'float32', ('time', 'latitude', 'longitude'))
+                variable.units = '1'
+                variable.missing_value = MISSING
+                values = np.round(self.__random.uniform(0.0, 1.0, (len(times), self.rows, self.columns)), 3)
+                values[:, 0, 0] = MISSING
+                variable[:] = values
+        finally:
+            data_set.close()
+
+    def write_rank_files(self):
+        """
+        This function writes synthetic STEP_0201 - STEP_0204 and STEP_0302 files so the CDI and export stages
+            can be measured without running the earlier steps
+        """
+        output_dir = self.dirs['output_dir']
+        for name, variables in [
+            ("STEP_0201_LST_anomaly_pct_rank_{}.nc", ['lst_anom_pct_rank']),
+            ("STEP_0202_NDVI_anomaly_pct_rank_{}.nc", ['ndvi_anom_pct_rank']),
+            ("STEP_0203_SPI_anomaly_pct_rank_{}.nc", ['spi_3_anom_pct_rank']),
+            ("STEP_0204_SM_pct_rank_{}.nc", ['RootZone_SM_pct_rank', 'RootZone2_SM_pct_rank', 'TotalColumn_SM_pct_rank']),
+            ("STEP_0302_CDI_pct_rank_{}.nc", ['cdi_wt_sum_pr'])
+        ]:
+            self.__write_ranked_file(os.path.join(output_dir, name.format(self.region)), variables)
+
+
+def main(args):
+    project = SyntheticProject(args.output, args.years, args.aoi_size, args.start_year, args.region, seed=args.seed)
+    print("Creating synthetic project in {} ({} years, {}x{} cells)".format(project.root, project.years, project.rows, project.columns))
+    project.create()
+    print("Finished creating synthetic data")
+
+
+if __name__ == '__main__':
+    # set up the command line argument parser
+    parser = ArgumentParser()
+    parser.add_argument("-o", "--output", required=True,
+                        help="The directory to create the synthetic project in")
+    parser.add_argument("-y", "--years", default=3, type=int,
+                        help="The number of years of monthly data to create. Default is 3")
+    parser.add_argument("-a", "--aoi-size", default=2.0, type=float,
+                        help="The width and height of the area of interest in degrees. Default is 2.0")
+    parser.add_argument("--start-year", default=2001, type=int,
+                        help="The first year of data. Default is 2001")
+    parser.add_argument("--region", default="Synthetic",
+                        help="The region name used in the file names. Default is Synthetic")
+    parser.add_argument("--seed", default=0, type=int,
+                        help="The random seed. Default is 0")
+    # execute the program with the supplied options
+    main(parser.parse_args())
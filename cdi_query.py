@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+import csv
+import json
+import sys
+from libs.config_reader import ConfigParser
+from libs.date_range import DateRange, add_arguments as add_date_range_arguments
+from libs.time_index import TimeIndex
+from libs.point_query import PointQuery
+from argparse import ArgumentParser
+
+"""
+Point time series query of the CDI outputs (cdi-query)
+    Prints the CDI and component percentile rank history at one or more points, on the dates common to all of them
+    The first query of an output creates a pixel-major copy of it in <scratch_dir>/QUERY, which is used until the
+    output changes, so later queries only read the rows of the requested pixels
+Usage (from the project directory):
+    python cdi_query.py --lat -26.5 --lon 31.5 --start 202001 --end 202012
+    python cdi_query.py --points points.csv --format json --output series.json
+"""
+
+
+def read_points(file_path):
+    """
+    This function reads the points of a CSV file with 'lat' and 'lon' columns
+    Args:
+        file_path (str): fully-qualified path/name of the CSV file
+
+    Returns:
+        List of (latitude, longitude) tuples
+    """
+    with open(file_path, 'r', newline='') as fh:
+        return [(float(row['lat']), float(row['lon'])) for row in csv.DictReader(fh)]
+
+
+def write_results(fh, points, times, values, parameters, output_format='csv'):
+    """
+    This function writes the time series of the points as CSV (a row per point and date) or JSON
+    """
+    dates = TimeIndex.from_times(times).dates()
+    if output_format == 'json':
+        results = []
+        for i, (lat, lon) in enumerate(points):
+            series = {p: [round(float(v), 4) for v in values[p][i]] for p in parameters}
+            results.append({'lat': lat, 'lon': lon, 'dates': dates, 'values': series})
+        fh.write(json.dumps(results) + '\n')
+        return
+    writer = csv.writer(fh, lineterminator='\n')
+    writer.writerow(['lat', 'lon', 'date'] + parameters)
+    for i, (lat, lon) in enumerate(points):
+        for t, date_string in enumerate(dates):
+            writer.writerow([lat, lon, date_string] + [round(float(values[p][i, t]), 4) for p in parameters])
+
+
+def main(args):
+    """
+    This is the main entry point for the program
+    """
+    try:
+        points = []
+        if args.points is not None:
+            points = read_points(args.points)
+        if args.lat is not None and args.lon is not None:
+            points.append((args.lat, args.lon))
+        if len(points) == 0:
+            raise ValueError("Give a point with --lat and --lon, or a file of points with --points")
+        query = PointQuery(ConfigParser())
+        times, values = query.query(points, DateRange.from_args(args))
+        if args.output is not None:
+            with open(args.output, 'w', newline='') as fh:
+                write_results(fh, points, times, values, query.parameters, args.format)
+        else:
+            write_results(sys.stdout, points, times, values, query.parameters, args.format)
+        return 0
+    except IOError as ioe:
+        print(ioe, file=sys.stderr)
+    except Exception as ex:
+        print(ex, file=sys.stderr)
+    return 1
+
+
+if __name__ == '__main__':
+    # set up the command line argument parser
+    parser = ArgumentParser(prog='cdi-query')
+    parser.add_argument("--lat", default=None, type=float,
+                        help="The latitude of the point")
+    parser.add_argument("--lon", default=None, type=float,
+                        help="The longitude of the point")
+    parser.add_argument("-p", "--points", default=None,
+                        help="A CSV file of points, with 'lat' and 'lon' columns")
+    parser.add_argument("-f", "--format", default="csv", choices=["csv", "json"],
+                        help="The output format: csv (a row per point and date) or json. Default is csv")
+    parser.add_argument("-o", "--output", default=None,
+                        help="The file to write the results to. Default is the standard output")
+    add_date_range_arguments(parser)
+    # execute the program with the supplied options
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+import os
+# the open read-only handles must not lock the outputs, so the steps can still write them #
+os.environ.setdefault('HDF5_USE_FILE_LOCKING', 'FALSE')
+from libs.config_reader import ConfigParser  # noqa: E402
+from libs.query_service import OutputStore, create_server  # noqa: E402
+from argparse import ArgumentParser  # noqa: E402
+
+"""
+Local query service of the CDI outputs (standard library HTTP server)
+    Keeps the output NetCDF files open and serves the latest and monthly grids and the point time series as JSON or
+    binary float32 values, from an LRU cache of the decoded arrays; a changed output file is detected by its
+    modification time and read again
+Usage (from the project directory):
+    python cdi_service.py --port 8080 --cache-mb 512
+    curl "http://127.0.0.1:8080/grid/cdi/latest"
+    curl "http://127.0.0.1:8080/grid/cdi/202103?format=bin"
+    curl "http://127.0.0.1:8080/series?lat=-26.5&lon=31.5&start=202001"
+"""
+
+
+def main(args):
+    """
+    This is the main entry point for the program
+    """
+    store = None
+    try:
+        store = OutputStore(ConfigParser(), args.cache_mb * 1024 * 1024)
+        server = create_server(store, args.host, args.port, args.quiet)
+        print("Serving the {} outputs on http://{}:{}/".format(', '.join(p.upper() for p in store.parameters),
+                                                              args.host, args.port))
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("Stopped")
+    except IOError as ioe:
+        print(ioe)
+    except Exception as ex:
+        print(ex)
+    finally:
+        if store is not None:
+            store.close()
+
+
+if __name__ == '__main__':
+    # set up the command line argument parser
+    parser = ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1",
+                        help="The address to listen on. Default is 127.0.0.1")
+    parser.add_argument("-p", "--port", default=8080, type=int,
+                        help="The port to listen on. Default is 8080")
+    parser.add_argument("-c", "--cache-mb", default=256, type=int,
+                        help="The maximum size of the cached grids and series in MB. Default is 256")
+    parser.add_argument("-q", "--quiet", action="store_true",
+                        help="Do not log the requests")
+    # execute the program with the supplied options
+    main(parser.parse_args())
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import os
+import numpy as np
+from libs.config_reader import get_aoi_file
+from libs.zonal_statistics import ZoneIndex, read_zones
+from libs.change_tracking import combine_fingerprints
+
+
+class AOIMask:
+    """
+    This class holds the grid cells of the area of interest (e.g. the country) within the bounds box of the project
+        The statistics, SPI, ranking and CDI steps work on packed arrays of the AOI cells only (the last axis of the
+        arrays is the cell instead of latitude and longitude); the values are scattered back to the grid, with missing
+        values outside the AOI, only when they are written to the NetCDF files
+        Without an AOI file every cell of the bounds box is in the mask, and packing is a reshape of the grid
+    """
+    def __init__(self, mask):
+        """
+        Args:
+            mask: 2D boolean numpy array (latitudes, longitudes), true for the cells of the AOI
+        """
+        self.mask = np.asarray(mask, dtype=bool)
+        self.shape = self.mask.shape
+        self.cells = np.flatnonzero(self.mask)
+        self.is_full = len(self.cells) == self.mask.size
+
+    @classmethod
+    def full(cls, rows, columns):
+        """
+        This function creates the mask of the whole bounds box
+        Returns:
+            AOIMask object
+        """
+        return cls(np.ones((rows, columns), dtype=bool))
+
+    @classmethod
+    def from_polygons(cls, polygons, latitudes, longitudes, supersample=10):
+        """
+        This function rasterizes the AOI polygons with the zone rasterizer; a grid cell is in the AOI when any of its
+            supersampled points is inside a polygon, so the cells along the border are kept
+        Args:
+            polygons (list): the (name, geometry) tuples from read_zones
+            latitudes (list): the latitudes of the grid cell centers, from north to south
+            longitudes (list): the longitudes of the grid cell centers, from west to east
+            supersample (int): the number of points per grid cell in each direction
+
+        Returns:
+            AOIMask object
+        """
+        index = ZoneIndex.from_polygons(polygons, latitudes, longitudes, supersample)
+        mask = np.zeros(len(latitudes) * len(longitudes), dtype=bool)
+        mask[index.cells] = True
+        return cls(mask.reshape(len(latitudes), len(longitudes)))
+
+    @classmethod
+    def load(cls, cache_file, key):
+        """
+        This function loads a cached mask
+        Args:
+            cache_file (str): fully-qualified path/name of the .npz cache file
+            key (str): the description of the AOI file and grid the mask must have been created for
+
+        Returns:
+            AOIMask object, or None when there is no cache for the key
+        """
+        if not os.path.isfile(cache_file):
+            return None
+        with np.load(cache_file) as cache:
+            if str(cache['key']) != key:
+                return None
+            return cls(cache['mask'])
+
+    def save(self, cache_file, key):
+        """
+        This function caches the mask in a .npz file
+            The file is written under a temporary name first, since the steps of several branches may run at once
+        Args:
+            cache_file (str): fully-qualified path/name of the .npz cache file
+            key (str): the description of the AOI file and grid of the mask
+        """
+        temp_file = "{}.{}.tmp".format(cache_file, os.getpid())
+        with open(temp_file, 'wb') as fh:
+            np.savez_compressed(fh, key=np.array(key), mask=self.mask)
+        os.replace(temp_file, cache_file)
+
+    @property
+    def fingerprint(self):
+        """
+        Returns:
+            String checksum of the cells of the mask
+        """
+        return hashlib.sha1(json.dumps(list(self.shape)).encode('utf-8') + self.cells.tobytes()).hexdigest()
+
+    def pack(self, values):
+        """
+        This function keeps the values of the AOI cells
+        Args:
+            values: numpy array (..., latitudes, longitudes)
+
+        Returns:
+            numpy array (..., cells)
+        """
+        values = np.asarray(values)
+        flat = values.reshape(values.shape[:-2] + (-1,))
+        return flat if self.is_full else flat[..., self.cells]
+
+    def unpack(self, values, missing=-9999.0):
+        """
+        This function scatters packed values back to the grid
+        Args:
+            values: numpy array (..., cells), or a masked array whose masked values are written as missing
+            missing (float): the value of the cells outside the AOI
+
+        Returns:
+            numpy array (..., latitudes, longitudes)
+        """
+        values = np.ma.filled(values, missing)
+        if self.is_full:
+            return values.reshape(values.shape[:-1] + self.shape)
+        grid = np.full(values.shape[:-1] + (self.mask.size,), missing, dtype=values.dtype)
+        grid[..., self.cells] = values
+        return grid.reshape(values.shape[:-1] + self.shape)
+
+    def tag_fingerprints(self, fingerprints):
+        """
+        This function combines the input fingerprints of an output with the mask, so changing the AOI changes every
+            month and the outputs are computed again
+        Args:
+            fingerprints (dictionary): the 'YYYYMM' date: fingerprint of the inputs, or None
+
+        Returns:
+            Dictionary of 'YYYYMM' date: fingerprint, unchanged without an AOI file
+        """
+        if fingerprints is None or self.is_full:
+            return fingerprints
+        return combine_fingerprints([fingerprints, {d: self.fingerprint for d in fingerprints}], sorted(fingerprints))
+
+
+def get_aoi_mask(config, supersample=10):
+    """
+    This function returns the AOI mask of the project, rasterizing the polygons only when the AOI file or the grid
+        changed since the cached mask was created
+    Args:
+        config (ConfigParser): the project configuration
+        supersample (int): the number of points per grid cell in each direction
+
+    Returns:
+        AOIMask object; the whole bounds box when the configuration has no AOI file
+    """
+    latitudes = config.get('latitudes')
+    longitudes = config.get('longitudes')
+    aoi_file = get_aoi_file(config)
+    if aoi_file == '':
+        return AOIMask.full(len(latitudes), len(longitudes))
+    cache_file = os.path.join(config.get('scratch_dir').replace("\\", '/'),
+                              "aoi_mask_{}.npz".format(config.get('region_name')))
+    status = os.stat(aoi_file)
+    key = json.dumps({
+        'aoi_file': os.path.abspath(aoi_file),
+        'size': status.st_size,
+        'mtime': status.st_mtime,
+        'latitudes': [latitudes[0], latitudes[-1], len(latitudes)],
+        'longitudes': [longitudes[0], longitudes[-1], len(longitudes)],
+        'supersample': supersample
+    }, sort_keys=True)
+    mask = AOIMask.load(cache_file, key)
+    if mask is None:
+        mask = AOIMask.from_polygons(read_zones(aoi_file), latitudes, longitudes, supersample)
+        if len(mask.cells) == 0:
+            raise ValueError("The AOI polygons of {} do not cover any cell of the bounds".format(aoi_file))
+        mask.save(cache_file, key)
+    return mask
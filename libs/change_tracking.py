@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import os
+import libs.netcdf_functions as netcdf
+from libs.pipeline import fingerprint_file
+from libs.date_range import ChangedMonths
+
+"""
+Change tracking of the inputs of the monthly outputs
+    Each working file records the name and fingerprint of the raw file it was created from, so a raw file that is
+    reprocessed in place is detected and converted again
+    Each output records the fingerprint of the input of every month ({'YYYYMM': fingerprint}) in its global
+    attributes; the months whose fingerprint has changed since then are the only ones to compute again
+"""
+
+# the global attribute of the input fingerprints of an output #
+FINGERPRINTS_ATTRIBUTE = 'input_fingerprints'
+# the global attribute of the SPI fingerprints of the CDI outputs; a changed SPI month also changes the next months #
+SPI_FINGERPRINTS_ATTRIBUTE = 'spi_fingerprints'
+
+
+def set_source(data_set, source_file, fingerprint):
+    """
+    This function records the raw file of a working file in its global attributes
+    Args:
+        data_set (NetCDF4): the working file being written
+        source_file (str): the name of the raw file
+        fingerprint (str): the fingerprint of the raw file
+    """
+    data_set.source_file = source_file
+    data_set.source_fingerprint = fingerprint
+
+
+def read_source(file_path):
+    """
+    This function reads the raw file recorded in a working file
+    Args:
+        file_path (str): fully-qualified path/name of the working file
+
+    Returns:
+        Tuple of (raw file name, fingerprint), or None if the file does not exist or was created without them
+    """
+    if not os.path.isfile(file_path):
+        return None
+    data_set = None
+    try:
+        data_set = netcdf.open_dataset(file_path)
+        attributes = data_set.ncattrs()
+        if 'source_file' not in attributes or 'source_fingerprint' not in attributes:
+            return None
+        return str(data_set.source_file), str(data_set.source_fingerprint)
+    except (IOError, KeyError):
+        return None
+    finally:
+        if data_set is not None:
+            data_set.close()
+
+
+def is_source_changed(file_path, source_file, fingerprint):
+    """
+    This function tests if the raw file of a working file has changed since the working file was created
+        Working files created without a recorded raw file, or from another raw file of the same month,
+        are taken as current
+    Args:
+        file_path (str): fully-qualified path/name of the working file
+        source_file (str): the name of the raw file
+        fingerprint (str): the current fingerprint of the raw file
+
+    Returns:
+        Boolean flag
+    """
+    recorded = read_source(file_path)
+    return recorded is not None and recorded[0] == source_file and recorded[1] != fingerprint
+
+
+def get_file_fingerprints(files_by_date):
+    """
+    This function fingerprints the monthly working files by their size and modification time,
+        so a month changes when its working file is written again
+    Args:
+        files_by_date (dictionary): the 'YYYYMM' date: fully-qualified path of the file of each month
+
+    Returns:
+        Dictionary of 'YYYYMM' date: fingerprint
+    """
+    return {d: fingerprint_file(f, 'mtime') for d, f in files_by_date.items()}
+
+
+def combine_fingerprints(fingerprint_sets, dates):
+    """
+    This function combines the fingerprints of several inputs for each date
+    Args:
+        fingerprint_sets (list): the dictionaries of 'YYYYMM' date: fingerprint of the inputs
+        dates (list): the 'YYYYMM' dates to combine
+
+    Returns:
+        Dictionary of 'YYYYMM' date: combined fingerprint
+    """
+    combined = {}
+    for d in dates:
+        combined[d] = hashlib.sha1('|'.join(str(f.get(d)) for f in fingerprint_sets).encode('utf-8')).hexdigest()
+    return combined
+
+
+def read_fingerprints(data_set, attribute=FINGERPRINTS_ATTRIBUTE):
+    """
+    This function reads the input fingerprints recorded in an output
+    Args:
+        data_set: NetCDF4 Dataset object, or the fully-qualified path/name of the NetCDF file
+        attribute (str): the global attribute of the fingerprints
+
+    Returns:
+        Dictionary of 'YYYYMM' date: fingerprint, or None if the output does not exist or has none recorded
+    """
+    if not isinstance(data_set, str):
+        if attribute not in data_set.ncattrs():
+            return None
+        return json.loads(data_set.getncattr(attribute))
+    if not os.path.isfile(data_set):
+        return None
+    opened = None
+    try:
+        opened = netcdf.open_dataset(data_set)
+        return read_fingerprints(opened, attribute)
+    except (IOError, ValueError):
+        return None
+    finally:
+        if opened is not None:
+            opened.close()
+
+
+def set_fingerprints(data_set, fingerprints, attribute=FINGERPRINTS_ATTRIBUTE):
+    """
+    This function records the input fingerprints in an output, once all of its months have been written
+    Args:
+        data_set (NetCDF4): the output opened for writing
+        fingerprints (dictionary): the 'YYYYMM' date: fingerprint of the inputs
+        attribute (str): the global attribute of the fingerprints
+    """
+    data_set.setncattr(attribute, json.dumps(fingerprints, sort_keys=True, separators=(',', ':')))
+
+
+def write_fingerprints(file_path, fingerprints, attribute=FINGERPRINTS_ATTRIBUTE):
+    """
+    This function records the input fingerprints in an existing output file
+    Args:
+        file_path (str): fully-qualified path/name of the NetCDF file
+        fingerprints (dictionary): the 'YYYYMM' date: fingerprint of the inputs
+        attribute (str): the global attribute of the fingerprints
+    """
+    data_set = None
+    try:
+        data_set = netcdf.open_dataset(file_path, 'a')
+        set_fingerprints(data_set, fingerprints, attribute)
+    except IOError:
+        raise
+    except Exception:
+        raise
+    finally:
+        if data_set is not None:
+            data_set.close()
+
+
+def get_changed_dates(recorded, current):
+    """
+    This function compares the recorded and current input fingerprints
+    Returns:
+        Sorted list of the 'YYYYMM' dates that are new or have changed
+    """
+    return sorted(d for d, f in current.items() if recorded.get(d) != f)
+
+
+def get_update_range(date_range, recorded, current):
+    """
+    This function determines the months of an existing output to update in place
+    Args:
+        date_range (DateRange): the range of months requested on the command line
+        recorded (dictionary): the input fingerprints recorded in the output, or None
+        current (dictionary): the current input fingerprints, or None when the inputs do not record them
+
+    Returns:
+        ChangedMonths of the date range and of the months whose inputs have changed, the date range alone when
+            no fingerprints can be compared, or None when the output must be created again
+    """
+    if recorded is None or current is None:
+        return date_range if date_range.is_set else None
+    return ChangedMonths(date_range, get_changed_dates(recorded, current))
+
+
+def extend_update_range(update_range, months, recorded, current):
+    """
+    This function extends the months to update after the changed months of an input whose monthly values also
+        depend on the previous months (the multi-month SPI totals), and moves the end of the date range forward
+        Only the months whose fingerprint of that input has changed are extended; every changed month is extended
+        when the fingerprints of the input cannot be compared (e.g. an output written before they were recorded)
+    Args:
+        update_range (DateRange): the months to update from get_update_range, or None
+        months (int): the number of months to add after each changed month of the input
+        recorded (dictionary): the fingerprints of the input recorded in the output, or None
+        current (dictionary): the current fingerprints of the input, or None
+
+    Returns:
+        The extended ChangedMonths or DateRange, or None when the output must be created again
+    """
+    if update_range is None:
+        return None
+    if not isinstance(update_range, ChangedMonths) or recorded is None or current is None:
+        return update_range.extend(months)
+    return update_range.extend(months, get_changed_dates(recorded, current))
@@ -52,3 +52,33 @@ class ConfigParser:
             return longitudes
         else:
             return self.config[parameter]
+
+
+def get_aoi_file(config):
+    """
+    This function reads the optional AOI polygon file of the configuration
+    Args:
+        config (ConfigParser): the project configuration
+
+    Returns:
+        String path of the GeoJSON file, or an empty string when the whole bounds box is processed
+    """
+    try:
+        return (config.get('aoi_file') or '').replace("\\", '/')
+    except KeyError:
+        return ''
+
+
+def get_zone_file(config):
+    """
+    This function reads the optional zone polygon file of the configuration
+    Args:
+        config (ConfigParser): the project configuration
+
+    Returns:
+        String path of the GeoJSON file, or an empty string when no zonal statistics are computed
+    """
+    try:
+        return (config.get('zone_file') or '').replace("\\", '/')
+    except KeyError:
+        return ''
@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+import re
+from argparse import ArgumentTypeError
+from datetime import date, timedelta
+
+
+def year_month(value):
+    """
+    This function validates a 'YYYYMM' command line value
+    Args:
+        value (str): the value to test
+
+    Returns:
+        String of the year/month in 'YYYYMM' format
+    """
+    if re.match(r'^(19|20)\d\d(0[1-9]|1[0-2])$', str(value)) is None:
+        raise ArgumentTypeError("'{}' is not a valid year/month; use the YYYYMM format, e.g. 202103".format(value))
+    return str(value)
+
+
+def add_arguments(parser):
+    """
+    This function adds the --start and --end options to a command line parser
+    Args:
+        parser (ArgumentParser): the parser of a STEP script
+    """
+    parser.add_argument("--start", default=None, type=year_month,
+                        help="The first month (YYYYMM) to reprocess. Default is the first available month")
+    parser.add_argument("--end", default=None, type=year_month,
+                        help="The last month (YYYYMM) to reprocess. Default is the last available month")
+
+
+def time_to_year_month(time):
+    """
+    This function converts a NetCDF time (days since Jan 1, 1900) to the year and month
+    Args:
+        time: the NetCDF time
+
+    Returns:
+        Tuple of integers (year, month)
+    """
+    valid_date = date(1900, 1, 1) + timedelta(days=int(time))
+    return valid_date.year, valid_date.month
+
+
+class DateRange:
+    """
+    This class holds the optional range of months (--start/--end) that a step is limited to
+        When neither value is set, the range contains every month
+    """
+    def __init__(self, start=None, end=None):
+        """
+        Args:
+            start (str): optional first month in 'YYYYMM' format
+            end (str): optional last month in 'YYYYMM' format
+        """
+        self.start = None if start is None else (int(str(start)[0:4]), int(str(start)[4:6]))
+        self.end = None if end is None else (int(str(end)[0:4]), int(str(end)[4:6]))
+        if self.start is not None and self.end is not None and self.start > self.end:
+            raise ValueError("The start month {} is after the end month {}".format(start, end))
+
+    @classmethod
+    def from_args(cls, args):
+        """
+        This function creates the range from the parsed command line arguments (which may not define the options)
+        """
+        return cls(getattr(args, 'start', None), getattr(args, 'end', None))
+
+    @property
+    def is_set(self):
+        return self.start is not None or self.end is not None
+
+    def contains(self, year, month):
+        """
+        This function tests if a year/month is within the range
+        Args:
+            year (int): the year
+            month (int): the month (1 - 12)
+
+        Returns:
+            Boolean flag
+        """
+        value = (int(year), int(month))
+        if self.start is not None and value < self.start:
+            return False
+        if self.end is not None and value > self.end:
+            return False
+        return True
+
+    def contains_date(self, date_string):
+        """
+        This function tests if a 'YYYYMM' date string is within the range
+        """
+        return self.contains(date_string[0:4], date_string[4:6])
+
+    def contains_time(self, time):
+        """
+        This function tests if a NetCDF time (days since Jan 1, 1900) is within the range
+        """
+        return self.contains(*time_to_year_month(time))
+
+    def extend(self, months):
+        """
+        This function creates a range with the end moved forward, e.g. to cover the multi-month totals that include
+            the months of this range
+        Args:
+            months (int): the number of months to add to the end
+
+        Returns:
+            DateRange object
+        """
+        if self.end is None or months <= 0:
+            return DateRange(self.__format(self.start), self.__format(self.end))
+        total = self.end[0] * 12 + (self.end[1] - 1) + months
+        return DateRange(self.__format(self.start), "{}{:02d}".format(total // 12, total % 12 + 1))
+
+    @staticmethod
+    def __format(value):
+        return None if value is None else "{}{:02d}".format(value[0], value[1])
+
+    def time_indices(self, times):
+        """
+        This function finds the positions of a time dimension that are within the range
+        Args:
+            times: list of NetCDF times (days since Jan 1, 1900)
+
+        Returns:
+            List of integer indices
+        """
+        # numpy is only imported when the times are compared, so the orchestrator starts without it #
+        import numpy as np
+        from libs.time_index import TimeIndex
+        months = TimeIndex.from_times(times).months
+        selected = np.ones(len(months), dtype=bool)
+        if self.start is not None:
+            selected &= months >= TimeIndex.from_year_months(*self.start).months
+        if self.end is not None:
+            selected &= months <= TimeIndex.from_year_months(*self.end).months
+        return np.flatnonzero(selected).tolist()
+
+    def calendar_months(self, times):
+        """
+        This function finds the months of the year (1 - 12) of the times within the range
+        Args:
+            times: list of NetCDF times (days since Jan 1, 1900)
+
+        Returns:
+            Sorted list of integer months
+        """
+        from libs.time_index import TimeIndex
+        month_of_year = TimeIndex.from_times(times).month_of_year
+        return sorted(set(month_of_year[self.time_indices(times)].tolist()))
+
+    def __str__(self):
+        return "{} - {}".format(self.__format(self.start) or 'first', self.__format(self.end) or 'last')
+
+
+class ChangedMonths(DateRange):
+    """
+    This class holds the months to update in place: the months of an optional date range, and the months whose
+        inputs have changed since the output was written (found by comparing the recorded input fingerprints)
+        It is always set: when no month has changed, nothing needs to be updated
+    """
+    def __init__(self, date_range=None, dates=()):
+        """
+        Args:
+            date_range (DateRange): optional range of months to update
+            dates (iterable): the 'YYYYMM' dates that have changed
+        """
+        DateRange.__init__(self)
+        self.__date_range = date_range if date_range is not None else DateRange()
+        self.start = self.__date_range.start
+        self.end = self.__date_range.end
+        self.dates = set((int(str(d)[0:4]), int(str(d)[4:6])) for d in dates)
+
+    @property
+    def is_set(self):
+        return True
+
+    def contains(self, year, month):
+        if (int(year), int(month)) in self.dates:
+            return True
+        return self.__date_range.is_set and self.__date_range.contains(year, month)
+
+    def time_indices(self, times):
+        """
+        This function finds the positions of a time dimension that are changed months or within the date range
+        Args:
+            times: list of NetCDF times (days since Jan 1, 1900)
+
+        Returns:
+            List of integer indices
+        """
+        import numpy as np
+        from libs.time_index import TimeIndex
+        changed = TimeIndex.from_year_months([year for year, null in self.dates], [month for null, month in self.dates])
+        selected = np.isin(TimeIndex.from_times(times).months, changed.months)
+        if self.__date_range.is_set:
+            selected[self.__date_range.time_indices(times)] = True
+        return np.flatnonzero(selected).tolist()
+
+    def calendar_months(self, times):
+        """
+        This function finds the months of the year (1 - 12) to update: the months of the changed dates, even those
+            outside the times (a changed input month changes the rankings of its month in every year), and the months
+            of the times within the date range
+        Args:
+            times: list of NetCDF times (days since Jan 1, 1900)
+
+        Returns:
+            Sorted list of integer months
+        """
+        months = set(month for null, month in self.dates)
+        if self.__date_range.is_set:
+            months.update(self.__date_range.calendar_months(times))
+        return sorted(months)
+
+    def extend(self, months, extended_dates=None):
+        """
+        This function creates a set with each changed month followed by the next months, and the range end moved forward
+        Args:
+            months (int): the number of months to add after each month
+            extended_dates (iterable): optional 'YYYYMM' dates to extend; the other changed months are kept as they
+                are. Default is to extend every changed month
+
+        Returns:
+            ChangedMonths object
+        """
+        extended = self.dates
+        if extended_dates is not None:
+            extended = set((int(str(d)[0:4]), int(str(d)[4:6])) for d in extended_dates)
+        dates = []
+        for year, month in self.dates:
+            for m in range(0, (max(months, 0) if (year, month) in extended else 0) + 1):
+                total = year * 12 + (month - 1) + m
+                dates.append("{}{:02d}".format(total // 12, total % 12 + 1))
+        date_range = self.__date_range.extend(months) if self.__date_range.is_set else self.__date_range
+        return ChangedMonths(date_range, dates)
+
+    def __str__(self):
+        changed = "{} changed months".format(len(self.dates))
+        return "{}, {}".format(self.__date_range, changed) if self.__date_range.is_set else changed
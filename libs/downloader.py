@@ -0,0 +1,464 @@
+# -*- coding: utf-8 -*-
+import base64
+import hashlib
+import http.client
+import http.cookiejar
+import json
+import netrc
+import os
+import re
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from html.parser import HTMLParser
+from urllib.parse import urljoin, urlsplit
+
+CHUNK_SIZE = 1024 * 1024
+REDIRECT_CODES = [301, 302, 303, 307, 308]
+
+
+class LinkParser(HTMLParser):
+    """
+    This class collects the links of an HTML directory listing
+    """
+    def __init__(self):
+        HTMLParser.__init__(self)
+        self.links = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'a':
+            for name, value in attrs:
+                if name == 'href' and value:
+                    self.links.append(value)
+
+
+class HttpSession:
+    """
+    This class is a small HTTP(S) session built on the standard library
+        Keep-alive connections are pooled per thread and host, cookies are kept across requests and redirects
+        (as needed by the NASA Earthdata login), and the credentials of a host are sent when it asks for them
+    """
+    def __init__(self, credentials=None, cookie_file=None, timeout=60, max_redirects=10):
+        """
+        Args:
+            credentials (dict): optional (user, password) of each host name; ~/.netrc is used for the other hosts
+            cookie_file (str): optional Mozilla format cookie file to load and save the session cookies
+            timeout (int): the socket timeout in seconds
+            max_redirects (int): the maximum number of redirects of a request
+        """
+        self.__credentials = credentials if credentials is not None else {}
+        self.__cookie_file = cookie_file
+        if cookie_file is not None:
+            self.__cookies = http.cookiejar.MozillaCookieJar(cookie_file)
+            if os.path.isfile(cookie_file):
+                self.__cookies.load(ignore_discard=True, ignore_expires=True)
+        else:
+            self.__cookies = http.cookiejar.CookieJar()
+        self.__timeout = timeout
+        self.__max_redirects = max_redirects
+        self.__local = threading.local()
+
+    def __get_connection(self, scheme, host):
+        """
+        This function returns the open connection of the current thread to a host, or opens a new one
+        """
+        if not hasattr(self.__local, 'connections'):
+            self.__local.connections = {}
+        key = (scheme, host)
+        if key not in self.__local.connections:
+            if scheme == 'https':
+                self.__local.connections[key] = http.client.HTTPSConnection(host, timeout=self.__timeout)
+            else:
+                self.__local.connections[key] = http.client.HTTPConnection(host, timeout=self.__timeout)
+        return self.__local.connections[key]
+
+    def __drop_connection(self, scheme, host):
+        connection = getattr(self.__local, 'connections', {}).pop((scheme, host), None)
+        if connection is not None:
+            connection.close()
+
+    def __send(self, scheme, host, method, path, headers):
+        """
+        This function sends a request on the pooled connection to the host
+            A kept-alive connection may have been closed by the server, so the request is sent once more on a new one
+        Returns:
+            http.client.HTTPResponse object
+        """
+        reused = hasattr(self.__local, 'connections') and (scheme, host) in self.__local.connections
+        connection = self.__get_connection(scheme, host)
+        try:
+            connection.request(method, path, headers=headers)
+            return connection.getresponse()
+        except (http.client.HTTPException, OSError):
+            self.__drop_connection(scheme, host)
+            if not reused:
+                raise
+        connection = self.__get_connection(scheme, host)
+        try:
+            connection.request(method, path, headers=headers)
+            return connection.getresponse()
+        except (http.client.HTTPException, OSError):
+            self.__drop_connection(scheme, host)
+            raise
+
+    def __get_credentials(self, host_name):
+        """
+        This function finds the user and password of a host
+        Returns:
+            Tuple of (user, password), or None
+        """
+        if host_name in self.__credentials:
+            return self.__credentials[host_name]
+        try:
+            authenticators = netrc.netrc().authenticators(host_name)
+        except (IOError, netrc.NetrcParseError):
+            return None
+        if authenticators is None:
+            return None
+        return authenticators[0], authenticators[2]
+
+    def request(self, url, method='GET', headers=None):
+        """
+        This function sends a request and follows the redirects
+            The body of the returned response must be read completely before the next request of the thread
+        Args:
+            url (str): the URL
+            method (str): the HTTP method
+            headers (dict): optional request headers
+
+        Returns:
+            http.client.HTTPResponse object, and the final URL
+        """
+        authorized_hosts = set()
+        for r in range(0, self.__max_redirects + 1):
+            parts = urlsplit(url)
+            request = urllib.request.Request(url, method=method, headers=headers if headers is not None else {})
+            self.__cookies.add_cookie_header(request)
+            request_headers = dict(request.header_items())
+            if parts.hostname in authorized_hosts:
+                credentials = self.__get_credentials(parts.hostname)
+                token = "{}:{}".format(credentials[0], credentials[1]).encode('utf-8')
+                request_headers['Authorization'] = 'Basic ' + base64.b64encode(token).decode('ascii')
+            path = parts.path or '/'
+            if parts.query:
+                path += '?' + parts.query
+            response = self.__send(parts.scheme, parts.netloc, method, path, request_headers)
+            self.__cookies.extract_cookies(response, request)
+            if response.status in REDIRECT_CODES and response.getheader('Location') is not None:
+                response.read()
+                url = urljoin(url, response.getheader('Location'))
+                if response.status == 303:
+                    method = 'GET'
+                continue
+            if response.status == 401 and parts.hostname not in authorized_hosts and \
+                    self.__get_credentials(parts.hostname) is not None:
+                # send the request again with the credentials of the host #
+                response.read()
+                authorized_hosts.add(parts.hostname)
+                continue
+            return response, url
+        raise IOError("Too many redirects for {}".format(url))
+
+    def get_text(self, url):
+        """
+        This function downloads a (small) text document, e.g. a directory listing
+        Returns:
+            String of the document
+        """
+        response, final_url = self.request(url)
+        body = response.read()
+        if response.status != 200:
+            raise IOError("HTTP {} {} for {}".format(response.status, response.reason, url))
+        charset = response.headers.get_content_charset() or 'utf-8'
+        return body.decode(charset, errors='replace')
+
+    def save_cookies(self):
+        """
+        This function saves the session cookies to the cookie file
+        """
+        if self.__cookie_file is not None:
+            self.__cookies.save(ignore_discard=True, ignore_expires=True)
+
+
+class HostLimiter:
+    """
+    This class limits the load on each host: the number of concurrent requests, and the rate of new requests
+    """
+    def __init__(self, connections_per_host=2, requests_per_second=None):
+        """
+        Args:
+            connections_per_host (int): the maximum number of concurrent requests to a host
+            requests_per_second (float): optional maximum rate of new requests to a host
+        """
+        self.__connections_per_host = connections_per_host
+        self.__interval = 1.0 / requests_per_second if requests_per_second else 0.0
+        self.__semaphores = {}
+        self.__next_start = {}
+        self.__lock = threading.Lock()
+
+    def acquire(self, host):
+        """
+        This function waits until a request to the host is allowed
+        """
+        with self.__lock:
+            if host not in self.__semaphores:
+                self.__semaphores[host] = threading.BoundedSemaphore(self.__connections_per_host)
+            semaphore = self.__semaphores[host]
+        semaphore.acquire()
+        with self.__lock:
+            now = time.monotonic()
+            start = max(now, self.__next_start.get(host, now))
+            self.__next_start[host] = start + self.__interval
+        if start > now:
+            time.sleep(start - now)
+
+    def release(self, host):
+        self.__semaphores[host].release()
+
+
+class DownloadRecord:
+    """
+    This class keeps the persistent record of the completed downloads in a JSON file
+        A completed file is skipped by later runs while it still exists with the recorded size
+    """
+    def __init__(self, record_file):
+        self.__record_file = record_file
+        self.__lock = threading.Lock()
+        self.__entries = {}
+        if record_file is not None and os.path.isfile(record_file):
+            with open(record_file, 'r') as fh:
+                self.__entries = json.loads(fh.read())
+
+    def is_complete(self, url, file_path):
+        entry = self.__entries.get(url)
+        return entry is not None and os.path.isfile(file_path) and os.path.getsize(file_path) == entry['size']
+
+    def add(self, url, file_path, size, sha256):
+        """
+        This function records a completed download, and saves the record
+        """
+        with self.__lock:
+            self.__entries[url] = {
+                'file': os.path.basename(file_path),
+                'size': size,
+                'sha256': sha256,
+                'completed': datetime.now().isoformat(timespec='seconds')
+            }
+            if self.__record_file is not None:
+                # replace the record in one step, so an interrupted run cannot corrupt it #
+                temp_file = self.__record_file + '.tmp'
+                with open(temp_file, 'w') as fh:
+                    fh.write(json.dumps(self.__entries, indent=1, sort_keys=True))
+                os.replace(temp_file, self.__record_file)
+
+
+def parse_checksum(checksum):
+    """
+    This function splits an 'algorithm:digest' checksum, e.g. 'md5:9e107d9d372bb6826bd81d3542a419d6'
+    Returns:
+        Tuple of (algorithm, lower case digest)
+    """
+    algorithm, digest = checksum.split(':', 1)
+    return algorithm.lower(), digest.strip().lower()
+
+
+class Downloader:
+    """
+    This is the core processing class for downloading the raw data archives
+        The files are downloaded concurrently (with limits for each host), partial files are resumed with range
+        requests, each file is verified against its size and optional checksum, and completed files are recorded
+    """
+    def __init__(self, target_dir, record_file=None, workers=4, connections_per_host=2, requests_per_second=None,
+                 session=None, retries=3):
+        """
+        Args:
+            target_dir (str): the directory for the downloaded files
+            record_file (str): optional JSON file of the completed downloads. Default is download_record.json in target_dir
+            workers (int): the number of files to download at the same time
+            connections_per_host (int): the maximum number of concurrent downloads from a host
+            requests_per_second (float): optional maximum rate of new requests to a host
+            session (HttpSession): optional session, e.g. with credentials. Default is a new session
+            retries (int): the number of attempts for each file
+        """
+        self.__target_dir = target_dir
+        os.makedirs(target_dir, exist_ok=True)
+        if record_file is None:
+            record_file = os.path.join(target_dir, 'download_record.json')
+        self.__record = DownloadRecord(record_file)
+        self.__workers = workers
+        self.__limiter = HostLimiter(connections_per_host, requests_per_second)
+        self.__session = session if session is not None else HttpSession()
+        self.__retries = max(retries, 1)
+
+    def list_files(self, url, pattern, recursive=False, exclude=('doc',)):
+        """
+        This function lists the file links of an HTML directory listing that match a pattern
+        Args:
+            url (str): the URL of the directory listing (ending with '/')
+            pattern (str): regular expression the file names must match
+            recursive (boolean): flag to also list the sub-directories (one level), as used by the GES DISC archives
+            exclude (tuple): the sub-directory names to skip
+
+        Returns:
+            Sorted list of file URLs
+        """
+        regex = re.compile(pattern)
+        parser = LinkParser()
+        host = urlsplit(url).netloc
+        self.__limiter.acquire(host)
+        try:
+            parser.feed(self.__session.get_text(url))
+        finally:
+            self.__limiter.release(host)
+        files = set()
+        for link in parser.links:
+            target = urljoin(url, link)
+            # skip the sort links, the parent directory and other sites #
+            if '?' in link or not target.startswith(url) or target == url:
+                continue
+            name = target[len(url):].rstrip('/')
+            if target.endswith('/'):
+                if recursive and '/' not in name and name not in exclude:
+                    files.update(self.list_files(target, pattern, False, exclude))
+            elif regex.search(name) is not None:
+                files.add(target)
+        return sorted(files)
+
+    def download(self, url, file_name=None, checksum=None):
+        """
+        This function downloads a single file, resuming a partial download, with retries
+        Args:
+            url (str): the URL of the file
+            file_name (str): optional name of the local file. Default is the last part of the URL
+            checksum (str): optional expected 'algorithm:digest' checksum (e.g. md5 or sha256)
+
+        Returns:
+            String of the local file path
+        """
+        file_name = file_name if file_name is not None else os.path.basename(urlsplit(url).path)
+        file_path = os.path.join(self.__target_dir, file_name)
+        if self.__record.is_complete(url, file_path):
+            return file_path
+        for attempt in range(1, self.__retries + 1):
+            try:
+                self.__download_file(url, file_path, checksum)
+                return file_path
+            except (IOError, http.client.HTTPException) as ex:
+                if attempt == self.__retries:
+                    raise
+                print("Retrying {} ({})".format(file_name, ex))
+                time.sleep(2 ** attempt)
+
+    def __download_file(self, url, file_path, checksum):
+        """
+        This function downloads a file to a '.part' file, appending to the data of an earlier attempt
+            The '.part' file is renamed once its size and checksum are verified
+        """
+        part_file = file_path + '.part'
+        offset = os.path.getsize(part_file) if os.path.isfile(part_file) else 0
+        headers = {'Range': 'bytes={}-'.format(offset)} if offset > 0 else {}
+        host = urlsplit(url).netloc
+        self.__limiter.acquire(host)
+        try:
+            response, final_url = self.__session.request(url, headers=headers)
+            if response.status == 416 and offset > 0:
+                # the partial file may already hold the complete file #
+                response.read()
+                total = self.__get_total_size(response)
+                if total != offset:
+                    os.remove(part_file)
+                    raise IOError("Partial download of {} is invalid, starting again".format(url))
+            elif response.status == 206 and offset > 0:
+                self.__save_body(response, part_file, 'ab')
+            elif response.status == 200:
+                # the server does not support ranges (or there is no partial file) #
+                self.__save_body(response, part_file, 'wb')
+            else:
+                response.read()
+                raise IOError("HTTP {} {} for {}".format(response.status, response.reason, url))
+            total = self.__get_total_size(response)
+        finally:
+            self.__limiter.release(host)
+        # verify the file #
+        size = os.path.getsize(part_file)
+        if total is not None and size != total:
+            raise IOError("Incomplete download of {}: {} of {} bytes".format(url, size, total))
+        digests = self.__compute_digests(part_file, [] if checksum is None else [parse_checksum(checksum)[0]])
+        if checksum is not None:
+            algorithm, expected = parse_checksum(checksum)
+            if digests[algorithm] != expected:
+                os.remove(part_file)
+                raise IOError("Checksum mismatch for {}: expected {} {}".format(url, algorithm, expected))
+        os.replace(part_file, file_path)
+        self.__record.add(url, file_path, size, digests['sha256'])
+
+    @staticmethod
+    def __save_body(response, file_path, mode):
+        with open(file_path, mode) as fh:
+            while True:
+                chunk = response.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                fh.write(chunk)
+
+    @staticmethod
+    def __get_total_size(response):
+        """
+        This function finds the complete size of the file from the Content-Range or Content-Length header
+        Returns:
+            Integer size in bytes, or None if unknown
+        """
+        content_range = response.getheader('Content-Range')
+        if content_range is not None and '/' in content_range:
+            total = content_range.split('/')[-1].strip()
+            return int(total) if total.isdigit() else None
+        if response.status == 200 and response.getheader('Content-Length') is not None:
+            return int(response.getheader('Content-Length'))
+        return None
+
+    @staticmethod
+    def __compute_digests(file_path, algorithms):
+        """
+        This function computes the sha256 (for the record) and the other requested digests of a file in one pass
+        Returns:
+            Dictionary of hexadecimal digests by algorithm
+        """
+        hashes = {'sha256': hashlib.sha256()}
+        for algorithm in algorithms:
+            if algorithm not in hashes:
+                hashes[algorithm] = hashlib.new(algorithm)
+        with open(file_path, 'rb') as fh:
+            while True:
+                chunk = fh.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                for h in hashes.values():
+                    h.update(chunk)
+        return {algorithm: h.hexdigest() for algorithm, h in hashes.items()}
+
+    def download_all(self, urls, checksums=None):
+        """
+        This function downloads the files concurrently
+        Args:
+            urls (list): the URLs of the files
+            checksums (dict): optional expected 'algorithm:digest' checksum of each URL
+
+        Returns:
+            Tuple of (list of downloaded file paths, dictionary of the error of each failed URL)
+        """
+        checksums = checksums if checksums is not None else {}
+        downloaded = []
+        failed = {}
+        with ThreadPoolExecutor(max_workers=self.__workers) as executor:
+            futures = {executor.submit(self.download, url, None, checksums.get(url)): url for url in urls}
+            for future in as_completed(futures):
+                url = futures[future]
+                try:
+                    downloaded.append(future.result())
+                except (IOError, http.client.HTTPException) as ex:
+                    failed[url] = str(ex)
+                    print("Failed to download {}: {}".format(url, ex))
+        self.__session.save_cookies()
+        return downloaded, failed
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import shutil
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import libs.hdf_functions as hdf
+from libs.pipeline import fingerprint_file
+from libs.profiling import span
+
+
+class ConversionManifest:
+    """
+    This class records the converted HDF4 files in a JSON file, keyed by the checksum of the HDF4 file
+        The size and modification time of each source are kept too, so an unchanged file is not read again to
+        compute its checksum
+    """
+    def __init__(self, manifest_file):
+        self.__manifest_file = manifest_file
+        self.__lock = threading.Lock()
+        self.__entries = {}
+        if os.path.isfile(manifest_file):
+            with open(manifest_file, 'r') as fh:
+                self.__entries = json.loads(fh.read())
+
+    def find(self, source_name, size, mtime):
+        """
+        This function finds the checksum of a source file by its name, size and modification time
+        Returns:
+            String checksum, or None when the file is not recorded or has changed
+        """
+        with self.__lock:
+            for checksum, entry in self.__entries.items():
+                if entry['source'] == source_name and entry['size'] == size and entry['mtime'] == mtime:
+                    return checksum
+        return None
+
+    def get_output(self, checksum):
+        """
+        This function returns the converted file of a checksum
+        Returns:
+            String path of the HDF5 file, or None when the checksum is not recorded or the file no longer exists
+        """
+        with self.__lock:
+            entry = self.__entries.get(checksum)
+        if entry is None or not os.path.isfile(entry['output']):
+            return None
+        return entry['output']
+
+    def add(self, checksum, source_name, size, mtime, output):
+        """
+        This function records a converted file and saves the manifest
+        """
+        with self.__lock:
+            self.__entries[checksum] = {'source': source_name, 'size': size, 'mtime': mtime, 'output': output}
+            temp_file = self.__manifest_file + '.tmp'
+            with open(temp_file, 'w') as fh:
+                fh.write(json.dumps(self.__entries, indent=1, sort_keys=True))
+            os.replace(temp_file, self.__manifest_file)
+
+
+class HDFConverter:
+    """
+    This class converts the HDF4 files of a MODIS product to HDF5 with the h4toh5convert tool, on a pool of workers
+        A file is converted once whatever its name: the manifest is keyed by the checksum of the HDF4 file,
+        and a changed file is converted again
+        The HDF4 originals are kept (the HDF5 copies are written to the converted directory), or replaced by their
+        HDF5 version when keep_originals is false; files that are already HDF5 are never converted
+    """
+    def __init__(self, raw_data_dir, converted_dir, converter='./libs/h4toh5convert', jobs=1, keep_originals=True):
+        """
+        Args:
+            raw_data_dir (str): the directory of the HDF files of the product
+            converted_dir (str): the directory of the HDF5 copies and of the manifest
+            converter (str): the path of the h4toh5convert executable
+            jobs (int): the number of files to convert at the same time
+            keep_originals (boolean): flag to keep the HDF4 files; otherwise each is replaced by its HDF5 version
+        """
+        self.__raw_data_dir = raw_data_dir
+        self.__converted_dir = converted_dir
+        self.__converter = converter
+        self.__jobs = max(jobs, 1)
+        self.__keep_originals = keep_originals
+        os.makedirs(converted_dir, exist_ok=True)
+        self.__manifest = ConversionManifest(os.path.join(converted_dir, 'manifest.json'))
+
+    def __get_checksum(self, file_path, file_name):
+        """
+        This function returns the checksum of a HDF4 file, from the manifest when the file is unchanged
+        Returns:
+            Tuple of (checksum, size, modification time)
+        """
+        status = os.stat(file_path)
+        checksum = self.__manifest.find(file_name, status.st_size, status.st_mtime)
+        if checksum is None:
+            checksum = fingerprint_file(file_path, 'content')
+        return checksum, status.st_size, status.st_mtime
+
+    def get_read_path(self, file_name):
+        """
+        This function returns the file to read for a raw HDF file: the file itself when it is HDF5 or has not been
+            converted (HDF4 files are then read through GDAL), otherwise its HDF5 copy
+        Args:
+            file_name (str): the name of the HDF file, relative to the raw data directory
+
+        Returns:
+            String fully-qualified path of the file to read
+        """
+        raw_file_path = "{}/{}".format(self.__raw_data_dir, file_name)
+        if hdf.is_hdf5(raw_file_path):
+            return raw_file_path
+        status = os.stat(raw_file_path)
+        checksum = self.__manifest.find(file_name, status.st_size, status.st_mtime)
+        output = self.__manifest.get_output(checksum) if checksum is not None else None
+        return output if output is not None else raw_file_path
+
+    def __convert_file(self, file_name):
+        """
+        This function converts a HDF4 file, unless the manifest has a HDF5 version of the same contents
+        Returns:
+            Boolean flag, true if the file was converted
+        """
+        raw_file_path = "{}/{}".format(self.__raw_data_dir, file_name)
+        checksum, size, mtime = self.__get_checksum(raw_file_path, file_name)
+        output = self.__manifest.get_output(checksum)
+        if output is not None:
+            # the same contents were converted before, e.g. under another name #
+            self.__manifest.add(checksum, file_name, size, mtime, output)
+            return False
+        h5_path = os.path.join(self.__converted_dir, file_name)
+        os.makedirs(os.path.dirname(h5_path), exist_ok=True)
+        temp_file = h5_path + '.tmp'
+        try:
+            with span('convert', file=file_name) as s:
+                subprocess.run([self.__converter, raw_file_path, temp_file], check=True)
+                s.add_file_read(raw_file_path)
+        except Exception:
+            if os.path.isfile(temp_file):
+                os.remove(temp_file)
+            raise
+        if self.__keep_originals:
+            os.replace(temp_file, h5_path)
+        else:
+            # replace the HDF4 file by its HDF5 version, under the same name (the directories may be on other disks) #
+            shutil.move(temp_file, raw_file_path)
+            status = os.stat(raw_file_path)
+            h5_path, size, mtime = raw_file_path, status.st_size, status.st_mtime
+        self.__manifest.add(checksum, file_name, size, mtime, h5_path)
+        return True
+
+    def convert(self, file_names):
+        """
+        This function converts the HDF4 files that have no HDF5 version yet, on the pool of workers
+        Args:
+            file_names (list): the names of the HDF files, relative to the raw data directory
+
+        Returns:
+            List of the names of the converted files
+        """
+        to_check = [f for f in file_names if not hdf.is_hdf5("{}/{}".format(self.__raw_data_dir, f))]
+        converted = []
+        if len(to_check) == 0:
+            return converted
+        with ThreadPoolExecutor(max_workers=self.__jobs) as executor:
+            futures = {executor.submit(self.__convert_file, f): f for f in to_check}
+            for future in as_completed(futures):
+                if future.result():
+                    converted.append(futures[future])
+        return sorted(converted)
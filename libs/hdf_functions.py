@@ -21,6 +21,57 @@ def open_dataset(file_path):
         raise
 
 
+def is_hdf5(file_path):
+    """
+    This function tests if a file is in HDF5 format (e.g. converted by h4toh5convert), rather than HDF4
+    Args:
+        file_path (str): fully-qualified path/name of the HDF file
+
+    Returns:
+        Boolean flag, true for a HDF5 file
+    """
+    return h5py.is_hdf5(file_path)
+
+
+def get_hdf4_subdataset(file_path, group, parameter):
+    """
+    This function returns the GDAL name of a field of a HDF4-EOS grid, to read a HDF4 file without converting it
+    Args:
+        file_path (str): fully-qualified path/name of the HDF4 file
+        group (str): name of the EOS grid
+        parameter (str): name of the field
+
+    Returns:
+        String path for rasterio.open
+    """
+    return 'HDF4_EOS:EOS_GRID:"{}":{}:{}'.format(file_path, group, parameter)
+
+
+def extract_hdf4_window(file_path, group, parameter, rows, columns):
+    """
+    This function reads a window of a field of a HDF4-EOS grid through GDAL (requires the GDAL HDF4 driver)
+    Args:
+        file_path (str): fully-qualified path/name of the HDF4 file
+        group (str): name of the EOS grid
+        parameter (str): name of the field
+        rows (tuple): the first and last + 1 row of the window
+        columns (tuple): the first and last + 1 column of the window
+
+    Returns:
+        2D numpy array of the raw (unscaled) values
+    """
+    import rasterio
+    from rasterio.windows import Window
+    try:
+        with rasterio.open(get_hdf4_subdataset(file_path, group, parameter)) as src:
+            window = Window(columns[0], rows[0], columns[1] - columns[0], rows[1] - rows[0])
+            return src.read(1, window=window)
+    except IOError:
+        raise
+    except Exception:
+        raise
+
+
 def extract_data(data_set, group, parameter, time=0):
     """
     This function extracts the data from a HDF variable as a numpy array
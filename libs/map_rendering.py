@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import numpy as np
+from datetime import date
+
+
+def hex_to_rgba(color):
+    """
+    This function converts a '#RRGGBB' or '#RRGGBBAA' color to a RGBA tuple
+    Args:
+        color (str): the hexadecimal color
+
+    Returns:
+        Tuple of 4 integers (0 - 255)
+    """
+    value = color.lstrip('#')
+    if len(value) == 6:
+        value += 'ff'
+    return tuple(int(value[i:i + 2], 16) for i in range(0, 8, 2))
+
+
+def create_color_table(color_classes, no_data_color='#00000000', steps=1000):
+    """
+    This function creates the color lookup table of the percentile classes
+        The percentile ranks are rounded to 3 decimals, so a table of 1001 entries covers every value,
+        and the last entry holds the color of the missing values
+    Args:
+        color_classes (list): the [upper limit, color] pairs of the classes, in increasing order;
+            a value belongs to the first class with an upper limit >= the value
+        no_data_color (str): the color of the missing values
+        steps (int): the number of table entries between 0.0 and 1.0
+
+    Returns:
+        2D numpy array (steps + 2, 4) of uint8 RGBA values
+    """
+    table = np.zeros((steps + 2, 4), dtype=np.uint8)
+    values = np.arange(0, steps + 1) / float(steps)
+    # fill from the last class down, so the lowest matching class wins #
+    table[0:steps + 1] = hex_to_rgba(color_classes[-1][1])
+    for limit, color in reversed(color_classes):
+        table[0:steps + 1][values <= limit + 0.5 / steps] = hex_to_rgba(color)
+    table[steps + 1] = hex_to_rgba(no_data_color)
+    return table
+
+
+def apply_color_table(data, table, missing=-9999.0):
+    """
+    This function colors the percentile ranks of an image with the lookup table
+    Args:
+        data: 2D numpy array of the percentile ranks (0.0 - 1.0)
+        table: the color lookup table from create_color_table
+        missing (float): the missing value
+
+    Returns:
+        3D numpy array (rows, columns, 4) of uint8 RGBA values
+    """
+    steps = table.shape[0] - 2
+    invalid = (data == missing) | ~np.isfinite(data)
+    indices = np.rint(np.clip(np.where(invalid, 0.0, data), 0.0, 1.0) * steps).astype(np.intp)
+    indices[invalid] = steps + 1
+    return np.take(table, indices, axis=0)
+
+
+def read_overlay_lines(geojson_file):
+    """
+    This function reads the outlines of the (multi)polygon and line features of a GeoJSON file
+    Args:
+        geojson_file (str): fully-qualified path/name of the GeoJSON file (longitude/latitude coordinates)
+
+    Returns:
+        List of lines, each a list of (longitude, latitude) points
+    """
+    with open(geojson_file, 'r') as fh:
+        collection = json.loads(fh.read())
+    lines = []
+    for feature in collection.get('features', []):
+        geometry = feature.get('geometry') or {}
+        coordinates = geometry.get('coordinates', [])
+        if geometry.get('type') == 'Polygon' or geometry.get('type') == 'MultiLineString':
+            lines.extend(coordinates)
+        elif geometry.get('type') == 'MultiPolygon':
+            for polygon in coordinates:
+                lines.extend(polygon)
+        elif geometry.get('type') == 'LineString':
+            lines.append(coordinates)
+    return lines
+
+
+class QuicklookRenderer:
+    """
+    This class renders the percentile rank GeoTiffs to PNG quicklook maps, without any GIS desktop application
+        The color lookup table and the overlay are prepared once, and used for every map of the same grid
+    """
+    def __init__(self, color_classes, overlay_file=None, scale=8, missing=-9999.0):
+        """
+        Args:
+            color_classes (list): the [upper limit, color] pairs of the percentile classes
+            overlay_file (str): optional GeoJSON file of the outlines to draw on the maps
+            scale (int): the number of map pixels per grid cell
+            missing (float): the missing value
+        """
+        # the missing values are grey, apart from the white normal class #
+        self.__table = create_color_table(color_classes, '#BEBEBE')
+        self.__color_classes = color_classes
+        self.__lines = []
+        if overlay_file is not None and os.path.isfile(overlay_file):
+            self.__lines = read_overlay_lines(overlay_file)
+        self.__scale = max(int(scale), 1)
+        self.__missing = missing
+        self.__overlays = {}
+        self.__title_height = 24
+        self.__legend_height = 28
+
+    def __get_overlay(self, transform, rows, columns):
+        """
+        This function draws the overlay outlines for a grid, or returns the one drawn before
+        Returns:
+            PIL RGBA image of the map size
+        """
+        from PIL import Image, ImageDraw
+        key = (tuple(transform)[0:6], rows, columns)
+        if key not in self.__overlays:
+            overlay = Image.new('RGBA', (columns * self.__scale, rows * self.__scale), (0, 0, 0, 0))
+            draw = ImageDraw.Draw(overlay)
+            inverse = ~transform
+            for line in self.__lines:
+                points = []
+                for point in line:
+                    column, row = inverse * (point[0], point[1])
+                    points.append((column * self.__scale, row * self.__scale))
+                if len(points) > 1:
+                    draw.line(points, fill=(40, 40, 40, 255), width=1)
+            self.__overlays[key] = overlay
+        return self.__overlays[key]
+
+    def __draw_legend(self, draw, top, width):
+        """
+        This function draws the color classes and their upper limits below the map
+        """
+        box = max(int(width / len(self.__color_classes)), 1)
+        for c, (limit, color) in enumerate(self.__color_classes):
+            left = c * box
+            draw.rectangle([left, top, left + box - 1, top + 10], fill=hex_to_rgba(color), outline=(0, 0, 0, 255))
+            draw.text((left + 2, top + 13), "{:g}".format(limit * 100), fill=(0, 0, 0, 255))
+
+    def render(self, tif_file, png_file, title):
+        """
+        This function renders a single band GeoTiff to a PNG map with a title, the overlay and a legend
+        Args:
+            tif_file (str): fully-qualified path/name of the percentile rank GeoTiff
+            png_file (str): fully-qualified path/name of the PNG to write
+            title (str): the text above the map
+
+        Returns:
+            Integer number of grid cells rendered
+        """
+        import rasterio
+        from PIL import Image, ImageDraw
+        with rasterio.open(tif_file) as source:
+            data = source.read(1).astype(float)
+            transform = source.transform
+        rows, columns = data.shape
+        # color the grid cells and enlarge them to the map size #
+        colors = apply_color_table(data, self.__table, self.__missing)
+        colors = np.repeat(np.repeat(colors, self.__scale, axis=0), self.__scale, axis=1)
+        map_image = Image.alpha_composite(Image.fromarray(colors, 'RGBA'), self.__get_overlay(transform, rows, columns))
+        # place the map between the title and the legend #
+        width, height = map_image.size
+        image = Image.new('RGBA', (width, height + self.__title_height + self.__legend_height), (255, 255, 255, 255))
+        image.alpha_composite(map_image, (0, self.__title_height))
+        draw = ImageDraw.Draw(image)
+        draw.text((4, 6), title, fill=(0, 0, 0, 255))
+        self.__draw_legend(draw, height + self.__title_height + 2, width)
+        os.makedirs(os.path.dirname(png_file), exist_ok=True)
+        image.convert('RGB').save(png_file, 'PNG', optimize=False)
+        return data.size
+
+
+def create_map_title(region, parameter, date_string):
+    """
+    This function creates the title of a map, e.g. 'Eswatini CDI Nov 2024'
+    Args:
+        region (str): the region name
+        parameter (str): the parameter name
+        date_string (str): the 'YYYYMM' date of the map
+
+    Returns:
+        String title
+    """
+    month = date(int(date_string[0:4]), int(date_string[4:6]), 1)
+    return "{} {} {}".format(region, parameter.upper(), month.strftime('%b %Y'))
@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+import os
 from netCDF4 import Dataset
 import numpy as np
 from datetime import datetime
@@ -87,6 +88,60 @@ def extract_data(data_set, parameter, time=0):
         raise
 
 
+def time_selection(indices):
+    """
+    This function creates the key to read or write a list of time indices of a NetCDF variable
+        Consecutive indices are accessed as a single slice
+    Args:
+        indices (list): the increasing time indices
+
+    Returns:
+        slice object, or the list of indices
+    """
+    if len(indices) > 0 and indices[-1] - indices[0] == len(indices) - 1:
+        return slice(indices[0], indices[-1] + 1)
+    return list(indices)
+
+
+def write_month_year(variable, positions, values):
+    """
+    This function writes values laid out by month of the year and year to their time indices of a NetCDF variable
+    Args:
+        variable: the NetCDF variable (time, latitude, longitude)
+        positions: 2D numpy array (months, years) of the time indices, -1 for the missing months
+        values: numpy array (months, years, latitudes, longitudes) of the values
+
+    Returns:
+        Integer number of values written
+    """
+    valid = positions >= 0
+    order = np.argsort(positions[valid])
+    if len(order) == 0:
+        return 0
+    data = values[valid][order]
+    variable[time_selection(positions[valid][order].tolist())] = data
+    return np.size(data)
+
+
+def extract_data_indices(data_set, parameter, indices):
+    """
+    This function extracts the data from a NetCDF variable for a list of time indices as a numpy array
+    Args:
+        data_set (NetCDF4): class object of a read NetCDF file
+        parameter (str): name of the parameter to extract data for
+        indices (list): the increasing time indices
+
+    Returns:
+        3D numpy array of float values
+    """
+    try:
+        return np.array(data_set.variables[parameter][time_selection(indices)]).astype(float)
+    except IOError:
+        raise
+    except Exception:
+        raise
+
+
 def extract_data_range(data_set, parameter, start, stop):
     """
     This function extracts the data from a NetCDF variable across a given time range as a numpy array
@@ -150,11 +205,13 @@ def initialize_dataset(file_path, properties):
         longitudes = properties['longitudes']
         times = properties['times']
         time_units = properties['time_units']
+        # an unlimited time dimension allows new times to be appended later #
+        unlimited_time = properties.get('unlimited_time', False)
 
         # create dimensions #
         data_set.createDimension('latitude', len(latitudes))
         data_set.createDimension('longitude', len(longitudes))
-        data_set.createDimension('time', len(times))
+        data_set.createDimension('time', None if unlimited_time else len(times))
 
         # populate dimension variables #
         # latitude #
@@ -192,3 +249,60 @@ def initialize_dataset(file_path, properties):
         if data_set is not None:
             data_set.close()
         raise
+
+
+def read_times(file_path):
+    """
+    This function reads the time dimension of an existing NetCDF file
+        It is used to decide if a file can be updated in place, or must be created again
+    Args:
+        file_path (str): fully-qualified path/name of the NetCDF file
+
+    Returns:
+        List of float times, or None if the file does not exist or cannot be read
+    """
+    if not os.path.isfile(file_path):
+        return None
+    data_set = None
+    try:
+        data_set = Dataset(file_path, 'r')
+        return [float(t) for t in data_set.variables['time'][:]]
+    except (IOError, KeyError):
+        return None
+    finally:
+        if data_set is not None:
+            data_set.close()
+
+
+def get_append_index(file_path, times, variables=None):
+    """
+    This function determines where new times can be appended to an existing NetCDF file
+        The times of the file must be the leading values of the given times, and the time dimension must be
+        unlimited if times are missing from the file
+    Args:
+        file_path (str): fully-qualified path/name of the NetCDF file
+        times (list): the complete list of times (days since Jan 1, 1900)
+        variables (list): optional names of the variables the file must have
+
+    Returns:
+        Integer index of the first time to append (equal to the number of times when none are missing),
+            or None if the file does not exist or must be created again
+    """
+    if not os.path.isfile(file_path):
+        return None
+    data_set = None
+    try:
+        data_set = Dataset(file_path, 'r')
+        existing_times = [float(t) for t in data_set.variables['time'][:]]
+        if existing_times != [float(t) for t in times[0:len(existing_times)]]:
+            return None
+        if len(existing_times) < len(times) and not data_set.dimensions['time'].isunlimited():
+            return None
+        if variables is not None and any(v not in data_set.variables for v in variables):
+            return None
+        return len(existing_times)
+    except (IOError, KeyError):
+        return None
+    finally:
+        if data_set is not None:
+            data_set.close()
@@ -0,0 +1,415 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import importlib
+import json
+import os
+import re
+import time
+
+
+class FileSet:
+    """
+    This class describes a group of files in a directory that match a regular expression
+        It is used to declare the raw data and working data inputs/outputs of a step
+    """
+    def __init__(self, directory, pattern):
+        self.directory = directory
+        self.pattern = pattern
+        self.__match = re.compile(r'{}'.format(pattern))
+
+    def paths(self):
+        """
+        This function lists the files of the set (recursively) in a stable order
+
+        Returns:
+            List of fully-qualified file paths
+        """
+        results = []
+        if not os.path.isdir(self.directory):
+            return results
+        for root, dirs, files in os.walk(self.directory):
+            dirs.sort()
+            for f in sorted(files):
+                if self.__match.search(f):
+                    results.append(os.path.join(root, f))
+        return results
+
+    def __repr__(self):
+        return "{}/{}".format(self.directory, self.pattern)
+
+
+class PipelineStep:
+    """
+    This class declares a single step of the CDI pipeline: the module to run, the files it reads and the files it writes
+    """
+    def __init__(self, name, module, inputs, outputs, depends=(), pass_args=False, enabled=True):
+        """
+        Args:
+            name (str): the short name of the step (e.g. '0201')
+            module (str): the name of the STEP module providing the main() function
+            inputs (list): file paths and/or FileSet objects the step reads
+            outputs (list): file paths and/or FileSet objects the step writes
+            depends (tuple): names of the steps that must run before this step
+            pass_args (boolean): flag to pass the command line arguments to the step's main()
+            enabled (boolean): flag to include the step in the pipeline
+        """
+        self.name = name
+        self.module = module
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.depends = tuple(depends)
+        self.pass_args = pass_args
+        self.enabled = enabled
+
+
+def fingerprint_file(file_path, method='mtime'):
+    """
+    This function creates a fingerprint of a single file
+    Args:
+        file_path (str): fully-qualified path of the file
+        method (str): 'mtime' (size and modification time) or 'content' (SHA-1 of the file contents)
+
+    Returns:
+        String fingerprint, or None if the file does not exist
+    """
+    if not os.path.isfile(file_path):
+        return None
+    if method == 'content':
+        digest = hashlib.sha1()
+        with open(file_path, 'rb') as fh:
+            for block in iter(lambda: fh.read(1024 * 1024), b''):
+                digest.update(block)
+        return digest.hexdigest()
+    stats = os.stat(file_path)
+    return "{}:{}".format(stats.st_size, stats.st_mtime_ns)
+
+
+def fingerprint_items(items, method='mtime'):
+    """
+    This function creates a combined fingerprint for a list of files and file sets
+    Args:
+        items (list): file paths and/or FileSet objects
+        method (str): fingerprint method ('mtime' or 'content')
+
+    Returns:
+        String fingerprint of all the files, and a flag that is False if a declared file is missing or empty, or a file
+            set is empty
+    """
+    digest = hashlib.sha1()
+    complete = True
+    for item in items:
+        if isinstance(item, FileSet):
+            paths = item.paths()
+            if len(paths) == 0:
+                complete = False
+        else:
+            paths = [item]
+        for p in paths:
+            value = fingerprint_file(p, method)
+            # an empty file is left behind by a step that failed before writing its results #
+            if value is None or os.path.getsize(p) == 0:
+                complete = False
+            digest.update("{}={};".format(p, value).encode('utf-8'))
+    return digest.hexdigest(), complete
+
+
+class PipelineRunner:
+    """
+    This class runs the pipeline steps in dependency order, skipping steps whose inputs and outputs have not changed
+        since the last successful run
+    """
+    def __init__(self, steps, state_file, method='mtime'):
+        self.__steps = [s for s in steps if s.enabled]
+        self.__state_file = state_file
+        self.__method = method
+        self.__state = self.__load_state()
+        self.__failed = []
+        self.__check_dependencies()
+
+    def __load_state(self):
+        """
+        This function reads the fingerprints recorded by the previous runs
+
+        Returns:
+            Dictionary of step name to recorded fingerprints
+        """
+        if not os.path.isfile(self.__state_file):
+            return {}
+        try:
+            with open(self.__state_file, 'r') as fh:
+                return json.loads(fh.read())
+        except ValueError:
+            print("Ignoring unreadable pipeline state file: {}".format(self.__state_file))
+            return {}
+
+    def __save_state(self):
+        """
+        This function writes the recorded fingerprints to the state file
+        """
+        temp_file = self.__state_file + '.tmp'
+        with open(temp_file, 'w') as fh:
+            fh.write(json.dumps(self.__state, indent=2, sort_keys=True))
+        os.replace(temp_file, self.__state_file)
+
+    def __check_dependencies(self):
+        """
+        This function verifies the steps are declared in a valid order: every dependency is listed before the step
+        """
+        seen = set()
+        names = set(s.name for s in self.__steps)
+        for step in self.__steps:
+            for d in step.depends:
+                if d in names and d not in seen:
+                    raise ValueError("Step {} depends on {}, which is not declared before it".format(step.name, d))
+            seen.add(step.name)
+
+    @property
+    def steps(self):
+        return list(self.__steps)
+
+    @property
+    def failed(self):
+        """
+        Returns:
+            List of the names of the steps that failed, or were skipped because a dependency failed, in the last run
+        """
+        return list(self.__failed)
+
+    def select_steps(self, until=None, only=None):
+        """
+        This function returns the ordered list of steps to consider for this run
+        Args:
+            until (str): optional name of the last step to run
+            only (list): optional names of the steps to run; the other steps (including their dependencies) are left out
+
+        Returns:
+            List of PipelineStep objects
+        """
+        names = [s.name for s in self.__steps]
+        for name in ([until] if until is not None else []) + list(only or []):
+            if name not in names:
+                raise ValueError("Unknown step '{}'. Available steps: {}".format(name, ", ".join(names)))
+        steps = self.steps
+        if until is not None:
+            steps = steps[:names.index(until) + 1]
+        if only:
+            steps = [s for s in steps if s.name in only]
+        return steps
+
+    def is_stale(self, step):
+        """
+        This function determines if a step needs to run
+        Args:
+            step (PipelineStep): the step to test
+
+        Returns:
+            Boolean flag (True if the step must run), and a string describing the reason
+        """
+        record = self.__state.get(step.name)
+        if record is None:
+            return True, "no previous run recorded"
+        if record.get('method') != self.__method:
+            return True, "fingerprint method changed"
+        inputs, inputs_complete = fingerprint_items(step.inputs, self.__method)
+        if not inputs_complete:
+            return True, "inputs are incomplete"
+        if inputs != record.get('inputs'):
+            return True, "inputs changed"
+        outputs, outputs_complete = fingerprint_items(step.outputs, self.__method)
+        if not outputs_complete:
+            return True, "outputs are missing"
+        if outputs != record.get('outputs'):
+            return True, "outputs changed since the last run"
+        return False, "up to date"
+
+    def record(self, step):
+        """
+        This function stores the current fingerprints of a step after it has run
+        Args:
+            step (PipelineStep): the step that completed
+
+        Returns:
+            Boolean flag: False if the step did not produce all of its outputs
+        """
+        outputs, outputs_complete = fingerprint_items(step.outputs, self.__method)
+        if not outputs_complete:
+            self.forget(step)
+            return False
+        # the inputs are fingerprinted after the run since a step may rewrite its own inputs (e.g. HDF4 to HDF5) #
+        inputs, null = fingerprint_items(step.inputs, self.__method)
+        self.__state[step.name] = {
+            'method': self.__method,
+            'inputs': inputs,
+            'outputs': outputs,
+            'completed': time.strftime('%Y-%m-%d %H:%M:%S')
+        }
+        self.__save_state()
+        return True
+
+    def forget(self, step):
+        """
+        This function drops the recorded fingerprints of a step, so it runs again next time
+        Args:
+            step (PipelineStep): the step that failed or did not complete
+        """
+        self.__state.pop(step.name, None)
+        self.__save_state()
+
+    def __check_step(self, step, force):
+        """
+        This function determines if a step needs to run and reports the decision
+        Args:
+            step (PipelineStep): the step to test
+            force (boolean): flag to run the step regardless of the recorded fingerprints
+
+        Returns:
+            Boolean flag: True if the step must run
+        """
+        if force:
+            stale, reason = True, "forced"
+        else:
+            stale, reason = self.is_stale(step)
+        if stale:
+            print("Step {} is stale: {}.".format(step.name, reason))
+        else:
+            print("Skipping Step {}: {}.\n".format(step.name, reason))
+        return stale
+
+    def __complete_step(self, step, elapsed_time):
+        """
+        This function reports a completed step and records its fingerprints
+        Args:
+            step (PipelineStep): the step that completed
+            elapsed_time (float): the run time of the step in seconds
+        """
+        print("Step {} completed in {:.2f} seconds.\n".format(step.name, elapsed_time))
+        if not self.record(step):
+            print("Step {} did not produce all of its outputs; it will run again next time.\n".format(step.name))
+
+    def __fail_step(self, step, ex):
+        """
+        This function reports a failed step and drops its recorded fingerprints, so neither the step nor its
+            dependents are considered up to date
+        Args:
+            step (PipelineStep): the step that failed
+            ex (Exception): the error raised by the step
+        """
+        print("Step {} failed: {}\n".format(step.name, ex))
+        self.forget(step)
+        self.__failed.append(step.name)
+
+    def __skip_step(self, step):
+        """
+        This function reports a step that is not run because one of its dependencies failed
+        Args:
+            step (PipelineStep): the skipped step
+        """
+        print("Skipping Step {}: a dependency failed.\n".format(step.name))
+        self.__failed.append(step.name)
+
+    def run(self, args, force=False, until=None, jobs=1, only=None):
+        """
+        This function runs the stale steps in dependency order
+            With more than one job, steps whose dependencies have completed run concurrently in separate processes,
+            e.g. the LST, NDVI, SPI and soil moisture branches, which join before the CDI weighted sum
+        Args:
+            args: the parsed command line arguments to pass to the steps
+            force (boolean): flag to run every step regardless of the recorded fingerprints
+            until (str): optional name of the last step to run
+            jobs (int): the maximum number of steps to run at the same time
+            only (list): optional names of the steps to run
+
+        Returns:
+            List of the names of the steps that were executed successfully
+        """
+        steps = self.select_steps(until, only)
+        self.__failed = []
+        if jobs <= 1:
+            executed = []
+            for step in steps:
+                if any(d in self.__failed for d in step.depends):
+                    self.__skip_step(step)
+                elif self.__check_step(step, force):
+                    print("Executing Step {}...".format(step.name))
+                    try:
+                        self.__complete_step(step, execute_step(step.module, step.pass_args, args))
+                        executed.append(step.name)
+                    except Exception as ex:
+                        self.__fail_step(step, ex)
+            return executed
+        return self.__run_concurrent(steps, args, force, jobs)
+
+    def __run_concurrent(self, steps, args, force, jobs):
+        """
+        This function schedules the steps on a bounded process pool as soon as their dependencies have completed
+        Args:
+            steps (list): the ordered PipelineStep objects to run
+            args: the parsed command line arguments to pass to the steps
+            force (boolean): flag to run every step regardless of the recorded fingerprints
+            jobs (int): the maximum number of worker processes
+
+        Returns:
+            List of the names of the steps that were executed successfully
+        """
+        # the process pool is only imported when it is used #
+        from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+        names = set(s.name for s in steps)
+        pending = list(steps)
+        finished = set()
+        running = {}
+        executed = []
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            while len(pending) > 0 or len(running) > 0:
+                # start every step whose dependencies have finished, in declaration order #
+                for step in list(pending):
+                    if len(running) >= jobs:
+                        break
+                    depends = [d for d in step.depends if d in names]
+                    if any(d not in finished for d in depends):
+                        continue
+                    pending.remove(step)
+                    if any(d in self.__failed for d in depends):
+                        self.__skip_step(step)
+                        finished.add(step.name)
+                    elif self.__check_step(step, force):
+                        print("Executing Step {}...".format(step.name))
+                        running[executor.submit(execute_step, step.module, step.pass_args, args)] = step
+                    else:
+                        finished.add(step.name)
+                if len(running) == 0:
+                    continue
+                # wait for a running step to complete #
+                done, null = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in done:
+                    step = running.pop(future)
+                    try:
+                        self.__complete_step(step, future.result())
+                        executed.append(step.name)
+                    except Exception as ex:
+                        self.__fail_step(step, ex)
+                    finished.add(step.name)
+        return executed
+
+
+def execute_step(module, pass_args, args):
+    """
+    This function imports a step module and runs its entry point
+        It is defined at the module level so it can be sent to a worker process
+    Args:
+        module (str): the name of the STEP module
+        pass_args (boolean): flag to pass the command line arguments to the step's main()
+        args: the parsed command line arguments
+
+    Returns:
+        Float value of the run time in seconds; a RuntimeError is raised when the step's main() returns a non-zero status
+    """
+    start_time = time.time()
+    func = importlib.import_module(module).main
+    if pass_args:
+        status = func(args)
+    else:
+        status = func()
+    # the steps print their own errors and return a non-zero status #
+    if status:
+        raise RuntimeError("{} exited with status {}".format(module, status))
+    return time.time() - start_time
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import numpy as np
+import libs.netcdf_functions as netcdf
+from libs.profiling import span
+from libs.time_index import TimeIndex
+
+
+def get_output_sources(config):
+    """
+    This function lists the output NetCDF file and variable of the CDI and of each of its weighted inputs
+    Args:
+        config (ConfigParser): the project configuration
+
+    Returns:
+        Dictionary of parameter name: (file path, variable name), with the CDI first
+    """
+    output_dir = config.get('output_dir').replace("\\", '/')
+    region = config.get('region_name')
+    weights = config.get('cdi_parameters', 'weights')
+    names = config.get('cdi_parameters', 'names')
+    input_files = {
+        "lst": os.path.join(output_dir, "STEP_0201_LST_anomaly_pct_rank_{}.nc".format(region)),
+        "ndvi": os.path.join(output_dir, "STEP_0202_NDVI_anomaly_pct_rank_{}.nc".format(region)),
+        "spi": os.path.join(output_dir, "STEP_0203_SPI_anomaly_pct_rank_{}.nc".format(region)),
+        "sm": os.path.join(output_dir, "STEP_0204_SM_pct_rank_{}.nc".format(region))
+    }
+    sources = {'cdi': (os.path.join(output_dir, "STEP_0302_CDI_pct_rank_{}.nc".format(region)), "cdi_wt_sum_pr")}
+    for p in ['lst', 'ndvi', 'spi', 'sm']:
+        if weights[p] > 0:
+            sources[p] = (input_files[p], names[p])
+    return sources
+
+
+def get_grid_index(latitudes, longitudes, lat, lon):
+    """
+    This function finds the grid cell of a point on the 0.05 degree grid of the project
+    Args:
+        latitudes (list): the latitudes of the grid cell centers, from north to south
+        longitudes (list): the longitudes of the grid cell centers, from west to east
+        lat (float): the latitude of the point
+        lon (float): the longitude of the point
+
+    Returns:
+        Tuple of integers (row, column)
+    """
+    row = int(round((latitudes[0] - lat) / 0.05))
+    column = int(round((lon - longitudes[0]) / 0.05))
+    if row < 0 or row >= len(latitudes) or column < 0 or column >= len(longitudes):
+        raise ValueError("The point {}, {} is outside the grid of the project ({} - {}, {} - {})".format(
+            lat, lon, latitudes[-1], latitudes[0], longitudes[0], longitudes[-1]))
+    return row, column
+
+
+class PixelSeriesCache:
+    """
+    This class keeps a pixel-major copy of a NetCDF output variable, so the time series of a pixel is one
+        contiguous row of a memory mapped .npy file instead of a value from every time slice of the NetCDF file
+        The copy is created again when the size or modification time of the NetCDF file changes
+    """
+    def __init__(self, source, parameter, cache_dir, block_size=120):
+        """
+        Args:
+            source (str): fully-qualified path/name of the NetCDF file
+            parameter (str): the name of the NetCDF variable (time, latitude, longitude)
+            cache_dir (str): the directory of the cached copies
+            block_size (int): the number of time slices read at once while creating the copy
+        """
+        self.__source = source
+        self.__parameter = parameter
+        self.__block_size = block_size
+        base_name = os.path.join(cache_dir, "{}.{}".format(os.path.splitext(os.path.basename(source))[0], parameter))
+        self.__data_file = base_name + '.pixels.npy'
+        self.__key_file = base_name + '.json'
+        self.__key = None
+        self.__data = None
+        self.times = None
+
+    def __source_key(self):
+        status = os.stat(self.__source)
+        return {'source': os.path.abspath(self.__source), 'size': status.st_size, 'mtime': status.st_mtime}
+
+    def __load(self):
+        """
+        This function opens the cached copy when it matches the NetCDF file
+        Returns:
+            Boolean flag, true if the copy was opened
+        """
+        if not os.path.isfile(self.__key_file) or not os.path.isfile(self.__data_file):
+            return False
+        with open(self.__key_file, 'r') as fh:
+            key = json.loads(fh.read())
+        if key.get('file') != self.__source_key():
+            return False
+        self.__key = key['file']
+        self.times = np.array(key['times'])
+        self.__data = np.load(self.__data_file, mmap_mode='r')
+        return True
+
+    def __create(self):
+        """
+        This function writes the pixel-major copy of the NetCDF variable, reading the time slices in blocks
+        """
+        key = self.__source_key()
+        temp_file = self.__data_file + '.tmp.npy'
+        input_data_set = None
+        try:
+            with span('pixel cache', file=self.__source) as s:
+                input_data_set = netcdf.open_dataset(self.__source)
+                times = np.array(input_data_set.variables['time'][:], dtype=float)
+                variable = input_data_set.variables[self.__parameter]
+                cells = variable.shape[1] * variable.shape[2]
+                pixels = np.lib.format.open_memmap(temp_file, mode='w+', dtype=np.float32, shape=(cells, len(times)))
+                for t in range(0, len(times), self.__block_size):
+                    block = np.array(variable[t:t + self.__block_size], dtype=np.float32)
+                    pixels[:, t:t + block.shape[0]] = block.reshape(block.shape[0], cells).T
+                    s.add_pixels(block.size)
+                pixels.flush()
+                del pixels
+            os.replace(temp_file, self.__data_file)
+            with open(self.__key_file, 'w') as fh:
+                fh.write(json.dumps({'file': key, 'times': times.tolist()}))
+        except IOError:
+            raise
+        except Exception:
+            raise
+        finally:
+            if input_data_set is not None:
+                input_data_set.close()
+
+    def refresh(self):
+        """
+        This function opens the cached copy, creating it first when the NetCDF file is new or has changed
+        """
+        if self.__data is not None and self.__key == self.__source_key():
+            return
+        self.__data = None
+        if not self.__load():
+            self.__create()
+            self.__load()
+
+    def series(self, cells, time_indices=None):
+        """
+        This function reads the time series of grid cells
+        Args:
+            cells: the flat (latitude, longitude) index of each grid cell
+            time_indices: optional indices of the times to return (default is all times)
+
+        Returns:
+            2D numpy array (cells, times) of float values
+        """
+        self.refresh()
+        values = np.asarray(self.__data[np.asarray(cells)], dtype=float)
+        if time_indices is not None:
+            values = values[:, time_indices]
+        return values
+
+
+class PointQuery:
+    """
+    This class reads the CDI and component rank time series at points, aligned on the dates common to all of them
+    """
+    def __init__(self, config, cache_dir=None):
+        """
+        Args:
+            config (ConfigParser): the project configuration
+            cache_dir (str): the directory of the pixel-major copies. Default is <scratch_dir>/QUERY
+        """
+        self.__latitudes = config.get('latitudes')
+        self.__longitudes = config.get('longitudes')
+        if cache_dir is None:
+            cache_dir = os.path.join(config.get('scratch_dir').replace("\\", '/'), 'QUERY')
+        os.makedirs(cache_dir, exist_ok=True)
+        self.parameters = []
+        self.__caches = {}
+        for p, (source, variable) in get_output_sources(config).items():
+            self.parameters.append(p)
+            self.__caches[p] = PixelSeriesCache(source, variable, cache_dir)
+
+    def query(self, points, date_range=None):
+        """
+        This function reads the time series of every parameter at each point
+        Args:
+            points (list): the (latitude, longitude) tuples of the points
+            date_range (DateRange): optional range of months to return
+
+        Returns:
+            times: 1D numpy array of the common times (days since Jan 1, 1900)
+            values: Dictionary of parameter name: 2D numpy array (points, times) of float values
+        """
+        cells = []
+        for lat, lon in points:
+            row, column = get_grid_index(self.__latitudes, self.__longitudes, lat, lon)
+            cells.append(row * len(self.__longitudes) + column)
+        for p in self.parameters:
+            self.__caches[p].refresh()
+        # the dates that every parameter has a value for #
+        indices = {p: TimeIndex.from_times(self.__caches[p].times) for p in self.parameters}
+        common = indices[self.parameters[0]].intersection(*[indices[p] for p in self.parameters[1:]])
+        if date_range is not None and date_range.is_set:
+            common = TimeIndex(common.months[date_range.time_indices(common.times)])
+        values = {}
+        for p in self.parameters:
+            values[p] = self.__caches[p].series(cells, indices[p].index_of(common))
+        return np.array(common.times), values
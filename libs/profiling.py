@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import socket
+import time
+import traceback
+import tracemalloc
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:  # not available on Windows #
+    resource = None
+
+"""
+Per-stage instrumentation for the CDI steps
+    Spans are enabled by setting the CDI_PROFILE_REPORT environment variable to the path of a JSON-lines report
+    (STEP_0000 sets it with the --profile option, so the worker processes inherit it).
+    Setting CDI_PROFILE_TRACEMALLOC=1 also traces the Python memory allocations of each span, which is slower.
+    The peak resident set size is a high-water mark of the whole process, not of the span: process_peak_rss_kb is
+    the process peak when the span ends, and peak_rss_growth_kb is how much the span raised it (0 when an earlier
+    stage already used more memory). tracemalloc_peak_bytes is the per-span measure of the Python allocations.
+Example:
+    with span('raw read', file=file_name) as s:
+        data = read_the_data()
+        s.add_pixels(data.size)
+"""
+
+REPORT_VARIABLE = 'CDI_PROFILE_REPORT'
+RUN_VARIABLE = 'CDI_PROFILE_RUN'
+TRACEMALLOC_VARIABLE = 'CDI_PROFILE_TRACEMALLOC'
+
+_active_spans = []
+
+
+def enable(report_file, trace_memory=False):
+    """
+    This function turns on the span reporting for this process and any child processes it starts
+    Args:
+        report_file (str): path of the JSON-lines report to append the spans to
+        trace_memory (boolean): flag to measure the peak Python allocations of each span with tracemalloc
+    """
+    os.environ[REPORT_VARIABLE] = os.path.abspath(report_file)
+    os.environ.setdefault(RUN_VARIABLE, datetime.now().strftime('%Y%m%dT%H%M%S'))
+    if trace_memory:
+        os.environ[TRACEMALLOC_VARIABLE] = '1'
+
+
+def is_enabled():
+    return bool(os.environ.get(REPORT_VARIABLE))
+
+
+def _process_peak_rss_kb():
+    """
+    This function returns the peak resident set size of the current process since it started
+
+    Returns:
+        Integer value in kilobytes, or None if the platform does not support it
+    """
+    if resource is None:
+        return None
+    return int(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+
+class Span:
+    """
+    This class measures a single stage of processing: wall time, CPU time, memory, bytes read/written and pixel throughput
+    """
+    def __init__(self, stage, step=None, **attributes):
+        self.stage = stage
+        self.step = step
+        self.attributes = attributes
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.pixels = 0
+        self.__trace_memory = False
+        self.__memory_peak = 0
+        self.__start_rss = None
+        self.__start_wall = None
+        self.__start_cpu = None
+        self.__started = None
+
+    def add_bytes_read(self, count):
+        self.bytes_read += int(count)
+
+    def add_bytes_written(self, count):
+        self.bytes_written += int(count)
+
+    def add_file_read(self, file_path):
+        """
+        This function adds the size of a file that was read to the span
+        Args:
+            file_path (str): fully-qualified path of the file
+        """
+        if os.path.isfile(file_path):
+            self.bytes_read += os.path.getsize(file_path)
+
+    def add_file_written(self, file_path):
+        """
+        This function adds the size of a file that was written to the span
+        Args:
+            file_path (str): fully-qualified path of the file
+        """
+        if os.path.isfile(file_path):
+            self.bytes_written += os.path.getsize(file_path)
+
+    def add_pixels(self, count):
+        self.pixels += int(count)
+
+    def update_memory_peak(self, peak):
+        self.__memory_peak = max(self.__memory_peak, peak)
+
+    def __enter__(self):
+        # inherit the step name from the enclosing span #
+        if self.step is None and len(_active_spans) > 0:
+            self.step = _active_spans[-1].step
+        self.__trace_memory = is_enabled() and os.environ.get(TRACEMALLOC_VARIABLE) == '1'
+        if self.__trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            elif len(_active_spans) > 0:
+                # hand the peak so far to the enclosing span before the peak is reset for this span #
+                _active_spans[-1].update_memory_peak(tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        _active_spans.append(self)
+        self.__start_rss = _process_peak_rss_kb() if is_enabled() else None
+        self.__started = datetime.now()
+        self.__start_cpu = time.process_time()
+        self.__start_wall = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        wall_time = time.perf_counter() - self.__start_wall
+        cpu_time = time.process_time() - self.__start_cpu
+        if len(_active_spans) > 0 and _active_spans[-1] is self:
+            _active_spans.pop()
+        if self.__trace_memory:
+            self.update_memory_peak(tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+            if len(_active_spans) > 0:
+                _active_spans[-1].update_memory_peak(self.__memory_peak)
+        if is_enabled():
+            peak_rss = _process_peak_rss_kb()
+            rss_growth = None
+            if peak_rss is not None and self.__start_rss is not None:
+                rss_growth = peak_rss - self.__start_rss
+            record = {
+                'run': os.environ.get(RUN_VARIABLE),
+                'host': socket.gethostname(),
+                'pid': os.getpid(),
+                'step': self.step,
+                'stage': self.stage,
+                'depth': len(_active_spans),
+                'start': self.__started.isoformat(),
+                'wall_s': round(wall_time, 6),
+                'cpu_s': round(cpu_time, 6),
+                'process_peak_rss_kb': peak_rss,
+                'peak_rss_growth_kb': rss_growth,
+                'tracemalloc_peak_bytes': self.__memory_peak if self.__trace_memory else None,
+                'bytes_read': self.bytes_read,
+                'bytes_written': self.bytes_written,
+                'pixels': self.pixels,
+                'pixels_per_s': round(self.pixels / wall_time, 1) if wall_time > 0 else None,
+                'status': 'ok' if exc_type is None else 'error'
+            }
+            if exc_type is not None:
+                record['error'] = "{}: {}".format(exc_type.__name__, exc_val)
+                record['traceback'] = ''.join(traceback.format_exception(exc_type, exc_val, exc_tb))
+            record.update(self.attributes)
+            write_record(record)
+        # never suppress the exception #
+        return False
+
+
+def span(stage, step=None, **attributes):
+    """
+    This function creates a profiling span to use as a context manager
+    Args:
+        stage (str): the name of the sub-stage, e.g. 'file listing', 'raw read', 'subset', 'qc', 'anomaly', 'rank', 'write'
+        step (str): optional step name; inherited from the enclosing span when not set
+        attributes: optional extra values to add to the report record (e.g. the file name)
+
+    Returns:
+        Span object
+    """
+    return Span(stage, step, **attributes)
+
+
+def write_record(record):
+    """
+    This function appends a record to the JSON-lines report
+        Each record is written with a single append so concurrent step processes can share the report
+    Args:
+        record (dict): the values to write
+    """
+    report_file = os.environ.get(REPORT_VARIABLE)
+    if not report_file:
+        return
+    line = json.dumps(record, default=str) + '\n'
+    with open(report_file, 'a') as fh:
+        fh.write(line)
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+# the number of possible 16 bit QC values #
+QC_VALUES = 65536
+
+# the documented bit fields (first bit, last bit) of the QC layers, so the rules can name them #
+BIT_FIELDS = {
+    # MOD13C2 'CMG 0.05 Deg Monthly VI Quality' #
+    'ndvi': {
+        'vi_quality': (0, 1),
+        'vi_usefulness': (2, 5),
+        'aerosol_quantity': (6, 7),
+        'adjacent_cloud': (8, 8),
+        'atmosphere_brdf_correction': (9, 9),
+        'mixed_clouds': (10, 10),
+        'land_water': (11, 13),
+        'snow_ice': (14, 14),
+        'shadow': (15, 15)
+    },
+    # MOD21C3 'QC_Day' and 'QC_Night' #
+    'lst': {
+        'mandatory_qa': (0, 1),
+        'data_quality': (2, 3)
+    }
+}
+
+
+def decode_bits(qc, first_bit, last_bit):
+    """
+    This function extracts a bit field from QC values
+    Args:
+        qc: numpy array of integer QC values
+        first_bit (int): the lowest bit of the field
+        last_bit (int): the highest bit of the field
+
+    Returns:
+        numpy array of the integer field values
+    """
+    return (np.asarray(qc) >> first_bit) & ((1 << (last_bit - first_bit + 1)) - 1)
+
+
+def match_condition(qc, condition, fields):
+    """
+    This function tests the QC values against one condition of a rule:
+        the value of the whole QC word, or of a bit field ("field": name or "bits": [first, last]),
+        is compared with the optional "min" and "max" (inclusive) and "values" of the condition
+    Returns:
+        Boolean numpy array
+    """
+    value = qc
+    if 'field' in condition:
+        value = decode_bits(qc, *fields[condition['field']])
+    elif 'bits' in condition:
+        value = decode_bits(qc, *condition['bits'])
+    matches = np.ones(qc.shape, dtype=bool)
+    if 'min' in condition:
+        matches &= value >= condition['min']
+    if 'max' in condition:
+        matches &= value <= condition['max']
+    if 'values' in condition:
+        matches &= np.isin(value, condition['values'])
+    return matches
+
+
+def build_acceptance_table(rules, fields=None):
+    """
+    This function evaluates the rejection rules of a QC layer for every possible 16 bit QC value
+        A rule is a condition or a list of conditions that must all match; a QC value is rejected when any rule matches
+    Args:
+        rules (list): the rejection rules, e.g. [{"max": 15}, [{"field": "vi_quality", "values": [3]}, {"bits": [14, 14], "values": [1]}]]
+        fields (dictionary): the named bit fields of the layer
+
+    Returns:
+        Boolean numpy array of QC_VALUES entries, true for the accepted QC values
+    """
+    qc = np.arange(0, QC_VALUES, dtype=np.int64)
+    rejected = np.zeros(QC_VALUES, dtype=bool)
+    for rule in rules:
+        conditions = rule if isinstance(rule, list) else [rule]
+        matches = np.ones(QC_VALUES, dtype=bool)
+        for condition in conditions:
+            matches &= match_condition(qc, condition, fields or {})
+        rejected |= matches
+    return ~rejected
+
+
+class QCFilter:
+    """
+    This class filters the values of a MODIS product with the QC rules of the configuration
+        The rules are evaluated once for all 65,536 QC values, so filtering a grid is a single table lookup
+        whatever the number of rules
+    """
+    def __init__(self, product, rules):
+        """
+        Args:
+            product (str): the name of the product (lst or ndvi) for the named bit fields
+            rules (dictionary): the "reject" QC rules, and the optional "reject_values" of the data that are invalid
+        """
+        self.__table = build_acceptance_table(rules.get('reject', []), BIT_FIELDS.get(product))
+        self.__reject_values = rules.get('reject_values', [])
+
+    def accepted(self, qc):
+        """
+        This function looks up the QC values in the acceptance table
+        Args:
+            qc: numpy array of the QC values (unsigned 8 or 16 bit)
+
+        Returns:
+            Boolean numpy array, true for the accepted values
+        """
+        qc = np.asarray(qc)
+        if qc.dtype.kind != 'u':
+            # signed QC layers hold the same 16 bit patterns #
+            qc = qc.astype(np.int64) & (QC_VALUES - 1)
+        return np.take(self.__table, qc)
+
+    def rejected(self, values, qc):
+        """
+        This function finds the values to mask: values with a rejected QC value, and invalid data values
+        Args:
+            values: numpy array of the scaled data values
+            qc: numpy array of the QC values of the data
+
+        Returns:
+            Boolean numpy array, true for the values to mask
+        """
+        rejected = ~self.accepted(qc)
+        if len(self.__reject_values) > 0:
+            rejected |= np.isin(values, self.__reject_values)
+        return rejected
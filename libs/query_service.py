@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import threading
+from argparse import ArgumentTypeError
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+import numpy as np
+import libs.netcdf_functions as netcdf
+from libs.date_range import DateRange, year_month
+from libs.time_index import TimeIndex
+from libs.point_query import get_output_sources, get_grid_index
+
+
+class LRUCache:
+    """
+    This class holds numpy arrays up to a total size in bytes, dropping the least recently used arrays first
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.__items = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get(self, key):
+        """
+        This function returns a cached array and marks it as the most recently used
+        Returns:
+            numpy array, or None when the key is not cached
+        """
+        with self.__lock:
+            value = self.__items.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.__items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """
+        This function caches an array, dropping the least recently used arrays until the cache fits its size
+        """
+        with self.__lock:
+            if key in self.__items:
+                self.size -= self.__items.pop(key).nbytes
+            if value.nbytes > self.max_bytes:
+                return
+            self.__items[key] = value
+            self.size += value.nbytes
+            while self.size > self.max_bytes:
+                self.size -= self.__items.popitem(last=False)[1].nbytes
+
+    def discard(self, prefix):
+        """
+        This function drops the arrays whose key starts with the prefix tuple
+        """
+        with self.__lock:
+            for key in [k for k in self.__items if k[0:len(prefix)] == prefix]:
+                self.size -= self.__items.pop(key).nbytes
+
+    def __len__(self):
+        return len(self.__items)
+
+
+class OutputStore:
+    """
+    This class keeps the output NetCDF files open and serves their grids and pixel series through an LRU cache
+        The modification time of a file is checked on every request; when it changed the file is opened again and the
+        cached arrays of the file are dropped
+    """
+    def __init__(self, config, cache_bytes=256 * 1024 * 1024):
+        self.__latitudes = config.get('latitudes')
+        self.__longitudes = config.get('longitudes')
+        self.__sources = get_output_sources(config)
+        self.parameters = list(self.__sources.keys())
+        self.cache = LRUCache(cache_bytes)
+        self.missing = -9999.0
+        self.__datasets = {}
+        self.__versions = {}
+        self.__times = {}
+        self.__dates = {}
+        # netCDF4 reads are not thread-safe #
+        self.__lock = threading.RLock()
+
+    def close(self):
+        with self.__lock:
+            for data_set in self.__datasets.values():
+                data_set.close()
+            self.__datasets = {}
+            self.__versions = {}
+
+    def __open(self, parameter):
+        """
+        This function opens the file of a parameter, or opens it again when it has changed since it was opened
+        Returns:
+            NetCDF4 Dataset object
+        """
+        if parameter not in self.__sources:
+            raise KeyError("Unknown parameter '{}'".format(parameter))
+        source = self.__sources[parameter][0]
+        status = os.stat(source)
+        version = (status.st_mtime, status.st_size)
+        if self.__versions.get(parameter) != version:
+            if parameter in self.__datasets:
+                self.__datasets.pop(parameter).close()
+            self.cache.discard((parameter,))
+            data_set = netcdf.open_dataset(source)
+            times = np.array(data_set.variables['time'][:], dtype=float)
+            self.__datasets[parameter] = data_set
+            self.__versions[parameter] = version
+            self.__times[parameter] = times
+            self.__dates[parameter] = TimeIndex.from_times(times).dates()
+        return self.__datasets[parameter]
+
+    def get_dates(self, parameter):
+        """
+        This function lists the 'YYYYMM' dates of a parameter
+        """
+        with self.__lock:
+            self.__open(parameter)
+            return list(self.__dates[parameter])
+
+    def get_grid(self, parameter, date_string='latest'):
+        """
+        This function returns the grid of a parameter for a date
+        Args:
+            parameter (str): the name of the parameter (cdi, lst, ndvi, spi or sm)
+            date_string (str): the 'YYYYMM' date, or latest for the last date of the file
+
+        Returns:
+            date_string: the 'YYYYMM' date of the grid
+            values: 2D numpy array (latitudes, longitudes) of float32 values
+        """
+        with self.__lock:
+            data_set = self.__open(parameter)
+            dates = self.__dates[parameter]
+            if len(dates) == 0:
+                raise KeyError("There are no dates for '{}'".format(parameter))
+            if date_string == 'latest':
+                date_string = dates[-1]
+            if date_string not in dates:
+                raise KeyError("There is no '{}' grid for {}".format(parameter, date_string))
+            key = (parameter, 'grid', date_string)
+            values = self.cache.get(key)
+            if values is None:
+                variable = data_set.variables[self.__sources[parameter][1]]
+                values = np.array(variable[dates.index(date_string)], dtype=np.float32)
+                self.cache.put(key, values)
+            return date_string, values
+
+    def get_series(self, lat, lon, date_range=None):
+        """
+        This function returns the time series of every parameter at a point, on the dates common to all of them
+        Args:
+            lat (float): the latitude of the point
+            lon (float): the longitude of the point
+            date_range (DateRange): optional range of months to return
+
+        Returns:
+            dates: List of the 'YYYYMM' dates
+            values: Dictionary of parameter name: 1D numpy array of float32 values
+        """
+        row, column = get_grid_index(self.__latitudes, self.__longitudes, lat, lon)
+        with self.__lock:
+            series = {}
+            for p in self.parameters:
+                data_set = self.__open(p)
+                key = (p, 'series', row, column)
+                values = self.cache.get(key)
+                if values is None:
+                    values = np.array(data_set.variables[self.__sources[p][1]][:, row, column], dtype=np.float32)
+                    self.cache.put(key, values)
+                series[p] = values
+            # the dates that every parameter has a value for #
+            indices = {p: TimeIndex.from_times(self.__times[p]) for p in self.parameters}
+            common = indices[self.parameters[0]].intersection(*[indices[p] for p in self.parameters[1:]])
+            if date_range is not None and date_range.is_set:
+                common = TimeIndex(common.months[date_range.time_indices(common.times)])
+            values = {p: series[p][indices[p].index_of(common)] for p in self.parameters}
+        return common.dates(), values
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    """
+    This class answers the requests of the query service:
+        GET /parameters                              the parameters and their dates
+        GET /grid/<parameter>/latest                 the grid of the last date
+        GET /grid/<parameter>/<YYYYMM>               the grid of a date
+        GET /series?lat=<lat>&lon=<lon>[&start=YYYYMM&end=YYYYMM]
+                                                     the time series of every parameter at a point
+        GET /status                                  the cache statistics
+    The grids and series are JSON, or little-endian float32 values with ?format=bin
+        (the shape, dates and missing value are in the X-Shape, X-Dates and X-Missing-Value headers)
+    """
+    store = None
+    quiet = False
+
+    def log_message(self, format, *args):
+        if not self.quiet:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def __send(self, status, body, content_type, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def __send_json(self, status, value):
+        self.__send(status, json.dumps(value).encode('utf-8'), 'application/json')
+
+    def __send_values(self, values, dates, output_format, description):
+        """
+        This function sends an array as JSON (with the description) or as binary float32 values
+        """
+        if output_format == 'bin':
+            headers = {'X-Shape': ','.join(str(n) for n in values.shape), 'X-Dates': ','.join(dates),
+                       'X-Missing-Value': str(self.store.missing)}
+            self.__send(200, values.astype('<f4').tobytes(), 'application/octet-stream', headers)
+        else:
+            description['missing_value'] = self.store.missing
+            description['values'] = np.round(values.astype(float), 4).tolist()
+            self.__send_json(200, description)
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        path = [p for p in parts.path.split('/') if p != '']
+        query = {k: v[-1] for k, v in parse_qs(parts.query).items()}
+        output_format = query.get('format', 'json')
+        try:
+            if path == ['parameters']:
+                self.__send_json(200, {p: self.store.get_dates(p) for p in self.store.parameters})
+            elif len(path) == 3 and path[0] == 'grid':
+                date_string, values = self.store.get_grid(path[1], path[2])
+                self.__send_values(values, [date_string], output_format,
+                                   {'parameter': path[1], 'date': date_string, 'rows': values.shape[0],
+                                    'columns': values.shape[1]})
+            elif path == ['series']:
+                if 'lat' not in query or 'lon' not in query:
+                    raise ValueError("Give the point with the lat and lon parameters")
+                lat, lon = float(query['lat']), float(query['lon'])
+                # validate the months like the --start and --end options, so the error names the parameter #
+                for name in ['start', 'end']:
+                    try:
+                        if query.get(name) is not None:
+                            year_month(query[name])
+                    except ArgumentTypeError as ate:
+                        raise ValueError("Invalid {} parameter: {}".format(name, ate))
+                date_range = DateRange(query.get('start'), query.get('end'))
+                dates, series = self.store.get_series(lat, lon, date_range)
+                values = np.array([series[p] for p in self.store.parameters], dtype=np.float32).reshape(
+                    len(self.store.parameters), len(dates))
+                self.__send_values(values, dates, output_format,
+                                   {'lat': lat, 'lon': lon, 'parameters': self.store.parameters, 'dates': dates})
+            elif path == ['status']:
+                cache = self.store.cache
+                self.__send_json(200, {'entries': len(cache), 'bytes': cache.size, 'max_bytes': cache.max_bytes,
+                                       'hits': cache.hits, 'misses': cache.misses})
+            else:
+                self.__send_json(404, {'error': "Unknown request '{}'".format(parts.path)})
+        except KeyError as ke:
+            self.__send_json(404, {'error': str(ke.args[0]) if ke.args else 'not found'})
+        except ValueError as ve:
+            self.__send_json(400, {'error': str(ve)})
+        except Exception as ex:
+            self.__send_json(500, {'error': str(ex)})
+
+
+def create_server(store, host='127.0.0.1', port=8080, quiet=False):
+    """
+    This function creates the HTTP server of the query service; each request is answered on its own thread
+    Args:
+        store (OutputStore): the output files to serve
+        host (str): the address to listen on
+        port (int): the port to listen on
+        quiet (boolean): flag to turn off the request log
+
+    Returns:
+        ThreadingHTTPServer object
+    """
+    handler = type('ProjectQueryHandler', (QueryHandler,), {'store': store, 'quiet': quiet})
+    return ThreadingHTTPServer((host, port), handler)
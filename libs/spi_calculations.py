@@ -1,7 +1,6 @@
 # -*- coding: utf-8 -*-
 import numpy as np
 import numpy.ma as ma
-import scipy.stats as stats
 import warnings
 
 
@@ -16,6 +15,8 @@ def calculate_monthly_spi(values):
     Returns:
         numpy 3D array of monthly SPI values
     """
+    # scipy is only imported when SPI values are computed, since it is slow to import #
+    from scipy.special import gammainc, ndtri
     warnings.simplefilter("ignore")
     try:
         data_mask = np.where(values == 0.0, 0, 1)
@@ -28,15 +29,15 @@ def calculate_monthly_spi(values):
         alpha_hat = np.reciprocal(alpha * 4.0) * (1.0 + ma.sqrt(1.0 + (1.333334 * alpha)))
         # calculate the ß value #
         beta_hat = np.maximum(0.0001, mean_precip / alpha_hat)  # limit to prevent errors
-        # calculate the Gamma Cumulative Distribution #
-        gamma_cd = stats.gamma.cdf(masked_values, a=alpha_hat, scale=beta_hat)
+        # calculate the Gamma Cumulative Distribution (the regularized lower incomplete gamma function of x/ß) #
+        gamma_cd = gammainc(np.asarray(alpha_hat), np.asarray(masked_values) / np.asarray(beta_hat))
         # calculate the q value (m/n where m is the sum of zero values and n is the number of years) #
         zero_count = np.sum(np.equal(np.array(values), 0.0), axis=0)
         q_factor = np.clip(zero_count / period_length, 0.0, 1.0)  # q should be between 0.0 and 1.0
         # calculate the cumulative probability H(x) #
         cumulative_prob = q_factor + ((1.0 - q_factor) * gamma_cd)
-        # convert to a standard distribution #
-        spi_values = stats.norm.ppf(cumulative_prob)
+        # convert to a standard distribution (the inverse of the standard normal CDF) #
+        spi_values = ndtri(cumulative_prob)
         # cleanup memory #
         del alpha, alpha_hat, beta_hat, gamma_cd, cumulative_prob
         return np.where(data_mask, spi_values, -9999.0)  # mask out no-precipitation areas
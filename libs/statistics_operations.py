@@ -1,6 +1,6 @@
-import libs.netcdf_functions as netcdf
 import numpy as np
 import numpy.ma as ma
+from libs.profiling import span
 
 
 class StatisticOperations:
@@ -10,41 +10,89 @@ class StatisticOperations:
     def __init__(self):
         self.__missing = -9999.0
 
-    def compute_anomalies_from_files(self, files, parameter):
+    def compute_anomalies_by_month(self, files, parameter, positions, aoi=None):
         """
-        This function loads yearly for a particular month, and computes the anomaly per grid point per year
+        This function loads the files of the months of the year by year, and computes the anomaly per grid point per
+            year for all the months in one pass
             Anomalies are computed using the delta from the mean, vs. the standard deviation
             For each grid point:
                 Anomaly = (monthly value for that year - mean of monthly value for all years) / standard deviation of yearly values
         Args:
-            files (List[str]): The month to process per year
+            files (List[str]): the files of the time axis, in time order
             parameter (str): the name of the NetCDF parameter to load
+            positions: 2D numpy array (months, years) of the positions of the files, -1 for the missing months
+                (rows of TimeIndex.month_year_positions)
+            aoi (AOIMask): optional mask of the AOI cells; the grids are packed to the cells as they are read
 
         Returns:
-            List of 2D numpy arrays containing the anomaly values
+            numpy array (months, years, latitudes, longitudes) of the anomaly values, missing for the missing months,
+                or (months, years, cells) with an AOI mask
         """
+        import libs.netcdf_functions as netcdf
         try:
-            month_values = []
-            # load the data #
-            for f in files:
-                data_set = netcdf.open_dataset(f)
-                month_values.append(netcdf.extract_data(data_set, parameter, -1))
-                data_set.close()
-            masked_values = ma.masked_equal(month_values, self.__missing)  # mask out missing data
-            mask = np.where(np.mean(month_values, axis=0) == self.__missing, 1, 0)
-            # compute the mean delta value #
-            month_mean = ma.mean(masked_values, axis=0)
-            # masked_mean = ma.masked_equal(month_mean, self.__missing)
-            # compute the standard deviation #
-            month_std = ma.std(masked_values, axis=0, ddof=1)
-            # masked_std = ma.masked_equal(month_std, self.__missing)
-            # compute the anomaly for each month #
-            anomalies = []
-            for values in masked_values:
-                month_anomaly = np.ma.true_divide(np.ma.subtract(values, month_mean), month_std)
-                masked_anomaly = np.ma.masked_where(mask, month_anomaly.filled(0.0))
-                anomalies.append(month_anomaly.filled(self.__missing))
-            return anomalies
+            month_values = None
+            # load the data into the month by year grid #
+            with span('read', parameter=parameter) as s:
+                for m, y in zip(*np.nonzero(positions >= 0)):
+                    data_set = netcdf.open_dataset(files[positions[m, y]])
+                    values = netcdf.extract_data(data_set, parameter, 0)
+                    data_set.close()
+                    if aoi is not None:
+                        values = aoi.pack(values)
+                    if month_values is None:
+                        month_values = np.full(positions.shape + values.shape, self.__missing)
+                    month_values[m, y] = values
+                    s.add_file_read(files[positions[m, y]])
+                    s.add_pixels(values.size)
+            if month_values is None:
+                return np.full(positions.shape, self.__missing)
+            return self.compute_anomaly_stack(month_values, positions < 0)
+        except ValueError:
+            raise
+        except Exception:
+            raise
+
+    def group_by_month(self, values, positions):
+        """
+        This function lays a time series out by month of the year and year
+        Args:
+            values: numpy array (times, latitudes, longitudes) of the values, or (times, cells) of packed AOI values
+            positions: 2D numpy array (months, years) of the time indices, -1 for the missing months
+                (rows of TimeIndex.month_year_positions)
+
+        Returns:
+            numpy array (months, years, ...) of the values, missing for the missing months
+        """
+        values = np.asarray(values, dtype=float)
+        if values.shape[0] == 0:
+            return np.full(positions.shape + values.shape[1:], self.__missing)
+        grouped = values[np.maximum(positions, 0)]
+        grouped[positions < 0] = self.__missing
+        return grouped
+
+    def compute_anomaly_stack(self, values, gaps):
+        """
+        This function computes the anomaly per grid point per year for stacked months of the year
+            The missing months (gaps) and the missing values are left out of the mean and the standard deviation
+        Args:
+            values: numpy array (months, years, latitudes, longitudes) or (months, years, cells) of the values
+            gaps: boolean numpy array (months, years), true for the missing months
+
+        Returns:
+            numpy array of the anomaly values with the shape of the values, missing for the missing months
+        """
+        try:
+            with span('anomaly') as s:
+                s.add_pixels(np.size(values))
+                gaps = np.broadcast_to(np.reshape(gaps, np.shape(gaps) + (1,) * (np.ndim(values) - 2)), np.shape(values))
+                masked_values = ma.masked_array(values, mask=(values == self.__missing) | gaps)  # mask out missing data
+                # compute the mean value of each month of the year #
+                month_mean = ma.mean(masked_values, axis=1, keepdims=True)
+                # compute the standard deviation #
+                month_std = ma.std(masked_values, axis=1, ddof=1, keepdims=True)
+                # compute the anomaly for each month #
+                anomalies = np.ma.true_divide(np.ma.subtract(masked_values, month_mean), month_std)
+                return anomalies.filled(self.__missing)
         except ValueError:
             raise
         except Exception:
@@ -63,20 +111,22 @@ class StatisticOperations:
             List of 2D numpy arrays containing the anomaly values
         """
         try:
-            month_values = ma.masked_equal(values, self.__missing)  # mask out missing data
-            # compute the mean delta value #
-            month_mean = ma.average(month_values, axis=0)
-            masked_mean = ma.masked_equal(month_mean, self.__missing)
-            # compute the standard deviation #
-            month_std = ma.std(month_values, axis=0, ddof=1)
-            masked_std = ma.masked_equal(month_std, self.__missing)
-            # compute the anomaly for each month #
-            anomalies = []
-            for values in month_values:
-                month_anomaly = (values-masked_mean)/masked_std
-                masked_anomaly = month_anomaly.filled(self.__missing)
-                anomalies.append(masked_anomaly)
-            return anomalies
+            with span('anomaly') as s:
+                s.add_pixels(np.size(values))
+                month_values = ma.masked_equal(values, self.__missing)  # mask out missing data
+                # compute the mean delta value #
+                month_mean = ma.average(month_values, axis=0)
+                masked_mean = ma.masked_equal(month_mean, self.__missing)
+                # compute the standard deviation #
+                month_std = ma.std(month_values, axis=0, ddof=1)
+                masked_std = ma.masked_equal(month_std, self.__missing)
+                # compute the anomaly for each month #
+                anomalies = []
+                for values in month_values:
+                    month_anomaly = (values-masked_mean)/masked_std
+                    masked_anomaly = month_anomaly.filled(self.__missing)
+                    anomalies.append(masked_anomaly)
+                return anomalies
         except ValueError:
             raise
         except Exception:
@@ -92,30 +142,55 @@ class StatisticOperations:
         Returns:
             3D numpy array of the ranked values for the area
         """
+        return self.rank_stack(values, 0)
+
+    def rank_stack(self, values, axis=0, gaps=None):
+        """
+        This function ranks values over a time period on a 0.0 to 1.0 scale, for any number of stacked parameters
+            The mean rank of a value is the average of the number of other years with a smaller value and the
+            number of other years with a smaller or equal value; it is divided by the highest mean rank + 1
+            The values of each grid cell are sorted once, and the ranks of tied values are taken from the first and
+            last positions of their run in the sorted order (no year by year comparisons)
+            A grid cell with a missing value in any year is missing in every year
+            The missing years of a series (gaps) are sorted after all the values, so they are left out of the ranks
+        Args:
+            values: numpy array of the values, e.g. (years, latitudes, longitudes) or (parameters, years, latitudes,
+                longitudes)
+            axis (int): the axis of the years
+            gaps: optional boolean numpy array that broadcasts to the values, true for the missing years
+
+        Returns:
+            Masked numpy array of the ranked values, with the shape of the values
+        """
         try:
-            # mask out missing values #
-            masked_values = ma.masked_equal(values, self.__missing)
-            # create place-holder for the year grids #
-            ranked_data = []
-            # loop thru the sets and add the compare counts to the masks #
-            for j, base_data in enumerate(masked_values):
-                strict_ranks = np.zeros_like(base_data)
-                weak_ranks = np.zeros_like(base_data)
-                # loop thru again and compare the remaining sets against the base #
-                for i, compare_data in enumerate(masked_values):
-                    if i != j:  # skip if the same index as the base #
-                        # increment the cells based on rank comparison #
-                        np.add(strict_ranks, ma.where(base_data > compare_data, 1, 0), out=strict_ranks)
-                        np.add(weak_ranks, ma.where(base_data >= compare_data, 1, 0), out=weak_ranks)
-                # compute the mean rank #
-                ranks = (strict_ranks + weak_ranks) * 0.5
-                # append the year to the output #
-                ranked_data.append(ranks)
-            # divide sum by total years #
-            count = np.ma.masked_equal(ma.amax(ranked_data, axis=0) + 1, 0)
-            pct_data = np.round(np.ma.true_divide(np.ma.asarray(ranked_data), count), 3)
-            final_ranks = np.ma.masked_equal(pct_data, self.__missing)
-            return final_ranks
+            with span('rank') as s:
+                s.add_pixels(np.size(values))
+                values = np.asarray(values, dtype=float)
+                gaps = np.zeros(values.shape, dtype=bool) if gaps is None else np.broadcast_to(gaps, values.shape)
+                values = np.moveaxis(values, axis, 0)
+                gaps = np.moveaxis(gaps, axis, 0)
+                if np.any(gaps):
+                    values = np.where(gaps, np.inf, values)
+                years = values.shape[0]
+                order = np.argsort(values, axis=0, kind='stable')
+                sorted_values = np.take_along_axis(values, order, axis=0)
+                # the sorted position of the first and the last value of each run of equal values #
+                positions = np.arange(years).reshape((years,) + (1,) * (values.ndim - 1))
+                starts = np.ones(values.shape, dtype=bool)
+                starts[1:] = sorted_values[1:] != sorted_values[:-1]
+                first = np.maximum.accumulate(np.where(starts, positions, 0), axis=0)
+                ends = np.ones(values.shape, dtype=bool)
+                ends[:-1] = starts[1:]
+                last = np.minimum.accumulate(np.where(ends, positions, years - 1)[::-1], axis=0)[::-1]
+                # mean rank: (smaller values + smaller or equal values other than itself) / 2 #
+                ranks = np.empty(values.shape, dtype=float)
+                np.put_along_axis(ranks, order, (first + last) * 0.5, axis=0)
+                # divide by the highest rank + 1 #
+                count = np.amax(np.where(gaps, 0.0, ranks), axis=0) + 1
+                pct_data = np.round(np.true_divide(ranks, count), 3)
+                mask = np.broadcast_to(np.any(values == self.__missing, axis=0), values.shape) | gaps
+                final_ranks = ma.masked_array(pct_data, mask=mask, fill_value=self.__missing)
+                return np.moveaxis(final_ranks, 0, axis)
         except ValueError:
             raise
         except Exception:
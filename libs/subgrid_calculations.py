@@ -1,9 +1,8 @@
 import numpy as np
+from libs.profiling import span
 
 
 class NetCDFSubGrid:
-    import libs.netcdf_functions as NetCDF
-
     def __init__(self, aoi, file_path, interpolate=False):
         self.__aoi = aoi
         self.__file_path = file_path
@@ -16,10 +15,13 @@ class NetCDFSubGrid:
         self.last_root_x = 0
         self.first_root_y = 0
         self.last_root_y = 0
-        self.columns = int(abs(aoi['e_lon'] - aoi['w_lon']) * 20) + 1  # 0.05 degree spacing = 20 columns/degree
+        self.columns = int(round(abs(aoi['e_lon'] - aoi['w_lon']) * 20, 0) + 1)  # 0.05 degree spacing = 20 columns/degree
         self.rows = int(round(abs(aoi['n_lat'] - aoi['s_lat']) * 20, 0) + 1)  # 0.05 degree spacing = 20 rows/degree
         
     def __enter__(self):
+        # the file libraries are imported on first use to keep the start-up of the steps fast #
+        import libs.netcdf_functions as netcdf
+        self.NetCDF = netcdf
         try:
             self.__dataset = self.NetCDF.open_dataset(self.__file_path)
             # get the dimensions of the source data #
@@ -61,10 +63,10 @@ class NetCDFSubGrid:
         """
         # compute the SubGrid corners #
         start_y = s_lat + 0.025  # the SubGrid points are 0.025 degrees offset from the original points
-        self.start_y = int((self.__aoi['s_lat'] - start_y) * 20)
+        self.start_y = int(round((self.__aoi['s_lat'] - start_y) * 20, 0))
         self.end_y = int(self.start_y + self.rows)
         start_x = w_lon + 0.025  # the SubGrid points are 0.025 degrees offset from the original points
-        self.start_x = int((self.__aoi['w_lon'] - start_x) * 20)
+        self.start_x = int(round((self.__aoi['w_lon'] - start_x) * 20, 0))
         self.end_x = int(self.start_x + self.columns)
 
     def __compute_indices(self, bounds, latitudes, longitudes):
@@ -107,20 +109,28 @@ class NetCDFSubGrid:
         self.root_rows = int(self.last_root_y - self.first_root_y)
         self.root_columns = int(self.last_root_x - self.first_root_x)
 
-    def __extract_raw_subset(self, parameter):
+    def __extract_raw_subsets(self, parameters):
         """
-        This function extracts a subset of data from the requested parameter using the computed cells required to cover the current Area of Interest
+        This function reads the window of the requested parameters that covers the current Area of Interest
+            Only the window is read from the file, at the first time of the parameters with a time dimension
         Args:
-            parameter (str): the NetCDF parameter name
+            parameters (list): the NetCDF parameter names
 
         Returns:
-            2D numpy array of floats for the subset area
+            3D numpy array of floats (parameters, rows, columns) for the subset area
         """
-        if 'times' in self.__root_dimensions:
-            full_data = self.NetCDF.extract_data(self.__dataset, parameter)
-        else:
-            full_data = self.NetCDF.extract_data(self.__dataset, parameter, -1)
-        return full_data[self.first_root_y: self.last_root_y, self.first_root_x: self.last_root_x]
+        rows = slice(self.first_root_y, self.last_root_y)
+        columns = slice(self.first_root_x, self.last_root_x)
+        subsets = []
+        with span('raw read', parameters=len(parameters)) as s:
+            for parameter in parameters:
+                variable = self.__dataset.variables[parameter]
+                window = (0, rows, columns) if variable.ndim == 3 else (rows, columns)
+                subsets.append(np.array(variable[window]).astype(float))
+            subset = np.stack(subsets)
+            s.add_bytes_read(subset.nbytes)
+            s.add_pixels(subset.size)
+        return subset
 
     def __interpolate_cells(self, raw_data):
         """
@@ -128,94 +138,91 @@ class NetCDFSubGrid:
             and then interpolates the data to 0.05 degree spacing
         The new data values are created using a special form of bilinear-interpolation where the empty cells
             (represented by the value -9999.0) are not included in the weighting
+        Each original cell (jj, ii) and its neighbours (jp = jj + 1, ip = ii + 1) give a block of 2x2 new cells,
+            and all the blocks of all the layers are computed at once
         Args:
-            raw_data (2D numpy array of floats): the original data to process
+            raw_data (3D numpy array of floats): the original data to process (layers, rows, columns)
 
         Returns:
-            2D numpy array (floats) of the interpolated data covering the Area of Interest (bounds)
+            3D numpy array (floats) of the interpolated data covering the Area of Interest (bounds)
         """
+        layers, root_rows, root_columns = raw_data.shape
         # initialize output array with a 4 cell buffer #
-        output_data = np.full((self.rows + 4, self.columns + 4), self.__missing, dtype='float')
-        # pre-define the weight patterns: 16ths of the raw values to use #
-        w_jj_ii = np.array([[0.5625, 0.1875], [0.1875, 0.0625]])  # 9, 3, 3, 1
-        w_jj_ip = np.array([[0.1875, 0.5625], [0.0625, 0.1875]])  # 3, 9, 1, 3
-        w_jp_ii = np.array([[0.1875, 0.0625], [0.5625, 0.1875]])  # 3, 1, 9, 3
-        w_jp_ip = np.array([[0.0625, 0.1875], [0.1875, 0.5625]])  # 1, 3, 3, 9
-
-        def __interpolate_cell(values, weights, mask):
-            """
-            Private function that interpolates a cell based on the distance to the original cells,
-                and if the original cells contain non-missing values
-            Args:
-                values (2D numpy array of floats): subset of the original data that affects the new cell
-                weights (2D numpy array of floats): predetermined weighting of the original data
-                mask (2D numpy array of floats): array of zeros and ones representing False/True if an original data
-                    cell should be used in the interpolation
-
-            Returns:
-                float value of the interpolated data for the target cell
-            """
-            # determine the scale factor for the weights which accounts for empty cells
-            scale = np.true_divide(1.0, np.sum(mask * weights))
-            # return the interpolated value: sum of the raw values multiplied by their weights
-            return np.sum(values * (weights * mask) * scale)
-
-        # start to process the bilinear interpolation #
-        last_root_j = self.root_rows - 1  # last column in original data (minus 1 offset for zero-based array)
-        last_root_i = self.root_columns - 1  # last column in original data (minus 1 offset for zero-based array)
-        # iterate by row #
-        for jj in range(0, last_root_j):
-            # set row indices for new grid points #
-            j1 = jj * 2
-            j2 = jj * 2 + 1
-            jp = jj + 1
-            # iterate by column #
-            for ii in range(0, last_root_i):
-                # set column indices for new grid points #
-                i1 = ii * 2
-                i2 = ii * 2 + 1
-                ip = ii + 1
-                # bilinear interpolation of the interior #
-                data_subset = np.array([[raw_data[jj][ii], raw_data[jj][ip]], [raw_data[jp][ii], raw_data[jp][ip]]])
-                weight_mask = np.where(data_subset == self.__missing, 0, 1)
-                if np.sum(weight_mask) > 0:
-                    output_data[j1][i1] = __interpolate_cell(data_subset, w_jj_ii, weight_mask)
-                    output_data[j1][i2] = __interpolate_cell(data_subset, w_jj_ip, weight_mask)
-                    output_data[j2][i1] = __interpolate_cell(data_subset, w_jp_ii, weight_mask)
-                    output_data[j2][i2] = __interpolate_cell(data_subset, w_jp_ip, weight_mask)
+        output_data = np.full((layers, self.rows + 4, self.columns + 4), self.__missing, dtype='float')
+        if root_rows < 2 or root_columns < 2:
+            return output_data
+        # the original cells of each block: jj/ii, jj/ip, jp/ii and jp/ip #
+        corners = [raw_data[:, :-1, :-1], raw_data[:, :-1, 1:], raw_data[:, 1:, :-1], raw_data[:, 1:, 1:]]
+        masks = [np.where(c == self.__missing, 0, 1) for c in corners]
+        has_values = (masks[0] + masks[1] + masks[2] + masks[3]) > 0
+        # pre-define the weight patterns: 16ths of the raw values to use for each new cell of the block #
+        patterns = [
+            ((0, 0), [0.5625, 0.1875, 0.1875, 0.0625]),  # 9, 3, 3, 1
+            ((0, 1), [0.1875, 0.5625, 0.0625, 0.1875]),  # 3, 9, 1, 3
+            ((1, 0), [0.1875, 0.0625, 0.5625, 0.1875]),  # 3, 1, 9, 3
+            ((1, 1), [0.0625, 0.1875, 0.1875, 0.5625])   # 1, 3, 3, 9
+        ]
+        height = min(2 * (root_rows - 1), self.rows + 4)
+        width = min(2 * (root_columns - 1), self.columns + 4)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for (dj, di), weights in patterns:
+                # the weights of the empty cells are 0, and the others are scaled to add up to 1 #
+                weighted_masks = [m * w for m, w in zip(masks, weights)]
+                scale = np.true_divide(1.0, ((weighted_masks[0] + weighted_masks[1]) + weighted_masks[2]) + weighted_masks[3])
+                terms = [c * wm * scale for c, wm in zip(corners, weighted_masks)]
+                values = np.where(has_values, ((terms[0] + terms[1]) + terms[2]) + terms[3], self.__missing)
+                output_data[:, dj:height:2, di:width:2] = values[:, 0:(height - dj + 1) // 2, 0:(width - di + 1) // 2]
         return output_data
 
-    def create_sub_grid(self, parameter):
+    def create_sub_grids(self, parameters):
         """
-        This function creates a new numpy array for the current Area of Interest interpolated to the target resolution of 0.05 degrees
+        This function creates a numpy array of several parameters for the current Area of Interest, interpolated to the
+            target resolution of 0.05 degrees
+            The windows of all parameters are read in one pass and interpolated together
         Args:
-            parameter (str): the NetCDF parameter name
+            parameters (list): the NetCDF parameter names
 
         Returns:
-            2D numpy array of floats
+            3D numpy array of floats (parameters, rows, columns)
         """
         # load the subset of the raw data to interpolate #
-        raw_data = self.__extract_raw_subset(parameter)
+        raw_data = self.__extract_raw_subsets(parameters)
         # set the current units #
-        self.units = self.NetCDF.get_parameter_units(self.__dataset, parameter)
+        self.units = self.NetCDF.get_parameter_units(self.__dataset, parameters[-1])
         if self.interpolate:
             # interpolate the data #
-            interpolated_data = self.__interpolate_cells(raw_data)
+            with span('interpolate', parameters=len(parameters)) as s:
+                interpolated_data = self.__interpolate_cells(raw_data)
+                s.add_pixels(interpolated_data.size)
             # return the interpolated data in our Area of Interest #
-            results = interpolated_data[self.start_y: self.end_y, self.start_x: self.end_x]
+            results = interpolated_data[:, self.start_y: self.end_y, self.start_x: self.end_x]
         else:
             results = raw_data
         return results
 
+    def create_sub_grid(self, parameter):
+        """
+        This function creates a new numpy array for the current Area of Interest interpolated to the target resolution of 0.05 degrees
+        Args:
+            parameter (str): the NetCDF parameter name
+
+        Returns:
+            2D numpy array of floats
+        """
+        return self.create_sub_grids([parameter])[0]
+
 
 class HDFSubGrid:
-    import libs.hdf_functions as HDF
-
+    """
+    This class reads the Area of Interest of the MODIS CMG files: HDF5 files (converted by h4toh5convert) are read
+        with h5py, and HDF4 files directly through GDAL, without converting them
+    """
     def __init__(self, aoi, file_path, group):
         self.__bounds = aoi
         self.__file_path = file_path
         self.__dataset = None
         self.__group = group
+        self.__is_hdf4 = False
         # initialize class properties #
         self.__missing = np.float32(-9999.0)
         self.units = ""
@@ -227,8 +234,13 @@ class HDFSubGrid:
         self.rows = int(abs(aoi['n_lat'] - aoi['s_lat']) * 20) + 1  # 0.05 degree spacing = 20 rows/degree
 
     def __enter__(self):
+        import libs.hdf_functions as hdf
+        self.HDF = hdf
         try:
-            self.__dataset = self.HDF.open_dataset(self.__file_path)
+            if self.HDF.is_hdf5(self.__file_path):
+                self.__dataset = self.HDF.open_dataset(self.__file_path)
+            else:
+                self.__is_hdf4 = True
             # set the dimensions of the source data #
             self.__root_latitudes = np.arange(89.975, -90.05, -0.05)
             self.__root_longitudes = np.arange(-179.975, 180.05, 0.05)
@@ -290,8 +302,23 @@ class HDFSubGrid:
         Returns:
             2D numpy array of floats for the subset area
         """
-        full_data = self.HDF.extract_data(self.__dataset, self.__group, parameter, -1)
-        return full_data[self.first_root_y: self.last_root_y, self.first_root_x: self.last_root_x]
+        if self.__is_hdf4:
+            # read only the window of the subset from the HDF4 file #
+            with span('raw read', parameter=parameter) as s:
+                subset = self.HDF.extract_hdf4_window(self.__file_path, self.__group, parameter,
+                                                      (self.first_root_y, self.last_root_y),
+                                                      (self.first_root_x, self.last_root_x))
+                s.add_bytes_read(subset.nbytes)
+                s.add_pixels(subset.size)
+            return subset
+        with span('raw read', parameter=parameter) as s:
+            full_data = self.HDF.extract_data(self.__dataset, self.__group, parameter, -1)
+            s.add_bytes_read(full_data.nbytes)
+            s.add_pixels(full_data.size)
+        with span('subset', parameter=parameter) as s:
+            subset = full_data[self.first_root_y: self.last_root_y, self.first_root_x: self.last_root_x]
+            s.add_pixels(subset.size)
+        return subset
 
     def create_sub_grid(self, parameter):
         """
@@ -308,9 +335,22 @@ class HDFSubGrid:
         return subset
 
 
-class CHIRPSSubGrid:
-    import imageio
+def get_raster_path(file_path):
+    """
+    This function returns the path GDAL opens a raster with, reading gzipped files through /vsigzip/
+        so the archives of the source data do not need to be decompressed to disk
+    Args:
+        file_path (str): fully-qualified path/name of the raster file (.tif or .tif.gz)
+
+    Returns:
+        String path for rasterio.open
+    """
+    if file_path.lower().endswith('.gz'):
+        return '/vsigzip/' + file_path
+    return file_path
 
+
+class CHIRPSSubGrid:
     def __init__(self, aoi, file_path):
         self.__bounds = aoi
         self.__file_path = file_path
@@ -326,13 +366,24 @@ class CHIRPSSubGrid:
         self.rows = int(abs(aoi['n_lat'] - aoi['s_lat']) * 20) + 1  # 0.05 degree spacing = 20 rows/degree
 
     def __enter__(self):
+        import rasterio
+        from rasterio.windows import Window
         try:
-            self.__dataset = self.imageio.imread(self.__file_path)
             # set the dimensions of the source data #
             self.__root_latitudes = np.arange(49.975, -50.05, -0.05)
             self.__root_longitudes = np.arange(-179.975, 180.05, 0.05)
             # determine the properties of the SubGrid area #
             self.__compute_indices(self.__bounds, self.__root_latitudes, self.__root_longitudes)
+            # read only the window of the SubGrid area, directly from the .tif.gz archives #
+            with span('raw read', file=self.__file_path) as s:
+                with rasterio.open(get_raster_path(self.__file_path)) as source:
+                    last_y = max(min(self.last_root_y, source.height), self.first_root_y)
+                    last_x = max(min(self.last_root_x, source.width), self.first_root_x)
+                    window = Window(self.first_root_x, self.first_root_y,
+                                    last_x - self.first_root_x, last_y - self.first_root_y)
+                    self.__dataset = source.read(1, window=window)
+                s.add_file_read(self.__file_path)
+                s.add_pixels(self.__dataset.size)
             return self
         except IOError:
             raise
@@ -387,7 +438,8 @@ class CHIRPSSubGrid:
         Returns:
             2D numpy array of floats
         """
-        # load the subset of the raw data #
-        data = np.array(self.__dataset)
-        subset = data[self.first_root_y: self.last_root_y, self.first_root_x: self.last_root_x]
+        # the subset of the raw data was read as a window #
+        with span('subset') as s:
+            subset = np.array(self.__dataset)
+            s.add_pixels(subset.size)
         return subset
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+"""
+Monthly time axes of the NetCDF files
+    The times are held as numpy datetime64[M] months, so grouping by month of the year, finding the dates common to
+    several files and mapping the positions of one file to another are array operations instead of loops over dates
+"""
+
+# the origin of the NetCDF times (days since Jan 1, 1900) #
+TIME_ORIGIN = np.datetime64('1900-01-01', 'D')
+
+
+class TimeIndex:
+    """
+    This class holds a monthly time axis as an array of numpy datetime64[M] months
+    """
+    def __init__(self, months=()):
+        """
+        Args:
+            months: array-like of datetime64 months (or anything numpy converts to them, e.g. '2001-02')
+        """
+        self.months = np.asarray(months, dtype='datetime64[M]').reshape(-1)
+
+    @classmethod
+    def from_times(cls, times):
+        """
+        This function creates the index of NetCDF times
+        Args:
+            times: list or numpy array of the times as days since Jan 1, 1900
+
+        Returns:
+            TimeIndex object
+        """
+        days = np.floor(np.asarray(times, dtype=float)).astype('timedelta64[D]')
+        return cls((TIME_ORIGIN + days).astype('datetime64[M]'))
+
+    @classmethod
+    def from_year_months(cls, years, months):
+        """
+        This function creates the index of years and months of the year (1 - 12)
+        Returns:
+            TimeIndex object
+        """
+        counts = (np.asarray(years, dtype=np.int64) - 1970) * 12 + (np.asarray(months, dtype=np.int64) - 1)
+        return cls(counts.astype('datetime64[M]'))
+
+    @classmethod
+    def from_dates(cls, dates):
+        """
+        This function creates the index of 'YYYYMM' date strings
+        Returns:
+            TimeIndex object
+        """
+        dates = [str(d) for d in dates]
+        return cls.from_year_months([int(d[0:4]) for d in dates], [int(d[4:6]) for d in dates])
+
+    @classmethod
+    def from_file_names(cls, files, match_regex):
+        """
+        This function creates the index of monthly file names
+        Args:
+            files: list of the file names as strings
+            match_regex: compiled regex of the file name pattern, with the year and month as its first two groups
+
+        Returns:
+            TimeIndex object
+        """
+        dates = [match_regex.match(f).groups()[0:2] for f in files]
+        return cls.from_year_months([int(y) for y, m in dates], [int(m) for y, m in dates])
+
+    def __len__(self):
+        return len(self.months)
+
+    def __eq__(self, other):
+        return isinstance(other, TimeIndex) and np.array_equal(self.months, other.months)
+
+    @property
+    def times(self):
+        """
+        This function converts the months to NetCDF times
+        Returns:
+            List (floats) of the times as number of days since Jan 1, 1900
+        """
+        return (self.months.astype('datetime64[D]') - TIME_ORIGIN).astype(np.int64).astype(float).tolist()
+
+    @property
+    def years(self):
+        """
+        Returns:
+            numpy array of the integer years
+        """
+        return self.months.astype(np.int64) // 12 + 1970
+
+    @property
+    def month_of_year(self):
+        """
+        Returns:
+            numpy array of the integer months of the year (1 - 12)
+        """
+        return self.months.astype(np.int64) % 12 + 1
+
+    def dates(self):
+        """
+        This function formats the months as dates
+        Returns:
+            List of 'YYYYMM' date strings
+        """
+        return [str(d) for d in (self.years * 100 + self.month_of_year).tolist()]
+
+    def month_indices(self, month):
+        """
+        This function finds the positions of a month of the year
+        Args:
+            month (int): the month of the year (1 - 12)
+
+        Returns:
+            numpy array of the integer positions, in time order
+        """
+        return np.flatnonzero(self.month_of_year == int(month))
+
+    def month_groups(self):
+        """
+        This function groups the positions by month of the year, with one stable sort
+        Returns:
+            Dictionary of month of the year (1 - 12): numpy array of the integer positions, in time order
+        """
+        month_of_year = self.month_of_year
+        order = np.argsort(month_of_year, kind='stable')
+        bounds = np.searchsorted(month_of_year[order], np.arange(1, 14))
+        return {m: order[bounds[m - 1]:bounds[m]] for m in range(1, 13)}
+
+    def month_year_positions(self):
+        """
+        This function lays the positions out as a grid of month of the year by year, from the first year of the index
+            A missing month is a gap in the grid instead of a shift of the months after it, so the series of a month
+            of the year is a row of the grid whatever the first month and the gaps of the time axis
+        Returns:
+            2D numpy array (12, years) of the integer positions, -1 for the months the index does not have
+        """
+        if len(self.months) == 0:
+            return np.full((12, 0), -1, dtype=np.int64)
+        years = self.years
+        positions = np.full((12, int(years.max() - years.min()) + 1), -1, dtype=np.int64)
+        positions[self.month_of_year - 1, years - years.min()] = np.arange(len(self.months))
+        return positions
+
+    def intersection(self, *others):
+        """
+        This function finds the months that this index and all the others have in common
+        Args:
+            others: TimeIndex objects
+
+        Returns:
+            TimeIndex object of the sorted common months
+        """
+        months = np.unique(self.months)
+        for other in others:
+            months = np.intersect1d(months, other.months, assume_unique=False)
+        return TimeIndex(months)
+
+    def positions(self, other):
+        """
+        This function maps the months of another index to their positions in this index
+        Args:
+            other (TimeIndex): the months to find
+
+        Returns:
+            numpy array of the integer positions, -1 for the months this index does not have
+        """
+        if len(self.months) == 0:
+            return np.full(len(other.months), -1, dtype=np.int64)
+        order = np.argsort(self.months, kind='stable')
+        found = np.minimum(np.searchsorted(self.months, other.months, sorter=order), len(self.months) - 1)
+        positions = order[found]
+        return np.where(self.months[positions] == other.months, positions, -1)
+
+    def index_of(self, other):
+        """
+        This function maps the months of another index to their positions in this index, e.g. to read the dates
+            common to several files from each of them
+        Args:
+            other (TimeIndex): the months to find, all within this index
+
+        Returns:
+            numpy array of the integer positions
+        """
+        positions = self.positions(other)
+        if np.any(positions < 0):
+            missing = TimeIndex(other.months[positions < 0]).dates()
+            raise ValueError("The time dimension has no values for {}".format(', '.join(missing)))
+        return positions
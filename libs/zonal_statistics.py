@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import numpy as np
+from libs.profiling import span
+
+# the approximate length of one degree of latitude in km #
+KM_PER_DEGREE = 111.32
+
+
+def read_zones(geojson_file, name_field='name'):
+    """
+    This function reads the (multi)polygon features of a GeoJSON file as zones
+    Args:
+        geojson_file (str): fully-qualified path/name of the GeoJSON file (longitude/latitude coordinates)
+        name_field (str): the feature property that holds the zone name
+
+    Returns:
+        List of (name, geometry) tuples; features without a name are named 'zone_<n>'
+    """
+    with open(geojson_file, 'r') as fh:
+        collection = json.loads(fh.read())
+    zones = []
+    for f, feature in enumerate(collection.get('features', [])):
+        geometry = feature.get('geometry') or {}
+        if geometry.get('type') not in ['Polygon', 'MultiPolygon']:
+            continue
+        name = (feature.get('properties') or {}).get(name_field)
+        if name is None:
+            name = 'zone_{}'.format(f + 1)
+        zones.append((str(name), geometry))
+    return zones
+
+
+class ZoneIndex:
+    """
+    This class holds the zones of a polygon file rasterized on the 0.05 degree grid of the project
+        Every grid cell covered by a zone is listed once per zone, with the fraction of the cell inside the zone
+        (estimated from a supersampled rasterization) and the area of that fraction in km2
+        The entries are sorted by zone, so a zone covers a contiguous run of entries
+    """
+    def __init__(self, names, cells, zones, fractions, areas):
+        """
+        Args:
+            names (list): the zone names
+            cells (numpy array): the flat (latitude, longitude) grid index of each entry
+            zones (numpy array): the zone index of each entry
+            fractions (numpy array): the fraction of the grid cell inside the zone
+            areas (numpy array): the area of the fraction in km2
+        """
+        self.names = list(names)
+        self.cells = cells
+        self.zones = zones
+        self.fractions = fractions
+        self.areas = areas
+        self.zone_areas = np.bincount(zones, areas, minlength=len(self.names))
+        self.starts = np.searchsorted(zones, np.arange(0, len(self.names)))
+
+    @classmethod
+    def from_polygons(cls, zones, latitudes, longitudes, supersample=10):
+        """
+        This function rasterizes the zones on a grid with supersample x supersample points per grid cell,
+            and counts the points of each zone in each grid cell
+        Args:
+            zones (list): the (name, geometry) tuples from read_zones
+            latitudes (list): the latitudes of the grid cell centers, from north to south
+            longitudes (list): the longitudes of the grid cell centers, from west to east
+            supersample (int): the number of points per grid cell in each direction
+
+        Returns:
+            ZoneIndex object
+        """
+        from rasterio import features
+        from rasterio.transform import Affine
+        res = 0.05
+        rows = len(latitudes)
+        columns = len(longitudes)
+        names = [name for name, geometry in zones]
+        with span('rasterize', zones=len(zones), supersample=supersample) as s:
+            transform = Affine.translation(longitudes[0] - res / 2, latitudes[0] + res / 2) * \
+                Affine.scale(res / supersample, -res / supersample)
+            shapes = [(geometry, z + 1) for z, (name, geometry) in enumerate(zones)]
+            grid = features.rasterize(shapes, out_shape=(rows * supersample, columns * supersample),
+                                      transform=transform, fill=0, dtype='int32')
+            # count the points of each (grid cell, zone) pair #
+            point_rows, point_columns = np.nonzero(grid)
+            keys = ((point_rows // supersample) * columns + point_columns // supersample) * len(zones) + \
+                grid[point_rows, point_columns] - 1
+            keys, counts = np.unique(keys, return_counts=True)
+            cells = keys // len(zones)
+            zone_indices = keys % len(zones)
+            # sort the entries by zone, keeping the grid order within each zone #
+            order = np.argsort(zone_indices, kind='stable')
+            cells = cells[order]
+            zone_indices = zone_indices[order]
+            fractions = counts[order] / float(supersample * supersample)
+            # the grid cells narrow towards the poles #
+            cell_areas = (res * KM_PER_DEGREE) ** 2 * np.cos(np.radians(np.asarray(latitudes, dtype=float)))
+            areas = fractions * cell_areas[cells // columns]
+            s.add_pixels(grid.size)
+        return cls(names, cells, zone_indices, fractions, areas)
+
+    @classmethod
+    def load(cls, cache_file, key):
+        """
+        This function loads a cached zone index
+        Args:
+            cache_file (str): fully-qualified path/name of the .npz cache file
+            key (str): the description of the zone file and grid the index must have been created for
+
+        Returns:
+            ZoneIndex object, or None when there is no cache for the key
+        """
+        if not os.path.isfile(cache_file):
+            return None
+        with np.load(cache_file) as cache:
+            if str(cache['key']) != key:
+                return None
+            return cls(cache['names'].tolist(), cache['cells'], cache['zones'], cache['fractions'], cache['areas'])
+
+    def save(self, cache_file, key):
+        """
+        This function caches the zone index in a .npz file
+        Args:
+            cache_file (str): fully-qualified path/name of the .npz cache file
+            key (str): the description of the zone file and grid of the index
+        """
+        np.savez_compressed(cache_file, key=np.array(key), names=np.array(self.names), cells=self.cells,
+                            zones=self.zones, fractions=self.fractions, areas=self.areas)
+
+
+def get_zone_index(zone_file, latitudes, longitudes, cache_file, name_field='name', supersample=10):
+    """
+    This function returns the zone index of a polygon file, rasterizing the polygons only when the file or the grid
+        changed since the cached index was created
+    Args:
+        zone_file (str): fully-qualified path/name of the GeoJSON file of the zones
+        latitudes (list): the latitudes of the grid cell centers, from north to south
+        longitudes (list): the longitudes of the grid cell centers, from west to east
+        cache_file (str): fully-qualified path/name of the .npz cache file
+        name_field (str): the feature property that holds the zone name
+        supersample (int): the number of points per grid cell in each direction
+
+    Returns:
+        ZoneIndex object
+    """
+    status = os.stat(zone_file)
+    key = json.dumps({
+        'zone_file': os.path.abspath(zone_file),
+        'size': status.st_size,
+        'mtime': status.st_mtime,
+        'name_field': name_field,
+        'latitudes': [latitudes[0], latitudes[-1], len(latitudes)],
+        'longitudes': [longitudes[0], longitudes[-1], len(longitudes)],
+        'supersample': supersample
+    }, sort_keys=True)
+    index = ZoneIndex.load(cache_file, key)
+    if index is None:
+        index = ZoneIndex.from_polygons(read_zones(zone_file, name_field), latitudes, longitudes, supersample)
+        index.save(cache_file, key)
+    return index
+
+
+def compute_zonal_statistics(data, index, class_limits, missing=-9999.0):
+    """
+    This function computes the statistics of every zone for a block of dates
+        The mean and the class percentages are weighted by the area of each grid cell inside the zone,
+        and the minimum and maximum are taken over every grid cell that touches the zone
+    Args:
+        data: 3D numpy array (times, latitudes, longitudes) of the values
+        index (ZoneIndex): the rasterized zones
+        class_limits (list): the upper limits of the classes, in increasing order;
+            a value belongs to the first class with an upper limit >= the value
+        missing (float): the missing value
+
+    Returns:
+        Dictionary of numpy arrays (times, zones): 'valid_pct', 'mean', 'min' and 'max',
+            and (times, zones, classes): 'class_pct'; the values of zones without data are missing
+    """
+    times = data.shape[0]
+    zone_count = len(index.names)
+    class_count = len(class_limits)
+    values = data.reshape(times, -1)[:, index.cells]
+    valid = (values != missing) & np.isfinite(values)
+    weights = np.where(valid, index.areas, 0.0)
+    # aggregate all dates at once, with a separate set of bins per date #
+    bins = (np.arange(0, times)[:, None] * zone_count + index.zones).ravel()
+    valid_area = np.bincount(bins, weights.ravel(), minlength=times * zone_count).reshape(times, zone_count)
+    sums = np.bincount(bins, (weights * np.where(valid, values, 0.0)).ravel(),
+                       minlength=times * zone_count).reshape(times, zone_count)
+    has_data = valid_area > 0
+    results = {}
+    with np.errstate(divide='ignore', invalid='ignore'):
+        results['valid_pct'] = np.where(index.zone_areas > 0, valid_area / index.zone_areas * 100.0, 0.0)
+        results['mean'] = np.where(has_data, sums / valid_area, missing)
+    # reduce over the run of entries of each zone that covers a grid cell #
+    results['min'] = np.full((times, zone_count), missing)
+    results['max'] = np.full((times, zone_count), missing)
+    covered = index.zone_areas > 0
+    if np.any(covered):
+        starts = index.starts[covered]
+        minimum = np.minimum.reduceat(np.where(valid, values, np.inf), starts, axis=1)
+        maximum = np.maximum.reduceat(np.where(valid, values, -np.inf), starts, axis=1)
+        results['min'][:, covered] = np.where(has_data[:, covered], minimum, missing)
+        results['max'][:, covered] = np.where(has_data[:, covered], maximum, missing)
+    # the classes of the values rounded to 3 decimals, with anything above the last limit in the last class #
+    classes = np.minimum(np.searchsorted(class_limits, np.round(np.where(valid, values, 0.0), 3)), class_count - 1)
+    class_area = np.bincount((bins * class_count + classes.ravel()), weights.ravel(),
+                             minlength=times * zone_count * class_count).reshape(times, zone_count, class_count)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        results['class_pct'] = np.where(has_data[:, :, None], class_area / valid_area[:, :, None] * 100.0, missing)
+    return results
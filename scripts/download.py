@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+import getpass
+import os
+import sys
+from argparse import ArgumentParser
+from datetime import datetime
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+from libs.downloader import Downloader, HttpSession  # noqa: E402
+
+"""
+Concurrent, resumable download of the raw data archives (replaces download.sh and download-all.sh)
+    The files of a dataset are listed from the HTML directory listing of its archive (and of its sub-directories for
+    the archives with a directory per date), and downloaded with a few concurrent connections per host.
+    Interrupted downloads are resumed, and the completed files are recorded in download_record.json of the target
+    directory, so a backfill can simply be started again.
+    The NASA Earthdata credentials are read from ~/.netrc (machine urs.earthdata.nasa.gov), or asked for with --user.
+Usage (from the project directory, to download into the raw data directories of cdi_directory_settings.conf):
+    python scripts/download.py chirps lst ndvi sm --workers 8
+    python scripts/download.py --url https://example.org/data/ --pattern "\\.nc$" --target ./downloads
+"""
+
+EARTHDATA_HOST = 'urs.earthdata.nasa.gov'
+
+# the archive URL, file name pattern, directory per date flag and raw data directory of each dataset #
+DATASETS = {
+    'chirps': ('https://data.chc.ucsb.edu/products/CHIRPS-2.0/global_monthly/tifs/', r'\.tif\.gz$', False, 'chirps_tif'),
+    'lst': ('https://e4ftl01.cr.usgs.gov/MOLT/MOD21C3.061/', r'\.hdf$', True, 'lst_hdf'),
+    'ndvi': ('https://e4ftl01.cr.usgs.gov/MOLT/MOD13C2.061/', r'\.hdf$', True, 'ndvi_hdf'),
+    'sm': ('https://hydro1.gesdisc.eosdis.nasa.gov/data/FLDAS/FLDAS_NOAH01_C_GL_M.001/', r'FLDAS.*\.nc$', True, 'fldas_data')
+}
+
+
+def get_target_dir(dataset):
+    """
+    This function finds the download directory of a dataset: its raw data directory when run from a project
+        directory, or ./dataset/<name> otherwise
+    """
+    if os.path.isfile('./cdi_directory_settings.conf'):
+        from libs.config_reader import ConfigParser
+        return ConfigParser().get('raw_data_dirs', DATASETS[dataset][3]).replace("\\", '/')
+    return os.path.join('.', 'dataset', dataset.upper())
+
+
+def main(args):
+    script_start = datetime.now()
+    credentials = {}
+    if args.user is not None:
+        credentials[EARTHDATA_HOST] = (args.user, getpass.getpass("Earthdata password for {}: ".format(args.user)))
+    session = HttpSession(credentials, args.cookies)
+    jobs = []
+    if args.url is not None:
+        jobs.append((args.url, args.pattern, args.recursive, args.target or os.path.join('.', 'dataset')))
+    for dataset in args.datasets:
+        url, pattern, recursive, key = DATASETS[dataset]
+        jobs.append((url, pattern, recursive, args.target or get_target_dir(dataset)))
+    total_failed = 0
+    for url, pattern, recursive, target_dir in jobs:
+        downloader = Downloader(target_dir, workers=args.workers, connections_per_host=args.per_host,
+                                requests_per_second=args.rate, session=session, retries=args.retries)
+        print("Listing {}...".format(url))
+        urls = downloader.list_files(url, pattern, recursive)
+        print("Downloading {} file(s) to {}...".format(len(urls), target_dir))
+        downloaded, failed = downloader.download_all(urls)
+        print("-- {} file(s) complete, {} failed".format(len(downloaded), len(failed)))
+        total_failed += len(failed)
+    print("Script execution: {}".format(datetime.now() - script_start))
+    return 1 if total_failed > 0 else 0
+
+
+if __name__ == '__main__':
+    # set up the command line argument parser
+    parser = ArgumentParser()
+    parser.add_argument("datasets", nargs='*',
+                        help="The dataset(s) to download: {}".format(', '.join(sorted(DATASETS.keys()))))
+    parser.add_argument("--url", default=None,
+                        help="The URL of another directory listing to download from")
+    parser.add_argument("--pattern", default=".*",
+                        help="The regular expression the file names of --url must match. Default is all files")
+    parser.add_argument("--recursive", action="store_true",
+                        help="Also list the sub-directories of --url (one level)")
+    parser.add_argument("-t", "--target", default=None,
+                        help="The download directory. Default is the raw data directory of the dataset")
+    parser.add_argument("-w", "--workers", default=4, type=int,
+                        help="The number of files to download at the same time. Default is 4")
+    parser.add_argument("--per-host", default=2, type=int,
+                        help="The maximum number of concurrent downloads from one host. Default is 2")
+    parser.add_argument("--rate", default=2.0, type=float,
+                        help="The maximum number of new requests per second to one host. Default is 2")
+    parser.add_argument("--retries", default=3, type=int,
+                        help="The number of attempts for each file. Default is 3")
+    parser.add_argument("-u", "--user", default=None,
+                        help="The Earthdata user; the password is asked for. Default is to use ~/.netrc")
+    parser.add_argument("--cookies", default="./.urs_cookies",
+                        help="The file to keep the session cookies in. Default is ./.urs_cookies")
+    arguments = parser.parse_args()
+    if len(arguments.datasets) == 0 and arguments.url is None:
+        parser.error("give one or more datasets, or --url")
+    for name in arguments.datasets:
+        if name not in DATASETS:
+            parser.error("unknown dataset '{}' (choose from {})".format(name, ', '.join(sorted(DATASETS.keys()))))
+    # execute the downloads with the supplied options
+    sys.exit(main(arguments))
@@ -1,5 +1,8 @@
 #!/bin/bash
 
+# Note: STEP_0103 reads the chirps-v2.0.YYYY.MM.tif.gz archives directly (through GDAL /vsigzip/),
+# so extracting and renaming them is only needed for tools that require the cYYYYMM.tif files
+
 # Directory where .gz files are located (default is current directory)
 DIR=~/dataset/CHIRPS
 CURR_DATE=$(date +%Y%m%d)